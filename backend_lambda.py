@@ -2,12 +2,17 @@
 import json
 import boto3
 import base64
+import hashlib
+import io
 import uuid
 from datetime import datetime
-from io import BytesIO
-from PIL import Image
+from email.message import Message
+from botocore.exceptions import ClientError
 import os
-from urllib.parse import parse_qs
+
+# S3 and image helpers shared with the other Lambdas
+from gallery_common import (decode_downscaled, iter_bucket_objects, map_concurrently, presign_get_url,
+                            read_image_properties)
 
 # Initialize AWS clients
 s3_client = boto3.client('s3')
@@ -16,12 +21,18 @@ s3_client = boto3.client('s3')
 PICTURES_BUCKET = os.environ.get('PICTURES_BUCKET', 'your-pictures-bucket')
 ICEBERG_BUCKET = os.environ.get('ICEBERG_BUCKET', 'your-iceberg-bucket')
 ICEBERG_TABLE_PATH = os.environ.get('ICEBERG_TABLE_PATH', 'pictures_table')
+# Rows committed per Iceberg snapshot when backfilling uncatalogued pictures
+ICEBERG_BACKFILL_BATCH = int(os.environ.get('ICEBERG_BACKFILL_BATCH', '500'))
 
 def lambda_handler(event, context):
     """
     Main Lambda handler for the backend API
     """
     
+    # Scheduled EventBridge invocations catalogue pictures whose insert failed
+    if event.get('source') == 'aws.events':
+        return reconcile_iceberg_table()
+    
     # Handle CORS preflight requests
     if event.get('requestContext', {}).get('http', {}).get('method') == 'OPTIONS':
         return cors_response()
@@ -71,9 +82,12 @@ def get_pictures(event):
         date_filter = query_params.get('date')
         name_filter = query_params.get('name')
         
-        # For now, we'll simulate the Iceberg query with S3 metadata
-        # In a real implementation, you would use PyIceberg to query the table
-        pictures = get_pictures_from_s3(date_filter, name_filter)
+        try:
+            pictures = get_pictures_from_iceberg(date_filter, name_filter)
+        except Exception as e:
+            # Keep the gallery usable while the catalog is missing or unreachable
+            print(f"Iceberg query failed, falling back to S3 listing: {str(e)}")
+            pictures = get_pictures_from_s3(date_filter, name_filter)
         
         return cors_response(200, {
             'pictures': pictures,
@@ -84,58 +98,78 @@ def get_pictures(event):
         print(f"Error getting pictures: {str(e)}")
         return error_response(500, f'Error retrieving pictures: {str(e)}')
 
-def get_pictures_from_s3(date_filter=None, name_filter=None):
+def get_pictures_from_iceberg(date_filter=None, name_filter=None):
     """
-    Get pictures metadata from S3 (simulating Iceberg table)
-    In a real implementation, this would query the Iceberg table
+    Get pictures metadata from the Iceberg table
+    The date filter is pushed down to the scan, so only matching data files are read
     """
-    try:
-        # List objects in the pictures bucket
-        response = s3_client.list_objects_v2(Bucket=PICTURES_BUCKET)
-        pictures = []
-        
-        if 'Contents' not in response:
-            return pictures
+    from iceberg_setup import query_pictures
+    
+    pictures = []
+    for record in query_pictures(date_filter, name_filter, limit=None):
+        key = record['picture_jpg']
+        jpg_url = presign_get_url(key, bucket=PICTURES_BUCKET, client=s3_client)
         
-        for obj in response['Contents']:
-            key = obj['Key']
+        taken = record.get('taken_timestamp')
+        pictures.append({
+            'id': record['picture_id'],
+            'picture_name': record['picture_name'],
+            'picture_date': record['picture_date'].isoformat(),
+            'jpg_url': jpg_url,
+            'width': int(record['image_width']) if record.get('image_width') else None,
+            'height': int(record['image_height']) if record.get('image_height') else None,
+            'taken': taken.isoformat() if taken else None
+        })
+    
+    # Sort by date (newest first)
+    pictures.sort(key=lambda x: x['picture_date'], reverse=True)
+    
+    return pictures
+
+def get_pictures_from_s3(date_filter=None, name_filter=None):
+    """
+    Get pictures metadata directly from S3 object metadata
+    Used as a fallback when the Iceberg table cannot be queried
+    """
+    def describe_picture(obj):
+        key = obj['Key']
+        try:
+            metadata_response = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=key)
+            metadata = metadata_response.get('Metadata', {})
             
-            # Skip non-image files
-            if not key.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                continue
+            picture_name = metadata.get('picture_name', key)
+            picture_date = metadata.get('picture_date', obj['LastModified'].strftime('%Y-%m-%d'))
             
-            # Get object metadata
-            try:
-                metadata_response = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=key)
-                metadata = metadata_response.get('Metadata', {})
-                
-                picture_name = metadata.get('picture_name', key)
-                picture_date = metadata.get('picture_date', obj['LastModified'].strftime('%Y-%m-%d'))
-                
-                # Apply filters
-                if date_filter and picture_date != date_filter:
-                    continue
-                
-                if name_filter and name_filter.lower() not in picture_name.lower():
-                    continue
-                
-                # Generate presigned URL for the image
-                jpg_url = s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': PICTURES_BUCKET, 'Key': key},
-                    ExpiresIn=3600  # 1 hour
-                )
-                
-                pictures.append({
-                    'id': key,
-                    'picture_name': picture_name,
-                    'picture_date': picture_date,
-                    'jpg_url': jpg_url
-                })
-                
-            except Exception as e:
-                print(f"Error processing object {key}: {str(e)}")
-                continue
+            # Apply filters
+            if date_filter and picture_date != date_filter:
+                return None
+            
+            if name_filter and name_filter.lower() not in picture_name.lower():
+                return None
+            
+            # Generate presigned URL for the image
+            jpg_url = presign_get_url(key, bucket=PICTURES_BUCKET, client=s3_client)
+            
+            return {
+                'id': key,
+                'picture_name': picture_name,
+                'picture_date': picture_date,
+                'jpg_url': jpg_url
+            }
+            
+        except Exception as e:
+            print(f"Error processing object {key}: {str(e)}")
+            return None
+    
+    try:
+        # List objects in the pictures bucket, skipping non-image files
+        image_objects = [
+            obj for obj in iter_bucket_objects('', bucket=PICTURES_BUCKET, client=s3_client)
+            if obj['Key'].lower().endswith(('.jpg', '.jpeg', '.png', '.gif'))
+        ]
+        
+        # Get object metadata concurrently
+        pictures = [picture for picture in map_concurrently(describe_picture, image_objects) if picture]
         
         # Sort by date (newest first)
         pictures.sort(key=lambda x: x['picture_date'], reverse=True)
@@ -148,7 +182,7 @@ def get_pictures_from_s3(date_filter=None, name_filter=None):
 
 def upload_picture(event):
     """
-    Upload a picture to S3 and update the Iceberg table
+    Upload one or more pictures to S3 and update the Iceberg table
     """
     try:
         # Parse the multipart form data
@@ -172,81 +206,43 @@ def upload_picture(event):
         
         print(f"Body length: {len(body)} bytes")
         
-        # Parse multipart data
+        # Parse multipart data; file contents stay views into the body
+        fields = {}
+        files = []
         try:
-            form_data = parse_multipart_form_data(body, content_type)
-            print(f"Form data keys: {list(form_data.keys())}")
+            for part in iter_multipart_parts(body, content_type):
+                if part['filename'] is not None or part['name'] == 'file':
+                    files.append(part)
+                else:
+                    fields[part['name']] = str(part['data'], 'utf-8', 'ignore')
+            print(f"Form fields: {list(fields)}, files: {len(files)}")
         except Exception as e:
             return error_response(400, f'Failed to parse form data: {str(e)}')
         
-        if 'file' not in form_data:
-            return error_response(400, f'No file provided. Available fields: {list(form_data.keys())}')
-        
-        file_data = form_data['file']
-        picture_name = form_data.get('picture_name', f'picture_{uuid.uuid4().hex}')
-        picture_date = form_data.get('picture_date', datetime.now().strftime('%Y-%m-%d'))
+        if not files:
+            return error_response(400, f'No file provided. Available fields: {list(fields)}')
         
-        print(f"File data length: {len(file_data)} bytes")
-        print(f"Picture name: {picture_name}")
+        picture_date = fields.get('picture_date', datetime.now().strftime('%Y-%m-%d'))
         print(f"Picture date: {picture_date}")
         
-        # Process and validate the image
-        try:
-            image = Image.open(BytesIO(file_data))
-            print(f"Image format: {image.format}, size: {image.size}, mode: {image.mode}")
-            
-            # Convert to RGB if necessary
-            if image.mode in ('RGBA', 'P'):
-                image = image.convert('RGB')
-            
-            # Resize if too large (optional)
-            max_size = (1920, 1080)
-            if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-                image.thumbnail(max_size, Image.Resampling.LANCZOS)
-                print(f"Resized image to: {image.size}")
-            
-            # Save as JPEG
-            output = BytesIO()
-            image.save(output, format='JPEG', quality=85, optimize=True)
-            processed_image_data = output.getvalue()
-            print(f"Processed image size: {len(processed_image_data)} bytes")
-            
-        except Exception as e:
-            return error_response(400, f'Invalid image file: {str(e)}')
+        if len(files) == 1:
+            picture_name = fields.get('picture_name', f'picture_{uuid.uuid4().hex}')
+            status, result = store_uploaded_picture(files[0]['data'], picture_name, picture_date)
+            return cors_response(status, result)
         
-        # Generate unique filename
-        file_extension = '.jpg'
-        unique_filename = f"{uuid.uuid4().hex}{file_extension}"
+        # Several files: each is named after its file name and reported on its own
+        results = []
+        for part in files:
+            picture_name = part['filename'] or f'picture_{uuid.uuid4().hex}'
+            status, result = store_uploaded_picture(part['data'], picture_name, picture_date)
+            results.append(dict(result, status=status, filename=part['filename']))
         
-        # Upload to S3 (or save locally for demo)
-        try:
-            s3_client.put_object(
-                Bucket=PICTURES_BUCKET,
-                Key=unique_filename,
-                Body=processed_image_data,
-                ContentType='image/jpeg',
-                Metadata={
-                    'picture_name': picture_name,
-                    'picture_date': picture_date,
-                    'original_filename': picture_name
-                }
-            )
-            
-            print(f"Successfully uploaded: {unique_filename}")
-            
-            # In a real implementation, you would also insert into the Iceberg table here
-            # insert_into_iceberg_table(unique_filename, picture_name, picture_date)
-            
-            return cors_response(201, {
-                'message': 'Picture uploaded successfully',
-                'id': unique_filename,
-                'picture_name': picture_name,
-                'picture_date': picture_date
-            })
-            
-        except Exception as e:
-            print(f"S3 upload error: {str(e)}")
-            return error_response(500, f'Error uploading to S3: {str(e)}')
+        statuses = [result['status'] for result in results]
+        return cors_response(201 if 201 in statuses else statuses[0], {
+            'pictures': results,
+            'count': len(results),
+            'uploaded': statuses.count(201)
+        })
         
     except Exception as e:
         print(f"Error uploading picture: {str(e)}")
@@ -254,6 +250,115 @@ def upload_picture(event):
         traceback.print_exc()
         return error_response(500, f'Error uploading picture: {str(e)}')
 
+def store_uploaded_picture(file_data, picture_name, picture_date):
+    """
+    Process, store and catalogue one uploaded file
+    
+    file_data may be a memoryview into the request body; it is hashed and
+    decoded in place rather than copied. Returns (status code, response body).
+    """
+    print(f"File data length: {len(file_data)} bytes")
+    print(f"Picture name: {picture_name}")
+    
+    # Stored under the hash of the uploaded bytes, so the same file is
+    # only processed, stored and catalogued once
+    unique_filename = f"{hashlib.sha256(file_data).hexdigest()}.jpg"
+    existing = find_existing_picture(unique_filename)
+    if existing is not None:
+        print(f"Upload matches existing picture {unique_filename}")
+        return 200, {
+            'message': 'Picture already uploaded',
+            'id': unique_filename,
+            'picture_name': existing.get('picture_name', picture_name),
+            'picture_date': existing.get('picture_date', picture_date),
+            'duplicate': True
+        }
+    
+    source = MemoryviewReader(file_data)
+    
+    # Capture time and camera come from the original's EXIF, which the
+    # re-encoded JPEG does not keep
+    properties = read_image_properties(source)
+    
+    # Process and validate the image
+    try:
+        # Decode straight to at most 1920x1080; large JPEGs are never
+        # decoded at full resolution
+        max_size = (1920, 1080)
+        image = decode_downscaled(source, max_size)
+        print(f"Decoded image size: {image.size}, mode: {image.mode}")
+        
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # Save as JPEG
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=85, optimize=True)
+        processed_image_data = output.getvalue()
+        print(f"Processed image size: {len(processed_image_data)} bytes")
+        
+    except Exception as e:
+        return 400, {'error': f'Invalid image file: {str(e)}'}
+    
+    # The object metadata also describes the picture for the catalog backfill
+    metadata = {
+        'picture_name': picture_name,
+        'picture_date': picture_date,
+        'original_filename': picture_name,
+        'image_width': str(image.width),
+        'image_height': str(image.height)
+    }
+    if properties['taken']:
+        metadata['taken_timestamp'] = properties['taken']
+    
+    # Upload to S3 (or save locally for demo)
+    try:
+        s3_client.put_object(
+            Bucket=PICTURES_BUCKET,
+            Key=unique_filename,
+            Body=processed_image_data,
+            ContentType='image/jpeg',
+            Metadata=metadata
+        )
+        
+        print(f"Successfully uploaded: {unique_filename}")
+        
+    except Exception as e:
+        print(f"S3 upload error: {str(e)}")
+        return 500, {'error': f'Error uploading to S3: {str(e)}'}
+    
+    try:
+        insert_into_iceberg_table(
+            unique_filename,
+            picture_name,
+            picture_date,
+            file_size=len(processed_image_data),
+            image_width=image.width,
+            image_height=image.height,
+            taken_timestamp=properties['taken'],
+            camera_model=properties['camera']
+        )
+    except Exception as e:
+        # The object is stored; the scheduled reconcile catalogues it
+        print(f"Error inserting {unique_filename} into Iceberg table: {str(e)}")
+    
+    return 201, {
+        'message': 'Picture uploaded successfully',
+        'id': unique_filename,
+        'picture_name': picture_name,
+        'picture_date': picture_date
+    }
+
+def find_existing_picture(key):
+    """Return the stored metadata of a picture, or None if the key is free"""
+    try:
+        return s3_client.head_object(Bucket=PICTURES_BUCKET, Key=key).get('Metadata', {})
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+            raise
+        return None
+
 def get_picture_by_id(event):
     """
     Get a specific picture by ID
@@ -271,11 +376,7 @@ def get_picture_by_id(event):
             metadata = response.get('Metadata', {})
             
             # Generate presigned URL
-            jpg_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': PICTURES_BUCKET, 'Key': picture_id},
-                ExpiresIn=3600
-            )
+            jpg_url = presign_get_url(picture_id, bucket=PICTURES_BUCKET, client=s3_client)
             
             return cors_response(200, {
                 'id': picture_id,
@@ -291,97 +392,158 @@ def get_picture_by_id(event):
         print(f"Error getting picture by ID: {str(e)}")
         return error_response(500, f'Error retrieving picture: {str(e)}')
 
-def parse_multipart_form_data(body, content_type):
+def multipart_boundary(content_type):
+    """Extract the boundary parameter from a multipart Content-Type header"""
+    header = Message()
+    header['content-type'] = content_type
+    boundary = header.get_param('boundary')
+    if not boundary:
+        raise ValueError('No boundary found in Content-Type')
+    return boundary.encode('latin-1')
+
+def parse_part_headers(raw_headers):
+    """Return (name, filename, content type) from a part's header block"""
+    headers = Message()
+    for line in raw_headers.splitlines():
+        field, _, value = line.partition(':')
+        if value:
+            headers[field.strip()] = value.strip()
+    name = headers.get_param('name', header='content-disposition')
+    if name is None:
+        raise ValueError('Part has no Content-Disposition name')
+    return name, headers.get_filename(), headers.get_content_type()
+
+def iter_multipart_parts(body, content_type):
     """
-    Simple multipart form data parser
-    In production, use a proper library like python-multipart
+    Yield the parts of a multipart/form-data body one at a time
+    
+    Each part is a dict with name, filename (None for plain fields),
+    content_type and data. data is a memoryview into body, so no part is
+    copied however large it is or however many files the request carries.
+    Delimiters are found with bytes.find, which scans in place. Bodies
+    with bare LF line endings are accepted as well as CRLF.
     """
-    try:
-        # Extract boundary
-        boundary = None
-        for part in content_type.split(';'):
-            if 'boundary=' in part:
-                boundary = part.split('boundary=')[1].strip()
-                break
-        
-        if not boundary:
-            raise ValueError('No boundary found in Content-Type')
-        
-        # Convert body to bytes if it's a string
-        if isinstance(body, str):
-            body = body.encode('utf-8')
+    dash_boundary = b'--' + multipart_boundary(content_type)
+    view = memoryview(body)
+    
+    position = body.find(dash_boundary)
+    if position == -1:
+        raise ValueError('Body does not contain the boundary')
+    position += len(dash_boundary)
+    newline = b'\n' if body[position:position + 1] == b'\n' else b'\r\n'
+    delimiter = newline + dash_boundary
+    
+    while True:
+        # Each delimiter is followed by "--" on the last one, else a line break
+        if body[position:position + 2] == b'--':
+            return
+        line_end = body.find(newline, position)
+        if line_end == -1 or body[position:line_end].strip(b' \t'):
+            raise ValueError('Malformed boundary line')
         
-        # Split by boundary
-        boundary_bytes = f'--{boundary}'.encode()
-        parts = body.split(boundary_bytes)
-        form_data = {}
+        headers_start = line_end + len(newline)
+        headers_end = body.find(newline + newline, headers_start - len(newline))
+        if headers_end == -1:
+            raise ValueError('Part headers are not terminated')
+        raw_headers = str(view[headers_start:headers_end], 'utf-8', 'replace')
         
-        for part in parts[1:-1]:  # Skip first empty part and last closing part
-            if not part.strip():
-                continue
-            
-            # Split headers and content
-            header_end = part.find(b'\r\n\r\n')
-            if header_end == -1:
-                # Try with just \n\n
-                header_end = part.find(b'\n\n')
-                if header_end == -1:
-                    continue
-                headers = part[:header_end].decode('utf-8', errors='ignore')
-                content = part[header_end + 2:]
-            else:
-                headers = part[:header_end].decode('utf-8', errors='ignore')
-                content = part[header_end + 4:]
-            
-            # Remove trailing CRLF or LF
-            if content.endswith(b'\r\n'):
-                content = content[:-2]
-            elif content.endswith(b'\n'):
-                content = content[:-1]
-            
-            # Parse Content-Disposition header
-            name = None
-            for line in headers.split('\n'):
-                line = line.strip()
-                if line.startswith('Content-Disposition:'):
-                    for param in line.split(';'):
-                        param = param.strip()
-                        if 'name=' in param:
-                            name = param.split('name=')[1].strip().strip('"').strip("'")
-                            break
-                    break
-            
-            if name:
-                if name == 'file':
-                    form_data[name] = content
-                else:
-                    try:
-                        form_data[name] = content.decode('utf-8')
-                    except UnicodeDecodeError:
-                        form_data[name] = content.decode('utf-8', errors='ignore')
+        data_start = headers_end + 2 * len(newline)
+        data_end = body.find(delimiter, data_start)
+        if data_end == -1:
+            raise ValueError('Part is not terminated by a boundary')
         
-        return form_data
-        
-    except Exception as e:
-        print(f"Error parsing multipart data: {str(e)}")
-        raise ValueError(f"Failed to parse multipart form data: {str(e)}")
+        name, filename, part_type = parse_part_headers(raw_headers)
+        yield {
+            'name': name,
+            'filename': filename,
+            'content_type': part_type,
+            'data': view[data_start:data_end]
+        }
+        position = data_end + len(delimiter)
+
+class MemoryviewReader(io.RawIOBase):
+    """Seekable binary file over a memoryview, so Pillow can read a part in place"""
+    
+    def __init__(self, view):
+        self._view = memoryview(view).cast('B')
+        self._position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+    
+    def tell(self):
+        return self._position
 
-def insert_into_iceberg_table(filename, picture_name, picture_date):
+def insert_into_iceberg_table(filename, picture_name, picture_date, file_size=None,
+                              image_width=None, image_height=None, taken_timestamp=None,
+                              camera_model=None):
     """
     Insert record into Iceberg table
-    This is a placeholder - implement with PyIceberg
     """
-    # Example implementation with PyIceberg:
-    # from pyiceberg.catalog import load_catalog
-    # 
-    # catalog = load_catalog("default")
-    # table = catalog.load_table(f"{ICEBERG_BUCKET}.{ICEBERG_TABLE_PATH}")
-    # 
-    # table.append([{
-    #     'picture_name': picture_name,
-    #     'picture_date': picture_date,
-    #     'picture_jpg': filename
-    # }])
-    
-    pass
+    from iceberg_setup import insert_picture_record
+    
+    insert_picture_record(
+        picture_id=filename,
+        picture_name=picture_name,
+        picture_date=picture_date,
+        picture_jpg=filename,
+        file_size=file_size,
+        image_width=image_width,
+        image_height=image_height,
+        taken_timestamp=taken_timestamp,
+        camera_model=camera_model
+    )
 
+def reconcile_iceberg_table():
+    """
+    Insert Iceberg rows for stored pictures the table is missing
+    
+    Uploads whose insert failed, and pictures stored before the table
+    existed, are described from their S3 metadata and committed in batches.
+    """
+    from iceberg_setup import insert_picture_records, list_picture_ids
+    
+    catalogued = list_picture_ids()
+    missing = [
+        obj for obj in iter_bucket_objects('', bucket=PICTURES_BUCKET, client=s3_client)
+        if obj['Key'].lower().endswith('.jpg') and obj['Key'] not in catalogued
+    ]
+    
+    def describe_picture(obj):
+        key = obj['Key']
+        try:
+            metadata = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=key).get('Metadata', {})
+        except Exception as e:
+            print(f"Error reading metadata of {key}: {str(e)}")
+            return None
+        return {
+            'picture_id': key,
+            'picture_name': metadata.get('picture_name', key),
+            'picture_date': metadata.get('picture_date', obj['LastModified'].strftime('%Y-%m-%d')),
+            'picture_jpg': key,
+            'file_size': obj.get('Size'),
+            'image_width': metadata.get('image_width'),
+            'image_height': metadata.get('image_height'),
+            'taken_timestamp': metadata.get('taken_timestamp')
+        }
+    
+    records = [record for record in map_concurrently(describe_picture, missing) if record]
+    for start in range(0, len(records), ICEBERG_BACKFILL_BATCH):
+        insert_picture_records(records[start:start + ICEBERG_BACKFILL_BATCH])
+    
+    print(f"Catalogued {len(records)} of {len(missing)} missing pictures")
+    return cors_response(200, {'catalogued': len(records), 'missing': len(missing)})
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for the per-entry ZIP compression policy
+
+Builds a gallery-like corpus (camera JPEGs, PNG screenshots, GIFs, plus a
+few uncompressed BMPs and JSON sidecars), archives it once with DEFLATE on
+every entry and once with the content-aware policy, and prints the time and
+size of each run.
+
+Usage: python benchmark_archive.py [--pictures N] [--rounds N]
+"""
+
+import argparse
+import io
+import json
+import random
+import time
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+def photo(rng, size):
+    """A noisy gradient, which JPEG-compresses like a real photograph"""
+    image = Image.effect_noise(size, rng.randint(20, 60)).convert('RGB')
+    gradient = Image.linear_gradient('L').resize(size)
+    tint = Image.new('RGB', size, tuple(rng.randint(0, 255) for _ in range(3)))
+    return Image.composite(image, tint, gradient)
+
+def screenshot(rng, size):
+    """Flat blocks of colour and text, as in a UI screenshot"""
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle([x, y, x + rng.randint(20, 200), y + rng.randint(10, 60)],
+                       fill=tuple(rng.randint(0, 255) for _ in range(3)))
+        draw.text((x, y), 'Picture Gallery', fill='black')
+    return image
+
+def encode(image, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+def build_corpus(pictures, seed=0):
+    """Return (name, content type, body) tuples mixed like a typical gallery"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(pictures):
+        kind = rng.random()
+        if kind < 0.6:
+            body = encode(photo(rng, (1600, 1200)), 'JPEG', quality=85)
+            corpus.append((f'photo{i}.jpg', 'image/jpeg', body))
+        elif kind < 0.8:
+            body = encode(screenshot(rng, (1280, 800)), 'PNG')
+            corpus.append((f'screen{i}.png', 'image/png', body))
+        elif kind < 0.9:
+            body = encode(screenshot(rng, (480, 320)).convert('P'), 'GIF')
+            corpus.append((f'clip{i}.gif', 'image/gif', body))
+        else:
+            body = encode(screenshot(rng, (800, 600)), 'BMP')
+            corpus.append((f'scan{i}.bmp', 'image/bmp', body))
+        sidecar = json.dumps({'name': corpus[-1][0], 'tags': ['holiday', 'family'] * 20}).encode()
+        corpus.append((f'{corpus[-1][0]}.json', 'application/json', sidecar))
+    return corpus
+
+def run(corpus, rounds, policy):
+    """Archive the corpus, returning the best time and the archive size"""
+    s3 = FakeS3Client()
+    entries = []
+    for name, content_type, body in corpus:
+        key = f'pictures/{name}'
+        s3.add_object(key, body, content_type=content_type)
+        entries.append((name, key))
+
+    best = None
+    with patch.object(unified_lambda, 's3_client', s3), \
+            patch.object(unified_lambda, 'choose_compression', policy):
+        for _ in range(rounds):
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            unified_lambda.write_zip_entries(buffer, entries)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, buffer.tell()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pictures', type=int, default=40)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.pictures)
+    raw_size = sum(len(body) for _, _, body in corpus)
+    print(f"Corpus: {len(corpus)} entries, {raw_size / 1024 / 1024:.1f} MB")
+
+    policies = [
+        ('deflate every entry', lambda content_type, sample: unified_lambda.zipfile.ZIP_DEFLATED),
+        ('content-aware', unified_lambda.choose_compression),
+    ]
+    print(f"{'policy':<22}{'time (s)':>10}{'size (MB)':>12}{'ratio':>8}")
+    for label, policy in policies:
+        elapsed, size = run(corpus, args.rounds, policy)
+        print(f"{label:<22}{elapsed:>10.3f}{size / 1024 / 1024:>12.2f}{size / raw_size:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for reduced-resolution decoding when downscaling uploads
+
+Writes a sample corpus of phone-sized JPEGs (12 and 24 MP, some with an
+EXIF rotation), then fits every picture into 1920x1080 two ways, each in a
+fresh process so peak memory can be measured:
+
+  full     - decode at full resolution, apply the orientation, resample
+  reduced  - decode_downscaled: JPEG DCT-domain reduction, then resample
+
+Peak memory is the growth of the worker's resident high-water mark while
+decoding, on top of the interpreter and the compressed corpus (Linux only).
+
+Usage: python benchmark_downscale.py [--pictures N]
+"""
+
+import argparse
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageOps
+
+from benchmark_archive import photo
+
+BOX = (1920, 1080)
+SIZES = [(4000, 3000), (5664, 4248)]
+
+def build_corpus(directory, pictures, seed=0):
+    """Write a mix of 12 and 24 MP camera JPEGs into directory"""
+    rng = random.Random(seed)
+    for i in range(pictures):
+        image = photo(rng, SIZES[i % len(SIZES)])
+        exif = Image.Exif()
+        exif[0x0112] = rng.choice([1, 1, 6, 8])
+        image.save(os.path.join(directory, f'photo{i}.jpg'), format='JPEG', quality=90, exif=exif)
+
+def decode_full(data):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image.thumbnail(BOX, Image.Resampling.LANCZOS)
+    return image
+
+def peak_rss_mb():
+    """High-water mark of this process's resident memory (Linux)"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def worker(mode, directory):
+    """Downscale every corpus picture and print the time and memory used"""
+    if mode == 'reduced':
+        from gallery_common import decode_downscaled
+        decode = lambda data: decode_downscaled(data, BOX)
+    else:
+        decode = decode_full
+
+    files = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    blobs = [open(path, 'rb').read() for path in files]
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    for data in blobs:
+        decode(data).convert('RGB').save(io.BytesIO(), format='JPEG', quality=85)
+    print(time.perf_counter() - start, peak_rss_mb() - baseline)
+
+def measure(mode, directory):
+    """Run a worker process, returning (seconds, peak memory growth in MB)"""
+    output = subprocess.run([sys.executable, __file__, '--worker', mode, directory],
+                            stdout=subprocess.PIPE, text=True, check=True).stdout
+    elapsed, peak = output.split()
+    return float(elapsed), float(peak)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pictures', type=int, default=8)
+    parser.add_argument('--worker', nargs=2, metavar=('MODE', 'DIRECTORY'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        build_corpus(directory, args.pictures)
+        print(f"Corpus: {args.pictures} JPEGs at {' and '.join(f'{w}x{h}' for w, h in SIZES)}")
+        print(f"{'decode':<10}{'time (s)':>10}{'per picture (ms)':>18}{'peak memory (MB)':>18}")
+        for mode in ('full', 'reduced'):
+            elapsed, peak = measure(mode, directory)
+            print(f"{mode:<10}{elapsed:>10.3f}{elapsed / args.pictures * 1000:>18.1f}{peak:>18.1f}")
+
+if __name__ == "__main__":
+    main()
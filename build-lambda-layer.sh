@@ -17,7 +17,9 @@ mkdir -p $LAYER_DIR/python
 
 # Install dependencies
 echo "📦 Installing Python dependencies..."
-pip install -r lambda_requirements.txt -t $LAYER_DIR/python/
+# Binary wheels for the Lambda runtime, whatever platform builds the layer
+pip install -r lambda_requirements.txt -t $LAYER_DIR/python/ \
+    --platform manylinux2014_x86_64 --python-version 3.12 --only-binary=:all:
 
 # Create zip file
 echo "📦 Creating layer zip file..."
@@ -173,6 +173,8 @@ class DemoRequestHandler(BaseHTTPRequestHandler):
         headers_dict = {}
         for header_name, header_value in self.headers.items():
             headers_dict[header_name.lower()] = header_value
+        # Bodies are rewritten below, so ask for them uncompressed
+        headers_dict.pop('accept-encoding', None)
         
         event = {
             'requestContext': {
@@ -41,6 +41,11 @@ fi
 echo "✅ Prerequisites check passed"
 echo ""
 
+# Build the dependency layer (Pillow for picture derivatives)
+echo "📦 Building Lambda layer..."
+./build-lambda-layer.sh
+echo ""
+
 # Navigate to terraform directory
 cd terraform
 
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""
+In-memory S3 client used by the unit tests.
+
+Implements the subset of the boto3 S3 client API that the Lambda functions
+use, and counts calls per operation so tests can assert on round trips.
+Also builds the function URL events the tests send to the handlers.
+"""
+
+import hashlib
+import io
+import json
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+
+def client_error(code, operation, message='', status=None):
+    """Build a botocore ClientError like the real client raises"""
+    return ClientError(
+        {
+            'Error': {'Code': code, 'Message': message or code},
+            'ResponseMetadata': {'HTTPStatusCode': status or 400}
+        },
+        operation
+    )
+
+
+def api_event(method, path, body=None, query=None):
+    """Build a Lambda function URL event"""
+    event = {
+        'requestContext': {'http': {'method': method}},
+        'rawPath': path,
+        'isBase64Encoded': False
+    }
+    if body is not None:
+        event['body'] = json.dumps(body)
+    if query is not None:
+        event['queryStringParameters'] = query
+    return event
+
+
+class FakeS3Client:
+    """Dictionary-backed stand-in for boto3.client('s3')"""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = Counter()
+        self.protected_keys = set()
+        self.uploads = {}
+        self.min_part_size = 5 * 1024 * 1024
+
+    # Helpers for tests
+
+    def add_object(self, key, body=b'', metadata=None, content_type='image/jpeg',
+                   last_modified=None):
+        """Seed an object without counting it as an API call"""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.objects[key] = {
+            'Body': bytes(body),
+            'Metadata': dict(metadata or {}),
+            'ContentType': content_type,
+            'LastModified': last_modified or datetime.now(timezone.utc),
+            'ETag': '"%s"' % hashlib.md5(body).hexdigest()
+        }
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    # S3 API
+
+    def put_object(self, Bucket, Key, Body=b'', ContentType='binary/octet-stream',
+                   Metadata=None, **kwargs):
+        self.calls['put_object'] += 1
+        current = self.objects.get(Key)
+        if 'IfMatch' in kwargs:
+            if current is None:
+                raise client_error('NoSuchKey', 'PutObject', status=404)
+            if current['ETag'] != kwargs['IfMatch']:
+                raise client_error('PreconditionFailed', 'PutObject', status=412)
+        if kwargs.get('IfNoneMatch') == '*' and current is not None:
+            raise client_error('PreconditionFailed', 'PutObject', status=412)
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        self.add_object(Key, Body, Metadata, ContentType)
+        return {'ETag': self.objects[Key]['ETag']}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.calls['get_object'] += 1
+        obj = self._require(Key, 'GetObject')
+        if 'IfMatch' in kwargs and obj['ETag'] != kwargs['IfMatch']:
+            raise client_error('PreconditionFailed', 'GetObject', status=412)
+        return {
+            'Body': StreamingBody(io.BytesIO(obj['Body']), len(obj['Body'])),
+            'ContentLength': len(obj['Body']),
+            'ContentType': obj['ContentType'],
+            'Metadata': dict(obj['Metadata']),
+            'ETag': obj['ETag'],
+            'LastModified': obj['LastModified']
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.calls['head_object'] += 1
+        obj = self._require(Key, 'HeadObject')
+        return {
+            'ContentLength': len(obj['Body']),
+            'ContentType': obj['ContentType'],
+            'Metadata': dict(obj['Metadata']),
+            'ETag': obj['ETag'],
+            'LastModified': obj['LastModified']
+        }
+
+    def copy_object(self, Bucket, Key, CopySource, Metadata=None,
+                    MetadataDirective='COPY', ContentType=None, **kwargs):
+        self.calls['copy_object'] += 1
+        source = self._require(CopySource['Key'], 'CopyObject')
+        if MetadataDirective == 'REPLACE':
+            metadata = Metadata or {}
+            content_type = ContentType or 'binary/octet-stream'
+        else:
+            metadata = source['Metadata']
+            content_type = source['ContentType']
+        self.add_object(Key, source['Body'], metadata, content_type)
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.calls['delete_object'] += 1
+        self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls['delete_objects'] += 1
+        if len(Delete['Objects']) > 1000:
+            raise client_error('MalformedXML', 'DeleteObjects')
+        deleted = []
+        errors = []
+        for item in Delete['Objects']:
+            if item['Key'] in self.protected_keys:
+                errors.append({'Key': item['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+                continue
+            self.objects.pop(item['Key'], None)
+            deleted.append({'Key': item['Key']})
+        response = {'Errors': errors} if errors else {}
+        if not Delete.get('Quiet'):
+            response['Deleted'] = deleted
+        return response
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, StartAfter=None,
+                        ContinuationToken=None, **kwargs):
+        self.calls['list_objects_v2'] += 1
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        start_after = ContinuationToken or StartAfter
+        if start_after:
+            keys = [key for key in keys if key > start_after]
+        page = keys[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > MaxKeys
+        }
+        if page:
+            response['Contents'] = [
+                {
+                    'Key': key,
+                    'Size': len(self.objects[key]['Body']),
+                    'ETag': self.objects[key]['ETag'],
+                    'LastModified': self.objects[key]['LastModified']
+                }
+                for key in page
+            ]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def create_multipart_upload(self, Bucket, Key, ContentType='binary/octet-stream',
+                                Metadata=None, **kwargs):
+        self.calls['create_multipart_upload'] += 1
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {
+            'Key': Key,
+            'ContentType': ContentType,
+            'Metadata': dict(Metadata or {}),
+            'Parts': {},
+            'Initiated': datetime.now(timezone.utc)
+        }
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body=b'', **kwargs):
+        self.calls['upload_part'] += 1
+        upload = self._require_upload(UploadId, 'UploadPart')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        etag = '"%s"' % hashlib.md5(Body).hexdigest()
+        upload['Parts'][PartNumber] = {'Body': bytes(Body), 'ETag': etag}
+        return {'ETag': etag}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange=None, **kwargs):
+        self.calls['upload_part_copy'] += 1
+        upload = self._require_upload(UploadId, 'UploadPartCopy')
+        body = self._require(CopySource['Key'], 'UploadPartCopy')['Body']
+        if CopySourceRange:
+            start, end = (int(value) for value in CopySourceRange[len('bytes='):].split('-'))
+            body = body[start:end + 1]
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        upload['Parts'][PartNumber] = {'Body': bytes(body), 'ETag': etag}
+        return {'CopyPartResult': {'ETag': etag}}
+
+    def list_parts(self, Bucket, Key, UploadId, MaxParts=1000, PartNumberMarker=0, **kwargs):
+        self.calls['list_parts'] += 1
+        upload = self._require_upload(UploadId, 'ListParts')
+        numbers = sorted(number for number in upload['Parts'] if number > PartNumberMarker)
+        page = numbers[:MaxParts]
+        response = {
+            'Parts': [
+                {
+                    'PartNumber': number,
+                    'ETag': upload['Parts'][number]['ETag'],
+                    'Size': len(upload['Parts'][number]['Body'])
+                }
+                for number in page
+            ],
+            'IsTruncated': len(numbers) > MaxParts
+        }
+        if response['IsTruncated']:
+            response['NextPartNumberMarker'] = page[-1]
+        return response
+
+    def list_multipart_uploads(self, Bucket, Prefix='', MaxUploads=1000, KeyMarker=None,
+                               UploadIdMarker=None, **kwargs):
+        self.calls['list_multipart_uploads'] += 1
+        uploads = sorted(
+            (upload['Key'], upload_id, upload['Initiated'])
+            for upload_id, upload in self.uploads.items()
+            if upload['Key'].startswith(Prefix)
+        )
+        if KeyMarker:
+            uploads = [u for u in uploads if (u[0], u[1]) > (KeyMarker, UploadIdMarker or '')]
+        page = uploads[:MaxUploads]
+        response = {
+            'Uploads': [{'Key': key, 'UploadId': upload_id, 'Initiated': initiated}
+                        for key, upload_id, initiated in page],
+            'IsTruncated': len(uploads) > MaxUploads
+        }
+        if response['IsTruncated']:
+            response['NextKeyMarker'], response['NextUploadIdMarker'] = page[-1][0], page[-1][1]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self.calls['complete_multipart_upload'] += 1
+        upload = self._require_upload(UploadId, 'CompleteMultipartUpload')
+        parts = MultipartUpload['Parts']
+        numbers = [part['PartNumber'] for part in parts]
+        if numbers != sorted(set(numbers)):
+            raise client_error('InvalidPartOrder', 'CompleteMultipartUpload')
+        body = bytearray()
+        for index, part in enumerate(parts):
+            stored = upload['Parts'].get(part['PartNumber'])
+            if stored is None or stored['ETag'] != part['ETag']:
+                raise client_error('InvalidPart', 'CompleteMultipartUpload')
+            if index < len(parts) - 1 and len(stored['Body']) < self.min_part_size:
+                raise client_error('EntityTooSmall', 'CompleteMultipartUpload')
+            body += stored['Body']
+        del self.uploads[UploadId]
+        self.add_object(Key, bytes(body), upload['Metadata'], upload['ContentType'])
+        return {'Key': Key, 'ETag': self.objects[Key]['ETag']}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.calls['abort_multipart_upload'] += 1
+        self._require_upload(UploadId, 'AbortMultipartUpload')
+        del self.uploads[UploadId]
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        url = f"https://fake-s3.local/{Params['Key']}?expires={ExpiresIn}"
+        if 'PartNumber' in Params:
+            url += f"&uploadId={Params['UploadId']}&partNumber={Params['PartNumber']}"
+        return url
+
+    def _require_upload(self, upload_id, operation):
+        if upload_id not in self.uploads:
+            raise client_error('NoSuchUpload', operation, status=404)
+        return self.uploads[upload_id]
+
+    def _require(self, key, operation):
+        if key not in self.objects:
+            raise client_error('NoSuchKey' if operation != 'HeadObject' else '404',
+                               operation, status=404)
+        return self.objects[key]
@@ -1,7 +1,14 @@
 import json
-import base64
 import os
 
+from static_assets import build_static_asset, static_asset_response
+
+# Extra CORS headers sent with every frontend page
+FRONTEND_CORS_HEADERS = {
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+}
+
 def lambda_handler(event, context):
     """
     Lambda function to serve the frontend HTML page
@@ -11,11 +18,11 @@ def lambda_handler(event, context):
     path = event.get('rawPath', '/')
     
     if path == '/' or path == '/index.html':
-        return serve_html()
+        return serve_html(event)
     elif path == '/style.css':
-        return serve_css()
+        return serve_css(event)
     elif path == '/script.js':
-        return serve_js()
+        return serve_js(event)
     else:
         return {
             'statusCode': 404,
@@ -28,8 +35,8 @@ def lambda_handler(event, context):
             'body': '<h1>404 - Page Not Found</h1>'
         }
 
-def serve_html():
-    """Serve the main HTML page"""
+def html_source():
+    """Source of the main HTML page"""
     html_content = """
     <!DOCTYPE html>
     <html lang="en">
@@ -71,19 +78,10 @@ def serve_html():
     </html>
     """
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/html',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization'
-        },
-        'body': html_content
-    }
+    return html_content
 
-def serve_css():
-    """Serve the CSS styles"""
+def css_source():
+    """Source of the CSS styles"""
     css_content = """
     * {
         margin: 0;
@@ -267,25 +265,16 @@ def serve_css():
     }
     """
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/css',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization'
-        },
-        'body': css_content
-    }
+    return css_content
 
-def serve_js():
-    """Serve the JavaScript code"""
+def js_source():
+    """Source of the JavaScript code"""
     # Get backend URL from environment variable
     backend_url = os.environ.get('BACKEND_URL', 'https://your-backend-lambda-url.lambda-url.region.on.aws')
     
-    js_content = f"""
+    js_content = """
     // Configuration - Backend Lambda function URL from environment
-    const API_BASE_URL = '{backend_url}';
+    const API_BASE_URL = __BACKEND_URL__;
     
     // Load pictures when page loads
     document.addEventListener('DOMContentLoaded', function() {
@@ -444,13 +433,24 @@ def serve_js():
     }
     """
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/javascript',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization'
-        },
-        'body': js_content
-    }
+    # Not an f-string: the script is full of braces and template literals
+    return js_content.replace('__BACKEND_URL__', json.dumps(backend_url))
+
+def serve_html(event=None):
+    """Serve the main HTML page"""
+    return static_asset_response(_static_assets['/'], event, FRONTEND_CORS_HEADERS)
+
+def serve_css(event=None):
+    """Serve the CSS styles"""
+    return static_asset_response(_static_assets['/style.css'], event, FRONTEND_CORS_HEADERS)
+
+def serve_js(event=None):
+    """Serve the JavaScript code"""
+    return static_asset_response(_static_assets['/script.js'], event, FRONTEND_CORS_HEADERS)
+
+# Rendered and compressed once per container
+_static_assets = {
+    '/': build_static_asset(html_source(), 'text/html'),
+    '/style.css': build_static_asset(css_source(), 'text/css'),
+    '/script.js': build_static_asset(js_source(), 'application/javascript')
+}
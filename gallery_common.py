@@ -0,0 +1,328 @@
+"""
+S3 and image helpers shared by the Lambda handlers
+
+Nothing here creates an AWS client or does work at import: helpers that
+talk to S3 take the client and bucket from their caller, so each handler
+module keeps its own client and configuration.
+"""
+
+import hashlib
+import hmac
+import io
+import os
+import queue
+import re
+import string
+import threading
+import time
+import boto3
+from botocore.client import BaseClient
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+# Configuration
+LIST_CONCURRENCY = int(os.environ.get('LIST_CONCURRENCY', '8'))
+S3_CONCURRENCY = int(os.environ.get('S3_CONCURRENCY', '16'))
+PRESIGN_WINDOW = int(os.environ.get('PRESIGN_WINDOW', '3600'))
+LIST_MAX_PARTITIONS = int(os.environ.get('LIST_MAX_PARTITIONS', '32'))
+LIST_PARTITION_CHARS = string.digits + string.ascii_lowercase
+# Manifest fields read from the image header at registration
+IMAGE_HEADER_FIELDS = ('width', 'height', 'orientation', 'taken', 'camera')
+# EXIF tags, in IFD0 unless noted
+EXIF_MAKE = 0x010F
+EXIF_MODEL = 0x0110
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003  # Exif IFD
+EXIF_OFFSET_TIME_ORIGINAL = 0x9011  # Exif IFD
+
+# Credentials and derived SigV4 signing key for presigned URLs
+_signing_credentials = None
+_signing_key_cache = {}
+
+# Presigned URLs
+#
+# generate_presigned_url signs every URL from "now", so the same picture gets
+# a new URL on every page load and the browser can never reuse its cached
+# copy. Instead, URLs are signed as of the start of a fixed time window and
+# stay byte-identical for the whole window. The SigV4 signing key only
+# depends on the credentials, date, region and service, so it is derived once
+# and reused for every object. Clients that are not real boto3 clients (the
+# test doubles and the local demo) or that use a custom endpoint fall back to
+# generate_presigned_url.
+
+def get_signing_credentials():
+    """Get frozen AWS credentials for signing, or None if there are none"""
+    global _signing_credentials
+    if _signing_credentials is None:
+        _signing_credentials = boto3.session.Session().get_credentials() or False
+    # Refreshable credentials rotate themselves when frozen
+    return _signing_credentials.get_frozen_credentials() if _signing_credentials else None
+
+def get_signing_key(secret_key, date_stamp, region):
+    """Derive the SigV4 signing key for S3, reusing it across objects"""
+    cache_key = (secret_key, date_stamp, region)
+    signing_key = _signing_key_cache.get(cache_key)
+    if signing_key is None:
+        signing_key = ('AWS4' + secret_key).encode('utf-8')
+        for part in (date_stamp, region, 's3', 'aws4_request'):
+            signing_key = hmac.new(signing_key, part.encode('utf-8'), hashlib.sha256).digest()
+        # Keys for past dates are never used again
+        _signing_key_cache.clear()
+        _signing_key_cache[cache_key] = signing_key
+    return signing_key
+
+def presign_get_url(key, bucket, client, now=None):
+    """Get a presigned GET URL for an object that is stable within a time window"""
+    # The window start is the signing time, so every URL signed in the same
+    # window is identical; it stays valid for at least one more window
+    window_start = int((now or time.time()) // PRESIGN_WINDOW) * PRESIGN_WINDOW
+    expires = min(2 * PRESIGN_WINDOW, 604800)
+    
+    credentials = None
+    if isinstance(client, BaseClient) and client.meta.endpoint_url.endswith('.amazonaws.com'):
+        credentials = get_signing_credentials()
+    if credentials is None:
+        return client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket, 'Key': key},
+            ExpiresIn=expires
+        )
+    
+    region = client.meta.region_name or 'us-east-1'
+    signed_at = datetime.fromtimestamp(window_start, timezone.utc)
+    amz_date = signed_at.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = signed_at.strftime('%Y%m%d')
+    scope = f"{date_stamp}/{region}/s3/aws4_request"
+    
+    if '.' in bucket:
+        # Dotted bucket names break virtual-hosted TLS, so use path-style
+        host = f"s3.{region}.amazonaws.com"
+        path = f"/{bucket}/{quote(key, safe='/~')}"
+    else:
+        host = f"{bucket}.s3.{region}.amazonaws.com"
+        path = f"/{quote(key, safe='/~')}"
+    
+    params = {
+        'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+        'X-Amz-Credential': f"{credentials.access_key}/{scope}",
+        'X-Amz-Date': amz_date,
+        'X-Amz-Expires': str(expires),
+        'X-Amz-SignedHeaders': 'host',
+        # S3 returns this header, so browsers keep the image for the URL's lifetime
+        'response-cache-control': f"private, max-age={expires}"
+    }
+    if credentials.token:
+        params['X-Amz-Security-Token'] = credentials.token
+    query = '&'.join(
+        f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}"
+        for name, value in sorted(params.items())
+    )
+    
+    canonical_request = f"GET\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+    signing_key = get_signing_key(credentials.secret_key, date_stamp, region)
+    signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    
+    return f"https://{host}{path}?{query}&X-Amz-Signature={signature}"
+
+# Concurrent S3 requests
+#
+# Per-object requests such as head_object are latency bound, so they are
+# issued from a bounded thread pool. boto3 clients are thread safe.
+
+def map_concurrently(func, items, concurrency=None):
+    """Apply func to every item on a bounded thread pool, keeping input order"""
+    items = list(items)
+    workers = min(concurrency or S3_CONCURRENCY, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+# Bucket listing engine
+#
+# list_objects_v2 returns at most 1000 keys per call. The first page is read
+# directly, which is all a small gallery needs. If it is truncated, the rest
+# of the keyspace is split into contiguous (start, end] key ranges that are
+# listed concurrently, each following its own continuation tokens. Upload keys
+# start with a YYYYMMDD timestamp, so ranges follow month (or coarser date)
+# boundaries; other key layouts are split on their leading character.
+
+def listing_partitions(prefix, after_key):
+    """Get range boundaries that split the keyspace after after_key"""
+    tail = after_key[len(prefix):]
+    match = re.match(r'(\d{4})(\d{2})\d{2}_', tail)
+    if not match:
+        return [prefix + char for char in LIST_PARTITION_CHARS if prefix + char > after_key]
+    
+    year, month = int(match.group(1)), int(match.group(2))
+    now = datetime.now(timezone.utc)
+    months = max(1, (now.year - year) * 12 + now.month - month + 1)
+    # Widen the partitions for old galleries so the fan-out stays bounded
+    step = -(-months // LIST_MAX_PARTITIONS)
+    
+    boundaries = []
+    for offset in range(step, months + step, step):
+        years, month_index = divmod(month - 1 + offset, 12)
+        boundaries.append(f"{prefix}{year + years:04d}{month_index + 1:02d}")
+    return boundaries
+
+def list_key_range(client, bucket, prefix, start_after, end_key, stop):
+    """Yield pages of objects with start_after < key <= end_key"""
+    params = {'Bucket': bucket, 'Prefix': prefix, 'StartAfter': start_after}
+    while not stop.is_set():
+        response = client.list_objects_v2(**params)
+        contents = response.get('Contents', [])
+        in_range = [obj for obj in contents if end_key is None or obj['Key'] <= end_key]
+        if in_range:
+            yield in_range
+        if len(in_range) < len(contents) or not response.get('IsTruncated'):
+            return
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+def iter_bucket_objects(prefix, bucket, client):
+    """Yield every object under a prefix, listing key ranges in parallel when needed"""
+    response = client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    contents = response.get('Contents', [])
+    yield from contents
+    if not response.get('IsTruncated') or not contents:
+        return
+    
+    last_key = contents[-1]['Key']
+    boundaries = listing_partitions(prefix, last_key)
+    ranges = list(zip([last_key] + boundaries, boundaries + [None]))
+    print(f"Listing {prefix} in {len(ranges)} parallel key ranges after {last_key}")
+    
+    pages = queue.Queue()
+    stop = threading.Event()
+    
+    def list_range(start_after, end_key):
+        try:
+            for page in list_key_range(client, bucket, prefix, start_after, end_key, stop):
+                pages.put(page)
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(None)
+    
+    executor = ThreadPoolExecutor(max_workers=min(LIST_CONCURRENCY, len(ranges)))
+    try:
+        for start_after, end_key in ranges:
+            executor.submit(list_range, start_after, end_key)
+        
+        remaining = len(ranges)
+        while remaining:
+            page = pages.get()
+            if page is None:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # Lets workers finish early if the caller stops iterating
+        stop.set()
+        executor.shutdown(wait=True)
+
+# Image properties
+#
+# Dimensions, capture time, camera model and orientation are read once, when
+# a picture is registered, and kept in its manifest entry, so listings can
+# sort by date taken and lay out cards by aspect ratio without touching the
+# image. Only the header is parsed: Pillow reads the size from the frame
+# header and EXIF from its APP1 segment without decoding any pixels.
+
+def exif_text(value):
+    """An EXIF ASCII value as a clean string, or None"""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    if not isinstance(value, str):
+        return None
+    return value.strip('\x00 ') or None
+
+def parse_exif_datetime(value, offset=None):
+    """Convert an EXIF 'YYYY:MM:DD HH:MM:SS' timestamp to ISO 8601, or None"""
+    value = exif_text(value)
+    if not value:
+        return None
+    try:
+        taken = datetime.strptime(value[:19], '%Y:%m:%d %H:%M:%S').isoformat()
+    except ValueError:
+        return None
+    offset = exif_text(offset)
+    if offset and re.fullmatch(r'[+-]\d\d:\d\d', offset):
+        taken += offset
+    return taken
+
+def read_image_properties(image_bytes):
+    """Read a picture's display size and EXIF details from its header"""
+    properties = dict.fromkeys(IMAGE_HEADER_FIELDS)
+    try:
+        image = open_image(image_bytes)
+        exif = image.getexif()
+        details = exif.get_ifd(EXIF_IFD)
+    except Exception as e:
+        print(f"Could not read image header: {e}")
+        return properties
+    
+    orientation = exif.get(EXIF_ORIENTATION)
+    orientation = orientation if orientation in range(1, 9) else 1
+    width, height = image.size
+    # Orientations 5-8 turn the picture on its side when it is displayed
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    
+    make, model = exif_text(exif.get(EXIF_MAKE)), exif_text(exif.get(EXIF_MODEL))
+    if make and model and not model.lower().startswith(make.split()[0].lower()):
+        model = f"{make} {model}"
+    
+    properties.update(
+        width=width,
+        height=height,
+        orientation=orientation,
+        taken=parse_exif_datetime(details.get(EXIF_DATETIME_ORIGINAL), details.get(EXIF_OFFSET_TIME_ORIGINAL))
+        or parse_exif_datetime(exif.get(EXIF_DATETIME)),
+        camera=model
+    )
+    return properties
+
+# Image decoding
+#
+# Pillow is imported lazily, so handlers that never touch pixels do not
+# pay for it and uploads still succeed where it is not installed.
+
+def open_image(image_bytes):
+    """Open image bytes, or a seekable binary file, with Pillow without decoding it"""
+    from PIL import Image
+    
+    if hasattr(image_bytes, 'read'):
+        image_bytes.seek(0)
+        return Image.open(image_bytes)
+    return Image.open(io.BytesIO(image_bytes))
+
+def decode_downscaled(image_bytes, box):
+    """Decode an image scaled to fit within box, never enlarging it"""
+    from PIL import Image, ImageOps
+    
+    image = open_image(image_bytes)
+    # Orientation is applied after scaling, so fit the box as the pixels are stored
+    if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+        box = (box[1], box[0])
+    scale = min(box[0] / image.width, box[1] / image.height, 1)
+    target = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    
+    if scale < 1:
+        # JPEGs decode straight to 1/2, 1/4 or 1/8 size in the DCT domain,
+        # so the full-resolution pixels are never allocated
+        image.draft(None, target)
+        # Other formats are box-reduced by an integer factor before resampling
+        image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return ImageOps.exif_transpose(image)
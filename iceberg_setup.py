@@ -13,12 +13,20 @@ from pyiceberg.types import (
     TimestampType
 )
 import os
-from datetime import datetime
+from datetime import date, datetime
 
 # Configuration
 ICEBERG_BUCKET = os.environ.get('ICEBERG_BUCKET', 'your-iceberg-bucket')
 ICEBERG_TABLE_PATH = os.environ.get('ICEBERG_TABLE_PATH', 'pictures_table')
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+COMMIT_RETRIES = int(os.environ.get('ICEBERG_COMMIT_RETRIES', '3'))
+
+# Columns returned to the gallery API; the rest stay unread on scans
+LISTING_FIELDS = ('picture_id', 'picture_name', 'picture_date', 'picture_jpg',
+                  'image_width', 'image_height', 'taken_timestamp')
+
+# Table handle reused across warm Lambda invocations
+_pictures_table = None
 
 def create_iceberg_catalog():
     """
@@ -32,6 +40,21 @@ def create_iceberg_catalog():
     
     return load_catalog('glue', **catalog_config)
 
+def load_pictures_table():
+    """
+    Load the pictures table, reusing the catalog connection when warm
+    """
+    global _pictures_table
+    
+    if _pictures_table is None:
+        catalog = create_iceberg_catalog()
+        _pictures_table = catalog.load_table(f"default.{ICEBERG_TABLE_PATH}")
+    else:
+        # Pick up snapshots committed by other writers
+        _pictures_table.refresh()
+    
+    return _pictures_table
+
 def create_pictures_table():
     """
     Create the pictures table in Iceberg format
@@ -48,7 +71,9 @@ def create_pictures_table():
             NestedField(5, "upload_timestamp", TimestampType(), required=True),
             NestedField(6, "file_size", StringType(), required=False),
             NestedField(7, "image_width", StringType(), required=False),
-            NestedField(8, "image_height", StringType(), required=False)
+            NestedField(8, "image_height", StringType(), required=False),
+            NestedField(9, "taken_timestamp", TimestampType(), required=False),
+            NestedField(10, "camera_model", StringType(), required=False)
         )
         
         # Create the table
@@ -65,58 +90,144 @@ def create_pictures_table():
         print(f"❌ Error creating Iceberg table: {str(e)}")
         raise
 
+def add_image_property_columns():
+    """
+    Add the capture time and camera columns to a table created before they existed
+    """
+    try:
+        table = load_pictures_table()
+        existing = {field.name for field in table.schema().fields}
+        
+        missing = [(name, field_type) for name, field_type in
+                   (('taken_timestamp', TimestampType()), ('camera_model', StringType()))
+                   if name not in existing]
+        if not missing:
+            print("ℹ️  Image property columns already exist")
+            return
+        
+        with table.update_schema() as update:
+            for name, field_type in missing:
+                update.add_column(name, field_type)
+        
+        print(f"✅ Added columns: {', '.join(name for name, _ in missing)}")
+        
+    except Exception as e:
+        print(f"❌ Error adding image property columns: {str(e)}")
+        raise
+
 def insert_picture_record(picture_id, picture_name, picture_date, picture_jpg, 
-                         file_size=None, image_width=None, image_height=None):
+                         file_size=None, image_width=None, image_height=None,
+                         taken_timestamp=None, camera_model=None):
     """
     Insert a picture record into the Iceberg table
+    
+    taken_timestamp is the EXIF capture time as an ISO 8601 string; it is
+    stored as the camera's local time, without the UTC offset.
+    """
+    insert_picture_records([{
+        'picture_id': picture_id,
+        'picture_name': picture_name,
+        'picture_date': picture_date,
+        'picture_jpg': picture_jpg,
+        'file_size': file_size,
+        'image_width': image_width,
+        'image_height': image_height,
+        'taken_timestamp': taken_timestamp,
+        'camera_model': camera_model
+    }])
+
+def insert_picture_records(pictures):
     """
+    Insert several picture records into the Iceberg table in one commit
+    
+    Each picture is a dict of insert_picture_record's arguments.
+    """
+    import pyarrow as pa
+    from pyiceberg.exceptions import CommitFailedException
+    from pyiceberg.io.pyarrow import schema_to_pyarrow
+    
     try:
-        catalog = create_iceberg_catalog()
-        table = catalog.load_table(f"default.{ICEBERG_TABLE_PATH}")
-        
-        record = {
-            'picture_id': picture_id,
-            'picture_name': picture_name,
-            'picture_date': picture_date,
-            'picture_jpg': picture_jpg,
-            'upload_timestamp': datetime.now(),
-            'file_size': file_size,
-            'image_width': image_width,
-            'image_height': image_height
-        }
-        
-        table.append([record])
-        print(f"✅ Successfully inserted record for: {picture_name}")
+        upload_timestamp = datetime.now()
+        records = []
+        for picture in pictures:
+            picture_date = picture['picture_date']
+            if isinstance(picture_date, str):
+                picture_date = date.fromisoformat(picture_date)
+            taken_timestamp = picture.get('taken_timestamp')
+            if isinstance(taken_timestamp, str):
+                taken_timestamp = datetime.fromisoformat(taken_timestamp[:19])
+            
+            records.append({
+                'picture_id': picture['picture_id'],
+                'picture_name': picture['picture_name'],
+                'picture_date': picture_date,
+                'picture_jpg': picture['picture_jpg'],
+                'upload_timestamp': upload_timestamp,
+                'file_size': None if picture.get('file_size') is None else str(picture['file_size']),
+                'image_width': None if picture.get('image_width') is None else str(picture['image_width']),
+                'image_height': None if picture.get('image_height') is None else str(picture['image_height']),
+                'taken_timestamp': taken_timestamp,
+                'camera_model': picture.get('camera_model')
+            })
+        
+        for attempt in range(COMMIT_RETRIES):
+            table = load_pictures_table()
+            rows = pa.Table.from_pylist(records, schema=schema_to_pyarrow(table.schema()))
+            try:
+                table.append(rows)
+                break
+            except CommitFailedException:
+                # Another upload committed first; retry on the new snapshot
+                if attempt == COMMIT_RETRIES - 1:
+                    raise
+                print(f"ℹ️  Commit conflict inserting {len(records)} records, retrying")
+        
+        print(f"✅ Successfully inserted {len(records)} records")
         
     except Exception as e:
-        print(f"❌ Error inserting picture record: {str(e)}")
+        print(f"❌ Error inserting picture records: {str(e)}")
         raise
 
+def list_picture_ids():
+    """
+    Return the ids of every catalogued picture, reading only that column
+    """
+    table = load_pictures_table()
+    return set(table.scan(selected_fields=('picture_id',)).to_arrow()['picture_id'].to_pylist())
+
 def query_pictures(date_filter=None, name_filter=None, limit=100):
     """
     Query pictures from the Iceberg table
+    
+    The date filter is pushed down into the scan so data files whose
+    picture_date statistics cannot match are never read. Iceberg has no
+    substring predicate, so the name filter is applied to the projected
+    rows. Pass limit=None to return every match.
     """
+    import pyarrow.compute as pc
+    from pyiceberg.expressions import AlwaysTrue, EqualTo
+    
     try:
-        catalog = create_iceberg_catalog()
-        table = catalog.load_table(f"default.{ICEBERG_TABLE_PATH}")
-        
-        # Build the query
-        scan = table.scan()
+        table = load_pictures_table()
         
+        row_filter = AlwaysTrue()
         if date_filter:
-            scan = scan.filter(f"picture_date = '{date_filter}'")
+            row_filter = EqualTo('picture_date', date_filter)
         
-        if name_filter:
-            scan = scan.filter(f"picture_name LIKE '%{name_filter}%'")
+        scan = table.scan(
+            row_filter=row_filter,
+            selected_fields=LISTING_FIELDS,
+            # The limit can only be pushed down when no rows are filtered afterwards
+            limit=None if name_filter else limit
+        )
+        rows = scan.to_arrow()
         
-        # Execute the scan and return results
-        results = []
-        for record in scan.to_arrow().to_pylist():
-            results.append(record)
-            if len(results) >= limit:
-                break
+        if name_filter:
+            rows = rows.filter(pc.match_substring(rows['picture_name'], name_filter, ignore_case=True))
+            if limit is not None:
+                rows = rows.slice(0, limit)
         
-        return results
+        return rows.to_pylist()
         
     except Exception as e:
         print(f"❌ Error querying pictures: {str(e)}")
@@ -149,13 +260,18 @@ def main():
     """
     Main setup function
     """
+    from pyiceberg.exceptions import TableAlreadyExistsError
+    
     print("🚀 Setting up Iceberg table for Picture Gallery...")
     
     # Setup Glue database
     setup_glue_database()
     
-    # Create the pictures table
-    create_pictures_table()
+    # Create the pictures table, or bring an existing one up to date
+    try:
+        create_pictures_table()
+    except TableAlreadyExistsError:
+        add_image_property_columns()
     
     print("✅ Iceberg setup completed successfully!")
 
@@ -0,0 +1,139 @@
+"""
+Precompressed, ETag-validated static asset responses
+
+An asset is rendered and compressed once, when its Lambda container starts,
+rather than on every request. Each asset is kept uncompressed and in every
+coding of STATIC_ASSET_ENCODINGS that shrinks it, and each of those
+representations carries its own strong ETag. Responses are picked by
+Accept-Encoding, so browsers keep their copy and revalidate it with
+If-None-Match, which is answered with an empty 304. Brotli is optional;
+without the module only gzip is offered.
+"""
+
+import base64
+import gzip
+import hashlib
+import re
+
+# Content codings offered for static assets, most preferred first
+STATIC_ASSET_ENCODINGS = ('br', 'gzip')
+
+def compress_static_asset(data, encoding):
+    """Compress an asset body, or return None if the coding is not available"""
+    if encoding == 'gzip':
+        # A fixed mtime keeps the output, and so the ETag, stable across containers
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br':
+        try:
+            import brotli
+        except ImportError:
+            return None
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+    return None
+
+def minify_css(source):
+    """Strip comments and insignificant whitespace from a stylesheet"""
+    css = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,])\s*', r'\1', css).replace(': ', ':')
+    return css.replace(';}', '}').strip()
+
+def minify_js(source):
+    """Drop comment lines, indentation and blank lines from a script"""
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        # Lines inside a multi-line template literal are part of a string
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('//'):
+                lines.append(stripped)
+        if line.count('`') % 2:
+            in_template = not in_template
+    # Line breaks are kept, so automatic semicolon insertion is unchanged
+    return '\n'.join(lines)
+
+def build_static_asset(content, content_type, cache_control='no-cache'):
+    """Build every representation of an asset: coding -> (body bytes, ETag)"""
+    data = content.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    variants = {'identity': (data, f'"{digest}"')}
+    for encoding in STATIC_ASSET_ENCODINGS:
+        compressed = compress_static_asset(data, encoding)
+        if compressed is not None and len(compressed) < len(data):
+            variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+    return {'content_type': content_type, 'cache_control': cache_control, 'variants': variants}
+
+def parse_accept_encoding(header):
+    """Map each coding in an Accept-Encoding header to its quality value"""
+    weights = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights
+
+def choose_asset_encoding(asset, accept_encoding):
+    """Pick the client's most preferred coding of an asset, identity if none is accepted"""
+    weights = parse_accept_encoding(accept_encoding)
+    chosen, chosen_weight = 'identity', 0.0
+    for encoding in STATIC_ASSET_ENCODINGS:
+        if encoding in asset['variants']:
+            weight = weights.get(encoding, weights.get('*', 0.0))
+            # Ties go to the earlier, smaller coding
+            if weight > chosen_weight:
+                chosen, chosen_weight = encoding, weight
+    return chosen
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches an ETag, by weak comparison"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def static_asset_response(asset, event=None, headers=None):
+    """Serve an asset in the coding the request accepts, or 304 if the client's copy is current"""
+    request_headers = {name.lower(): value for name, value in ((event or {}).get('headers') or {}).items()}
+    encoding = choose_asset_encoding(asset, request_headers.get('accept-encoding'))
+    body, etag = asset['variants'][encoding]
+    response_headers = {
+        'Content-Type': asset['content_type'],
+        'Cache-Control': asset['cache_control'],
+        'ETag': etag,
+        'Vary': 'Accept-Encoding',
+        'Access-Control-Allow-Origin': '*',
+        **(headers or {})
+    }
+    if etag_matches(request_headers.get('if-none-match'), etag):
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+    
+    if encoding == 'identity':
+        return {'statusCode': 200, 'headers': response_headers, 'body': body.decode('utf-8')}
+    
+    response_headers['Content-Encoding'] = encoding
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'body': base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': True
+    }
@@ -45,7 +45,10 @@ resource "aws_iam_role_policy" "lambda_s3_policy" {
           "s3:ListBucket",
           "s3:GetObjectVersion",
           "s3:PutObjectAcl",
-          "s3:GetObjectAcl"
+          "s3:GetObjectAcl",
+          "s3:AbortMultipartUpload",
+          "s3:ListMultipartUploadParts",
+          "s3:ListBucketMultipartUploads"
         ]
         Resource = [
           aws_s3_bucket.pictures.arn,
@@ -1,8 +1,30 @@
 # Archive unified Lambda code
 data "archive_file" "unified_lambda" {
   type        = "zip"
-  source_file = "${path.module}/../unified_lambda.py"
   output_path = "${path.module}/unified_lambda.zip"
+
+  source {
+    content  = file("${path.module}/../unified_lambda.py")
+    filename = "unified_lambda.py"
+  }
+
+  source {
+    content  = file("${path.module}/../gallery_common.py")
+    filename = "gallery_common.py"
+  }
+
+  source {
+    content  = file("${path.module}/../static_assets.py")
+    filename = "static_assets.py"
+  }
+}
+
+# Python dependencies (Pillow for picture derivatives), built by build-lambda-layer.sh
+resource "aws_lambda_layer_version" "dependencies" {
+  filename            = "${path.module}/../lambda-layer.zip"
+  layer_name          = "${local.project_name}-dependencies-${local.environment}"
+  source_code_hash    = filebase64sha256("${path.module}/../lambda-layer.zip")
+  compatible_runtimes = ["python3.12"]
 }
 
 # Unified Lambda function (frontend + backend)
@@ -15,6 +37,7 @@ resource "aws_lambda_function" "unified" {
   runtime         = "python3.12"
   timeout         = var.lambda_timeout
   memory_size     = var.lambda_memory_size
+  layers          = [aws_lambda_layer_version.dependencies.arn]
 
 
 
@@ -54,3 +77,23 @@ resource "aws_cloudwatch_log_group" "unified_logs" {
   tags              = local.common_tags
 }
 
+# Periodic reconciliation of the incrementally maintained gallery stats
+resource "aws_cloudwatch_event_rule" "stats_reconcile" {
+  name                = "${local.project_name}-stats-reconcile-${local.environment}"
+  description         = "Rebuild the gallery manifest and stats from the bucket"
+  schedule_expression = var.stats_reconcile_schedule
+  tags                = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "stats_reconcile" {
+  rule = aws_cloudwatch_event_rule.stats_reconcile.name
+  arn  = aws_lambda_function.unified.arn
+}
+
+resource "aws_lambda_permission" "stats_reconcile" {
+  statement_id  = "AllowStatsReconcileFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.unified.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.stats_reconcile.arn
+}
@@ -77,6 +77,40 @@ resource "aws_s3_bucket_lifecycle_configuration" "pictures" {
       noncurrent_days = 30
     }
   }
+
+  rule {
+    id     = "incomplete_upload_cleanup"
+    status = "Enabled"
+
+    filter {
+      prefix = "pictures/"
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 7
+    }
+  }
+
+  rule {
+    id     = "download_archive_cleanup"
+    status = "Enabled"
+
+    filter {
+      prefix = "downloads/"
+    }
+
+    expiration {
+      days = 1
+    }
+
+    noncurrent_version_expiration {
+      noncurrent_days = 1
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
 }
 
 
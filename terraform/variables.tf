@@ -43,3 +43,9 @@ variable "iceberg_warehouse_path" {
 }
 
 
+
+variable "stats_reconcile_schedule" {
+  description = "EventBridge schedule for rebuilding the gallery manifest and stats"
+  type        = string
+  default     = "rate(1 day)"
+}
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the Iceberg-backed read and write paths in backend_lambda
+"""
+
+import io
+import json
+import sys
+import types
+import unittest
+from datetime import date
+from unittest.mock import Mock, patch
+
+from PIL import Image
+
+import backend_lambda
+from fake_s3 import FakeS3Client
+
+
+def pictures_event(**query):
+    return {
+        'requestContext': {'http': {'method': 'GET'}},
+        'rawPath': '/pictures',
+        'queryStringParameters': query or None
+    }
+
+
+class TestIcebergReadPath(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.s3.add_object('abc.jpg', b'jpg', metadata={
+            'picture_name': 'From S3',
+            'picture_date': '2024-03-01'
+        })
+        patcher = patch('backend_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def install_iceberg(self, **functions):
+        module = types.ModuleType('iceberg_setup')
+        module.__dict__.update(functions)
+        patcher = patch.dict(sys.modules, {'iceberg_setup': module})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_listing_is_answered_by_iceberg_scan(self):
+        query = Mock(return_value=[
+            {'picture_id': 'a.jpg', 'picture_name': 'Old', 'picture_date': date(2024, 1, 1),
+             'picture_jpg': 'a.jpg'},
+            {'picture_id': 'b.jpg', 'picture_name': 'New', 'picture_date': date(2024, 2, 1),
+             'picture_jpg': 'b.jpg'}
+        ])
+        self.install_iceberg(query_pictures=query)
+
+        response = backend_lambda.lambda_handler(pictures_event(date='2024-02-01', name='ne'), {})
+
+        self.assertEqual(response['statusCode'], 200)
+        query.assert_called_once_with('2024-02-01', 'ne', limit=None)
+        body = json.loads(response['body'])
+        self.assertEqual([p['picture_name'] for p in body['pictures']], ['New', 'Old'])
+        self.assertEqual(body['pictures'][0]['picture_date'], '2024-02-01')
+        # No per-object metadata requests on the Iceberg path
+        self.assertEqual(self.s3.calls['head_object'], 0)
+
+    def test_listing_falls_back_to_s3_when_catalog_fails(self):
+        self.install_iceberg(query_pictures=Mock(side_effect=RuntimeError('no catalog')))
+
+        response = backend_lambda.lambda_handler(pictures_event(), {})
+
+        body = json.loads(response['body'])
+        self.assertEqual([p['picture_name'] for p in body['pictures']], ['From S3'])
+
+    def test_insert_forwards_to_catalog(self):
+        insert = Mock()
+        self.install_iceberg(insert_picture_record=insert)
+
+        backend_lambda.insert_into_iceberg_table('x.jpg', 'X', '2024-01-05', file_size=10,
+                                                 taken_timestamp='2023-07-04T18:30:00')
+
+        insert.assert_called_once_with(
+            picture_id='x.jpg', picture_name='X', picture_date='2024-01-05',
+            picture_jpg='x.jpg', file_size=10, image_width=None, image_height=None,
+            taken_timestamp='2023-07-04T18:30:00', camera_model=None
+        )
+
+    def test_scheduled_reconcile_catalogues_missing_pictures(self):
+        self.s3.add_object('catalogued.jpg', b'jpg', metadata={'picture_name': 'Known', 'picture_date': '2024-01-01'})
+        self.s3.add_object('notes.txt', b'text')
+        insert = Mock()
+        self.install_iceberg(list_picture_ids=Mock(return_value={'catalogued.jpg'}),
+                             insert_picture_records=insert)
+
+        response = backend_lambda.lambda_handler({'source': 'aws.events'}, {})
+
+        self.assertEqual(json.loads(response['body']), {'catalogued': 1, 'missing': 1})
+        insert.assert_called_once_with([{
+            'picture_id': 'abc.jpg', 'picture_name': 'From S3', 'picture_date': '2024-03-01',
+            'picture_jpg': 'abc.jpg', 'file_size': 3, 'image_width': None, 'image_height': None,
+            'taken_timestamp': None
+        }])
+
+    def test_failed_insert_leaves_enough_metadata_to_backfill(self):
+        output = io.BytesIO()
+        Image.new('RGB', (64, 48)).save(output, format='JPEG')
+        self.install_iceberg(insert_picture_record=Mock(side_effect=RuntimeError('no catalog')))
+
+        status, result = backend_lambda.store_uploaded_picture(output.getvalue(), 'Dog', '2024-05-05')
+
+        self.assertEqual(status, 201)
+        metadata = self.s3.objects[result['id']]['Metadata']
+        self.assertEqual((metadata['image_width'], metadata['image_height']), ('64', '48'))
+
+
+if __name__ == '__main__':
+    unittest.main()
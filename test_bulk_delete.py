@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the chunked, parallel bulk delete
+"""
+
+import json
+import unittest
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+
+def delete_event(names):
+    return {
+        'requestContext': {'http': {'method': 'DELETE'}},
+        'rawPath': '/api/pictures',
+        'body': json.dumps({'pictures': names}),
+        'isBase64Encoded': False
+    }
+
+
+class TestBulkDelete(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        for i in range(2500):
+            self.s3.add_object(f'pictures/20240101_{i:06d}_{i:08x}.jpg', b'x',
+                               metadata={'original-name': f'photo{i:04d}.jpg'})
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+        unified_lambda.load_manifest()
+
+    def delete(self, names):
+        response = unified_lambda.lambda_handler(delete_event(names), {})
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def picture_keys(self):
+        return [key for key in self.s3.objects if key.startswith('pictures/')]
+
+    def test_thousands_of_pictures_are_deleted_in_batches(self):
+        self.s3.reset_calls()
+
+        result = self.delete([f'photo{i:04d}.jpg' for i in range(2500)])
+
+        self.assertEqual(result['deleted_count'], 2500)
+        self.assertEqual(self.s3.calls['delete_objects'], 3)
+        self.assertEqual(self.picture_keys(), [])
+        self.assertEqual(unified_lambda.load_manifest()['pictures'], {})
+
+    def test_derived_artifacts_are_deleted_in_the_same_pass(self):
+        key = 'pictures/20240101_000007_00000007.jpg'
+        self.s3.add_object('comments/20240101_000007_00000007.jpg/log/1-a.json', b'{}')
+        self.s3.add_object('ratings/20240101_000007_00000007.jpg/shard-0.json', b'{}')
+        self.s3.add_object('comments/20240101_000008_00000008.jpg/log/1-a.json', b'{}')
+        self.s3.reset_calls()
+
+        result = self.delete(['photo0007.jpg'])
+
+        self.assertEqual(result['derived_deleted_count'], 2)
+        self.assertEqual(self.s3.calls['delete_objects'], 1)
+        self.assertNotIn(key, self.s3.objects)
+        self.assertEqual([k for k in self.s3.objects if not k.startswith(('pictures/', 'index/'))],
+                         ['comments/20240101_000008_00000008.jpg/log/1-a.json'])
+
+    def test_many_pictures_list_only_their_own_artifacts(self):
+        key = 'pictures/20240101_000100_00000064.jpg'
+        self.s3.add_object('ratings/20240101_000100_00000064.jpg/shard-3.json', b'{}')
+        self.s3.add_object('derivatives/20240101_000100_00000064.jpg/thumb.jpg', b'{}')
+        self.s3.add_object('ratings/20240101_002400_00000960.jpg/shard-0.json', b'{}')
+        unified_lambda.update_manifest_entry(key, derivatives=['thumb'])
+        self.s3.reset_calls()
+
+        with patch.object(self.s3, 'list_objects_v2', wraps=self.s3.list_objects_v2) as listing:
+            result = self.delete([f'photo{i:04d}.jpg' for i in range(200)])
+
+        self.assertEqual(result['deleted_count'], 200)
+        self.assertNotIn('ratings/20240101_000100_00000064.jpg/shard-3.json', self.s3.objects)
+        self.assertNotIn('derivatives/20240101_000100_00000064.jpg/thumb.jpg', self.s3.objects)
+        self.assertIn('ratings/20240101_002400_00000960.jpg/shard-0.json', self.s3.objects)
+        # Derivatives come from the manifest; no whole artifact root is listed
+        prefixes = [call.kwargs['Prefix'] for call in listing.call_args_list]
+        self.assertEqual(len(prefixes), 200 * len(unified_lambda.LISTED_DERIVED_PREFIXES))
+        self.assertTrue(all(prefix.count('/') == 2 for prefix in prefixes))
+        self.assertFalse(any(prefix.startswith(unified_lambda.DERIVATIVES_PREFIX) for prefix in prefixes))
+
+    def test_per_key_outcomes(self):
+        self.s3.protected_keys.add('pictures/20240101_000001_00000001.jpg')
+
+        result = self.delete(['photo0000.jpg', 'photo0001.jpg', 'nothing-like-this'])
+
+        self.assertEqual([r['status'] for r in result['results']], ['deleted', 'error', 'not_found'])
+        self.assertEqual(result['results'][1]['error'], 'Access Denied')
+        self.assertEqual(result['deleted_count'], 1)
+        manifest = unified_lambda.load_manifest()
+        self.assertIn('pictures/20240101_000001_00000001.jpg', manifest['pictures'])
+
+
+if __name__ == '__main__':
+    unittest.main()
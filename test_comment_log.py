@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the append-only comment log and its compaction
+"""
+
+import json
+import unittest
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+PICTURE_KEY = 'pictures/20240101_120000_aaaa1111.jpg'
+
+
+class TestCommentLog(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.s3.add_object(PICTURE_KEY, b'x' * 4096, metadata={
+            'original-name': 'sunset.jpg',
+            'comments': json.dumps([{'author': 'Old', 'text': 'Legacy', 'date': '2023-01-01'}])
+        })
+        for name, value in (('s3_client', self.s3), ('COMMENT_COMPACT_THRESHOLD', 5)):
+            patcher = patch(f'unified_lambda.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+
+    def comment(self, text):
+        response = unified_lambda.lambda_handler(api_event('POST', '/api/pictures/comment', {
+            'picture': 'sunset.jpg', 'author': 'Ann', 'text': text
+        }), {})
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def thread(self):
+        response = unified_lambda.lambda_handler(
+            api_event('GET', '/api/pictures/comments', query={'picture': 'sunset.jpg'}), {})
+        self.assertEqual(response['statusCode'], 200)
+        return [comment['text'] for comment in json.loads(response['body'])['comments']]
+
+    def log_keys(self):
+        return [key for key in self.s3.objects if key.startswith('comments/') and '/log/' in key]
+
+    def test_comment_does_not_touch_the_image(self):
+        self.comment('First')
+
+        self.assertEqual(self.s3.calls['copy_object'], 0)
+        self.assertEqual(self.s3.objects[PICTURE_KEY]['Body'], b'x' * 4096)
+        self.assertEqual(self.thread(), ['Legacy', 'First'])
+
+    def test_listing_carries_counts_only(self):
+        self.assertEqual(self.comment('First')['comment_count'], 2)
+
+        # The listing counts the comment right away
+        response = unified_lambda.lambda_handler(api_event('GET', '/api/pictures'), {})
+        picture = json.loads(response['body'])['pictures'][0]
+
+        self.assertEqual(picture['comment_count'], 2)
+        self.assertNotIn('comments', picture)
+
+    def test_compaction_keeps_thread_and_trims_log(self):
+        texts = [f'c{i}' for i in range(12)]
+        for text in texts:
+            self.comment(text)
+
+        snapshot = json.loads(self.s3.objects[unified_lambda.comment_snapshot_key(PICTURE_KEY)]['Body'])
+        self.assertEqual(snapshot['count'], 10)
+        # Entries folded into the previous snapshot are gone, the rest remain
+        self.assertEqual(len(self.log_keys()), 8)
+        self.assertEqual(self.thread(), ['Legacy'] + texts)
+
+    def test_entry_with_an_older_key_is_not_lost(self):
+        for i in range(5):
+            self.comment(f'c{i}')
+        # A container with a slow clock writes a key older than the folded ones
+        late_key = unified_lambda.comment_thread_prefix(PICTURE_KEY) + 'log/00000000000000000001-late.json'
+        self.s3.put_object(Bucket=unified_lambda.PICTURES_BUCKET, Key=late_key,
+                           Body=json.dumps({'author': 'Bo', 'text': 'late', 'date': ''}).encode('utf-8'))
+
+        self.assertIn('late', self.thread())
+        for i in range(5, 15):
+            self.comment(f'c{i}')
+
+        self.assertNotIn(late_key, self.s3.objects)
+        thread = self.thread()
+        self.assertEqual(len(thread), 17)
+        self.assertIn('late', thread)
+
+    def test_rebuilt_manifest_counts_compacted_threads(self):
+        for i in range(7):
+            self.comment(f'c{i}')
+        del self.s3.objects[unified_lambda.MANIFEST_KEY]
+        unified_lambda._metadata_cache.clear()
+
+        manifest = unified_lambda.load_manifest()
+
+        self.assertEqual(manifest['pictures'][PICTURE_KEY]['comment_count'], 8)
+
+    def test_unknown_picture(self):
+        response = unified_lambda.lambda_handler(
+            api_event('GET', '/api/pictures/comments', query={'picture': 'missing.jpg'}), {})
+
+        self.assertEqual(response['statusCode'], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
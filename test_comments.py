@@ -10,6 +10,7 @@ import tempfile
 import shutil
 from datetime import datetime
 from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError
 from unified_lambda import lambda_handler
 
 def test_comments_functionality():
@@ -42,13 +43,18 @@ def test_comments_functionality():
     # Mock generate_presigned_url
     mock_s3_client.generate_presigned_url.return_value = 'https://example.com/test-image.jpg'
     
-    # Mock copy_object (for updating metadata)
-    mock_s3_client.copy_object.return_value = {}
+    # Mock get_object (no manifest or comment snapshot stored yet)
+    mock_s3_client.get_object.side_effect = ClientError(
+        {'Error': {'Code': 'NoSuchKey', 'Message': 'NoSuchKey'}}, 'GetObject'
+    )
+    
+    # Mock put_object (for comment log entries and the manifest)
+    mock_s3_client.put_object.return_value = {}
     
     # Patch the S3 client
     with patch('unified_lambda.s3_client', mock_s3_client):
         
-        # Test 1: Get pictures (should include empty comments array)
+        # Test 1: Get pictures (should include a comment count)
         print("1️⃣ Testing get_pictures with comments...")
         
         event = {
@@ -63,12 +69,12 @@ def test_comments_functionality():
         pictures = body['pictures']
         
         assert len(pictures) == 1
-        assert 'comments' in pictures[0]
-        assert pictures[0]['comments'] == []
+        assert pictures[0]['comment_count'] == 0
+        assert 'comments' not in pictures[0]
         assert pictures[0]['name'] == 'test-image.jpg'
         assert pictures[0]['rating'] == 4
         
-        print("✅ get_pictures includes comments field")
+        print("✅ get_pictures includes comment count")
         
         # Test 2: Add a comment
         print("2️⃣ Testing add_comment...")
@@ -97,27 +103,23 @@ def test_comments_functionality():
         
         print("✅ add_comment works correctly")
         
-        # Verify copy_object was called with updated metadata
-        mock_s3_client.copy_object.assert_called_once()
-        call_args = mock_s3_client.copy_object.call_args
-        
-        # Check that metadata contains the new comment
-        updated_metadata = call_args[1]['Metadata']
-        assert 'comments' in updated_metadata
-        
-        comments_json = updated_metadata['comments']
-        comments = json.loads(comments_json)
+        # Verify the comment was appended to the picture's comment log
+        mock_s3_client.copy_object.assert_not_called()
+        log_calls = [
+            call for call in mock_s3_client.put_object.call_args_list
+            if call[1]['Key'].startswith('comments/test-image.jpg/log/')
+        ]
+        assert len(log_calls) == 1
         
-        assert len(comments) == 1
-        assert comments[0]['author'] == 'John Doe'
-        assert comments[0]['text'] == 'Beautiful sunset!'
+        comment = json.loads(log_calls[0][1]['Body'])
+        assert comment['author'] == 'John Doe'
+        assert comment['text'] == 'Beautiful sunset!'
         
-        print("✅ S3 metadata updated correctly")
+        print("✅ Comment log entry written correctly")
         
-        # Test 3: Test with existing comments
-        print("3️⃣ Testing add_comment with existing comments...")
+        # Test 3: Test with comments stored by the old metadata layout
+        print("3️⃣ Testing get_comments with legacy metadata comments...")
         
-        # Mock head_object to return existing comments
         existing_comments = [
             {
                 'author': 'Jane Smith',
@@ -134,36 +136,21 @@ def test_comments_functionality():
             }
         }
         
-        # Reset the mock
-        mock_s3_client.copy_object.reset_mock()
-        
-        # Add another comment
-        comment_event2 = {
-            'requestContext': {'http': {'method': 'POST'}},
-            'rawPath': '/api/pictures/comment',
-            'body': json.dumps({
-                'picture': 'test-image.jpg',
-                'author': 'Bob Wilson',
-                'text': 'Amazing colors!'
-            }),
-            'isBase64Encoded': False
+        comments_event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'rawPath': '/api/pictures/comments',
+            'queryStringParameters': {'picture': 'test-image.jpg'}
         }
         
-        response = lambda_handler(comment_event2, {})
+        response = lambda_handler(comments_event, {})
         
         assert response['statusCode'] == 200
+        body = json.loads(response['body'])
         
-        # Verify both comments are preserved
-        call_args = mock_s3_client.copy_object.call_args
-        updated_metadata = call_args[1]['Metadata']
-        comments_json = updated_metadata['comments']
-        comments = json.loads(comments_json)
-        
-        assert len(comments) == 2
-        assert comments[0]['author'] == 'Jane Smith'  # Existing comment
-        assert comments[1]['author'] == 'Bob Wilson'  # New comment
+        assert body['count'] == 1
+        assert body['comments'][0]['author'] == 'Jane Smith'
         
-        print("✅ Multiple comments handled correctly")
+        print("✅ Legacy comments still served")
         
         # Test 4: Test error handling
         print("4️⃣ Testing error handling...")
@@ -207,6 +194,7 @@ def test_comments_functionality():
         assert 'function toggleComments(' in js_content
         assert 'async function submitComment(' in js_content
         assert '/api/pictures/comment' in js_content
+        assert 'async function loadComments(' in js_content
         
         print("✅ JavaScript functions included correctly")
         
@@ -214,8 +202,8 @@ def test_comments_functionality():
         print("\nFeatures tested:")
         print("  ✅ Comments field included in picture data")
         print("  ✅ Adding new comments via API")
-        print("  ✅ Preserving existing comments")
-        print("  ✅ S3 metadata storage")
+        print("  ✅ Serving legacy metadata comments")
+        print("  ✅ Append-only comment log storage")
         print("  ✅ Error handling")
         print("  ✅ JavaScript functions")
 
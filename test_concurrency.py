@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the bounded S3 request executor
+"""
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import gallery_common
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+
+class SlowHeadS3Client(FakeS3Client):
+    """Fake client whose head_object takes a while and records concurrency"""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.01)
+            return super().head_object(Bucket, Key, **kwargs)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestMapConcurrently(unittest.TestCase):
+
+    def test_results_keep_input_order(self):
+        def slow_square(n):
+            time.sleep(0.001 * (10 - n))
+            return n * n
+
+        self.assertEqual(gallery_common.map_concurrently(slow_square, range(10)),
+                         [n * n for n in range(10)])
+
+    def test_empty_input(self):
+        self.assertEqual(gallery_common.map_concurrently(lambda n: n, []), [])
+
+    def test_manifest_rebuild_heads_in_parallel_within_bound(self):
+        s3 = SlowHeadS3Client()
+        for i in range(40):
+            s3.add_object(f'pictures/20240101_{i:06d}_abcd.jpg', metadata={'original-name': f'p{i}.jpg'})
+
+        with patch('unified_lambda.s3_client', s3), patch('gallery_common.S3_CONCURRENCY', 8):
+            unified_lambda._metadata_cache.clear()
+            manifest = unified_lambda.rebuild_manifest()
+
+        self.assertEqual(len(manifest['pictures']), 40)
+        self.assertGreater(s3.max_active, 1)
+        self.assertLessEqual(s3.max_active, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
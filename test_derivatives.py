@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Tests for upload-time thumbnail and medium-size derivatives
+"""
+
+import base64
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+
+def jpeg_bytes(size, orientation=None):
+    image = Image.new('RGB', size, (200, 80, 40))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    image.save(output, format='JPEG', exif=exif)
+    return output.getvalue()
+
+
+class TestDerivatives(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+        unified_lambda.load_stats()
+
+    def call(self, method, path, body=None):
+        response = unified_lambda.lambda_handler(api_event(method, path, body), {})
+        self.assertEqual(response['statusCode'], 200, response['body'])
+        return json.loads(response['body'])
+
+    def upload(self, name, data):
+        return self.call('POST', '/api/pictures', {
+            'name': name,
+            'data': base64.b64encode(data).decode('ascii'),
+            'contentType': 'image/jpeg'
+        })['key']
+
+    def stored_size(self, key):
+        return Image.open(io.BytesIO(self.s3.objects[key]['Body'])).size
+
+    def test_upload_stores_oriented_derivatives(self):
+        # Orientation 6: the camera was turned, so the picture displays portrait
+        key = self.upload('portrait.jpg', jpeg_bytes((2000, 1000), orientation=6))
+
+        self.assertEqual(self.stored_size(unified_lambda.derivative_key(key, 'medium')), (640, 1280))
+        self.assertEqual(self.stored_size(unified_lambda.derivative_key(key, 'thumb')), (200, 400))
+        entry = unified_lambda.load_manifest()['pictures'][key]
+        self.assertEqual(sorted(entry['derivatives']), ['medium', 'thumb'])
+
+    def test_listing_exposes_derivative_urls(self):
+        key = self.upload('sunset.jpg', jpeg_bytes((1600, 1200)))
+        self.s3.add_object('pictures/20240101_000000_legacy00.jpg', b'not an image',
+                           metadata={'original-name': 'legacy.jpg'})
+        unified_lambda.invalidate_manifest()
+
+        pictures = {p['name']: p for p in self.call('GET', '/api/pictures')['pictures']}
+
+        sunset = pictures['sunset.jpg']
+        self.assertIn(unified_lambda.derivative_key(key, 'thumb'), sunset['thumb_url'])
+        self.assertIn(unified_lambda.derivative_key(key, 'medium'), sunset['medium_url'])
+        # Pictures without derivatives fall back to the original
+        legacy = pictures['legacy.jpg']
+        self.assertEqual(legacy['thumb_url'], legacy['url'])
+
+    def test_backfill_renders_missing_derivatives(self):
+        key = 'pictures/20240101_000000_aaaa0000.jpg'
+        self.s3.add_object(key, jpeg_bytes((800, 600)), metadata={'original-name': 'old.jpg'})
+
+        unified_lambda.lambda_handler({'source': 'aws.events'}, {})
+
+        self.assertIn(unified_lambda.derivative_key(key, 'thumb'), self.s3.objects)
+        entry = unified_lambda.load_manifest()['pictures'][key]
+        self.assertEqual(sorted(entry['derivatives']), ['medium', 'thumb'])
+
+    def test_delete_removes_derivatives(self):
+        key = self.upload('gone.jpg', jpeg_bytes((800, 600)))
+
+        self.call('DELETE', '/api/pictures', {'pictures': ['gone.jpg']})
+
+        self.assertEqual([k for k in self.s3.objects if k.startswith(unified_lambda.DERIVATIVES_PREFIX)], [])
+        self.assertNotIn(key, self.s3.objects)
+
+
+class TestReducedDecode(unittest.TestCase):
+
+    def test_jpeg_is_decoded_at_reduced_scale(self):
+        data = jpeg_bytes((4000, 3000), orientation=6)
+        decoded = []
+
+        def draft(image, mode, size):
+            result = original_draft(image, mode, size)
+            decoded.append(image.size)
+            return result
+
+        original_draft = JpegImageFile.draft
+        with patch.object(JpegImageFile, 'draft', draft):
+            image = unified_lambda.decode_downscaled(data, (1920, 1080))
+
+        # Stored landscape, displayed portrait: fitted to 1080 high after rotation
+        self.assertEqual(image.size, (810, 1080))
+        # The 1080x810 target is 3.7x smaller, so the DCT decode halves the size
+        self.assertEqual(decoded, [(2000, 1500)])
+
+    def test_other_formats_and_small_images(self):
+        output = io.BytesIO()
+        Image.new('RGBA', (1000, 500)).save(output, format='PNG')
+
+        self.assertEqual(unified_lambda.decode_downscaled(output.getvalue(), (200, 200)).size, (200, 100))
+        self.assertEqual(unified_lambda.decode_downscaled(output.getvalue(), (4000, 4000)).size, (1000, 500))
+
+
+if __name__ == '__main__':
+    unittest.main()
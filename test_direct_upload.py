@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+"""
+Tests for direct-to-S3 upload sessions
+"""
+
+import base64
+import hashlib
+import json
+import unittest
+from datetime import timedelta
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+
+class DirectUploadTestCase(unittest.TestCase):
+
+    PART_SIZE = 1024
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.s3.min_part_size = self.PART_SIZE
+        for target, value in (('s3_client', self.s3),
+                              ('MULTIPART_PART_SIZE', self.PART_SIZE),
+                              ('MULTIPART_MIN_PART_SIZE', self.PART_SIZE)):
+            patcher = patch(f'unified_lambda.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+        unified_lambda.load_stats()
+        self.s3.reset_calls()
+
+    def call(self, path, body, status=200):
+        response = unified_lambda.lambda_handler(api_event('POST', path, body), {})
+        self.assertEqual(response['statusCode'], status, response['body'])
+        return json.loads(response['body'])
+
+    def browser_put(self, session, body):
+        """Do what the browser does with the signed PUT URL"""
+        metadata = {name[len('x-amz-meta-'):]: value for name, value in session['headers'].items()
+                    if name.startswith('x-amz-meta-')}
+        self.s3.add_object(session['key'], body, metadata, session['headers']['Content-Type'])
+
+
+class TestDirectUpload(DirectUploadTestCase):
+
+    def test_small_file_uses_a_single_presigned_put(self):
+        session = self.call('/api/uploads', {'name': 'sunset.jpg', 'contentType': 'image/jpeg', 'size': 500})
+
+        self.assertNotIn('uploadId', session)
+        self.assertEqual(session['method'], 'PUT')
+        self.assertEqual(session['headers']['x-amz-meta-original-name'], 'sunset.jpg')
+        self.assertEqual(self.s3.calls['put_object'], 0)
+
+        self.browser_put(session, b'x' * 500)
+        result = self.call('/api/uploads/complete', {'key': session['key'], 'name': 'sunset.jpg'})
+
+        self.assertEqual(result['original_name'], 'sunset.jpg')
+        entry = unified_lambda.load_manifest()['pictures'][session['key']]
+        self.assertEqual(entry['size'], 500)
+        self.assertEqual(unified_lambda.load_stats()['total_pictures'], 1)
+
+    def test_large_file_uses_multipart_part_urls(self):
+        body = bytes(range(256)) * 10
+        session = self.call('/api/uploads', {'name': 'pano.png', 'contentType': 'image/png',
+                                             'size': len(body)})
+
+        self.assertEqual(session['partSize'], self.PART_SIZE)
+        self.assertEqual([part['partNumber'] for part in session['parts']], [1, 2, 3])
+        self.assertEqual(len({part['url'] for part in session['parts']}), 3)
+
+        # Parts finish out of order in the browser
+        parts = []
+        for part in reversed(session['parts']):
+            start = (part['partNumber'] - 1) * session['partSize']
+            response = self.s3.upload_part(Bucket='b', Key=session['key'], UploadId=session['uploadId'],
+                                           PartNumber=part['partNumber'],
+                                           Body=body[start:start + session['partSize']])
+            parts.append({'PartNumber': part['partNumber'], 'ETag': response['ETag']})
+
+        self.call('/api/uploads/complete', {'key': session['key'], 'name': 'pano.png',
+                                            'uploadId': session['uploadId'], 'parts': parts})
+
+        self.assertEqual(self.s3.objects[session['key']]['Body'], body)
+        self.assertEqual(self.s3.objects[session['key']]['Metadata']['original-name'], 'pano.png')
+        entry = unified_lambda.load_manifest()['pictures'][session['key']]
+        self.assertEqual((entry['size'], entry['content_type']), (len(body), 'image/png'))
+
+    def test_upload_keys_always_use_a_listed_extension(self):
+        session = self.call('/api/uploads', {'name': 'IMG_0001.HEIC', 'contentType': 'image/heic', 'size': 500})
+        self.assertTrue(session['key'].endswith('.jpg'))
+        self.browser_put(session, b'x' * 500)
+        self.call('/api/uploads/complete', {'key': session['key']})
+
+        # A manifest rebuilt from the bucket still lists the picture
+        unified_lambda.invalidate_manifest()
+
+        self.assertIn(session['key'], unified_lambda.load_manifest()['pictures'])
+        self.assertTrue(unified_lambda.new_picture_key('clip.webp').endswith('.jpg'))
+        self.assertTrue(unified_lambda.new_picture_key('logo.webp', 'image/png').endswith('.png'))
+
+    def test_part_size_grows_to_stay_within_part_limit(self):
+        size = self.PART_SIZE * unified_lambda.MULTIPART_MAX_PARTS * 3
+        self.assertEqual(unified_lambda.upload_part_size(size), self.PART_SIZE * 3)
+
+    def test_completion_without_an_object_is_rejected(self):
+        self.call('/api/uploads/complete', {'key': 'pictures/never-uploaded.jpg'}, status=404)
+        self.call('/api/uploads/complete', {'key': 'index/manifest.json'}, status=400)
+        self.call('/api/uploads', {'name': 'empty.jpg', 'size': 0}, status=400)
+
+    def test_abort_discards_the_multipart_upload(self):
+        session = self.call('/api/uploads', {'name': 'big.jpg', 'size': self.PART_SIZE * 2 + 1})
+
+        self.call('/api/uploads/abort', {'key': session['key'], 'uploadId': session['uploadId']})
+
+        self.assertEqual(self.s3.uploads, {})
+
+
+class TestResumableUpload(DirectUploadTestCase):
+
+    def start(self, body):
+        session = self.call('/api/uploads', {'name': 'pano.jpg', 'size': len(body)})
+        self.body = body
+        return session
+
+    def send_part(self, session, part_number, length=None):
+        start = (part_number - 1) * session['partSize']
+        data = self.body[start:start + session['partSize']][:length]
+        self.s3.upload_part(Bucket='b', Key=session['key'], UploadId=session['uploadId'],
+                            PartNumber=part_number, Body=data)
+
+    def resume(self, session, status=200):
+        return self.call('/api/uploads/resume', {'key': session['key'], 'uploadId': session['uploadId'],
+                                                 'size': len(self.body), 'partSize': session['partSize']},
+                         status=status)
+
+    def test_resume_resends_only_unconfirmed_parts(self):
+        session = self.start(bytes(range(256)) * 16)
+        self.send_part(session, 1)
+        self.send_part(session, 3)
+        # The connection dropped halfway through part 2
+        self.send_part(session, 2, length=100)
+
+        resumed = self.resume(session)
+
+        self.assertEqual([part['PartNumber'] for part in resumed['completed']], [1, 3])
+        self.assertEqual([part['partNumber'] for part in resumed['parts']], [2, 4])
+
+        for part in resumed['parts']:
+            self.send_part(session, part['partNumber'])
+        self.call('/api/uploads/complete', {'key': session['key'], 'name': 'pano.jpg',
+                                            'uploadId': session['uploadId']})
+
+        self.assertEqual(self.s3.objects[session['key']]['Body'], self.body)
+
+    def test_retried_completion_finds_the_completed_upload(self):
+        session = self.start(bytes(range(256)) * 5)
+        for part_number in (1, 2):
+            self.send_part(session, part_number)
+        request = {'key': session['key'], 'name': 'pano.jpg', 'uploadId': session['uploadId']}
+
+        first = self.call('/api/uploads/complete', request)
+        # The response was lost and the client sends the request again
+        again = self.call('/api/uploads/complete', request)
+
+        self.assertEqual(again['key'], first['key'])
+        self.assertEqual(len(unified_lambda.load_manifest()['pictures']), 1)
+
+    def test_completing_an_aborted_upload_is_not_found(self):
+        session = self.start(b'x' * (self.PART_SIZE + 1))
+        self.call('/api/uploads/abort', {'key': session['key'], 'uploadId': session['uploadId']})
+
+        self.call('/api/uploads/complete', {'key': session['key'], 'uploadId': session['uploadId']}, status=404)
+
+    def test_finished_session_cannot_be_resumed(self):
+        session = self.start(b'x' * (self.PART_SIZE + 1))
+        self.call('/api/uploads/abort', {'key': session['key'], 'uploadId': session['uploadId']})
+
+        self.resume(session, status=404)
+
+    def test_stale_sessions_are_aborted_by_the_scheduled_job(self):
+        old = self.start(b'x' * (self.PART_SIZE + 1))
+        fresh = self.start(b'y' * (self.PART_SIZE + 1))
+        self.s3.uploads[old['uploadId']]['Initiated'] -= timedelta(seconds=unified_lambda.UPLOAD_SESSION_TTL + 60)
+
+        with patch('unified_lambda.reconcile_stats') as reconcile:
+            unified_lambda.lambda_handler({'source': 'aws.events'}, {})
+
+        reconcile.assert_called_once()
+        self.assertEqual(list(self.s3.uploads), [fresh['uploadId']])
+
+
+class TestContentAddressedUpload(DirectUploadTestCase):
+
+    def start(self, body, sha256=None):
+        return self.call('/api/uploads', {'name': 'sunset.jpg', 'contentType': 'image/jpeg', 'size': len(body),
+                                          'sha256': sha256 or hashlib.sha256(body).hexdigest()})
+
+    def test_known_content_costs_one_request(self):
+        body = b'x' * 500
+        sha256 = hashlib.sha256(body).hexdigest()
+        session = self.start(body)
+
+        self.assertEqual(session['key'], f'pictures/{sha256}.jpg')
+        self.assertEqual(base64.b64decode(session['headers']['x-amz-checksum-sha256']), hashlib.sha256(body).digest())
+        self.browser_put(session, body)
+        self.call('/api/uploads/complete', {'key': session['key'], 'name': 'sunset.jpg'})
+
+        existing = self.call('/api/uploads/check', {'hashes': [sha256, '0' * 64, 'not-a-hash']})['existing']
+        self.assertEqual(existing, {sha256: {'key': session['key'], 'name': 'sunset.jpg'}})
+
+        self.s3.reset_calls()
+        again = self.call('/api/uploads', {'name': 'copy.jpg', 'size': len(body), 'sha256': sha256.upper()})
+
+        self.assertEqual((again['key'], again['original_name'], again['duplicate']), (session['key'], 'sunset.jpg', True))
+        self.assertEqual(self.s3.calls['put_object'], 0)
+        self.assertEqual(self.s3.calls['create_multipart_upload'], 0)
+        self.assertEqual(unified_lambda.load_stats()['total_pictures'], 1)
+
+    def upload_parts(self, session, body):
+        for part in session['parts']:
+            start = (part['partNumber'] - 1) * session['partSize']
+            self.s3.upload_part(Bucket='b', Key=session['key'], UploadId=session['uploadId'],
+                                PartNumber=part['partNumber'], Body=body[start:start + session['partSize']])
+
+    def test_multipart_content_is_staged_until_verified(self):
+        body = bytes(range(256)) * 10
+        sha256 = hashlib.sha256(body).hexdigest()
+        session = self.start(body)
+        self.assertTrue(session['key'].startswith(unified_lambda.UPLOADS_PREFIX))
+        self.upload_parts(session, body)
+
+        result = self.call('/api/uploads/complete', {'key': session['key'], 'uploadId': session['uploadId']})
+
+        self.assertEqual(result['key'], f'pictures/{sha256}.jpg')
+        self.assertEqual(self.s3.objects[result['key']]['Body'], body)
+        self.assertEqual(self.s3.objects[result['key']]['Metadata']['original-name'], 'sunset.jpg')
+        self.assertEqual([key for key in self.s3.objects if key.startswith(unified_lambda.UPLOADS_PREFIX)], [])
+        self.assertIn(result['key'], unified_lambda.load_manifest()['pictures'])
+
+    def test_retried_staged_completion_finds_the_content_key(self):
+        body = bytes(range(256)) * 10
+        session = self.start(body)
+        self.upload_parts(session, body)
+        request = {'key': session['key'], 'uploadId': session['uploadId']}
+
+        first = self.call('/api/uploads/complete', request)
+        again = self.call('/api/uploads/complete', request)
+
+        self.assertEqual(again['key'], first['key'])
+        self.assertEqual(again['original_name'], 'sunset.jpg')
+        self.assertEqual(self.s3.calls['copy_object'], 1)
+
+    def test_uploads_too_large_for_one_copy_are_promoted_in_parts(self):
+        body = bytes(range(256)) * 10
+        session = self.start(body)
+        self.upload_parts(session, body)
+
+        with patch('unified_lambda.COPY_OBJECT_LIMIT', 2048), \
+                patch('unified_lambda.MULTIPART_COPY_PART_SIZE', self.PART_SIZE):
+            result = self.call('/api/uploads/complete', {'key': session['key'], 'uploadId': session['uploadId']})
+
+        self.assertEqual(self.s3.objects[result['key']]['Body'], body)
+        self.assertEqual(self.s3.objects[result['key']]['Metadata']['original-name'], 'sunset.jpg')
+        self.assertEqual(self.s3.calls['copy_object'], 0)
+        self.assertEqual(self.s3.calls['upload_part_copy'], 3)
+        self.assertEqual(self.s3.uploads, {})
+
+    def test_upload_claiming_an_existing_hash_cannot_replace_it(self):
+        body = bytes(range(256)) * 10
+        sha256 = hashlib.sha256(body).hexdigest()
+        original = self.start(body)
+        # A session signed before the original finished, then sent other bytes
+        forged = self.start(b'y' * len(body), sha256=sha256)
+        self.upload_parts(original, body)
+        self.call('/api/uploads/complete', {'key': original['key'], 'uploadId': original['uploadId']})
+        self.upload_parts(forged, b'y' * len(body))
+
+        self.call('/api/uploads/complete', {'key': forged['key'], 'uploadId': forged['uploadId']}, status=400)
+
+        content_key = f'pictures/{sha256}.jpg'
+        self.assertEqual(self.s3.objects[content_key]['Body'], body)
+        self.assertIn(content_key, unified_lambda.load_manifest()['pictures'])
+        self.assertNotIn(forged['key'], self.s3.objects)
+
+    def test_sessions_on_content_keys_must_start_over(self):
+        sha256 = 'b' * 64
+        upload_id = self.s3.create_multipart_upload(Bucket='b', Key=f'pictures/{sha256}.jpg')['UploadId']
+        old_session = {'key': f'pictures/{sha256}.jpg', 'uploadId': upload_id}
+
+        self.call('/api/uploads/complete', old_session, status=409)
+        self.call('/api/uploads/resume', {**old_session, 'size': 4096, 'partSize': self.PART_SIZE}, status=404)
+
+    def test_inline_reupload_is_not_stored_again(self):
+        def upload(name):
+            response = unified_lambda.lambda_handler({
+                'requestContext': {'http': {'method': 'POST'}},
+                'rawPath': '/api/pictures',
+                'body': json.dumps({'name': name, 'data': base64.b64encode(b'same bytes').decode('ascii')}),
+                'isBase64Encoded': False
+            }, {})
+            return json.loads(response['body'])
+
+        first = upload('a.jpg')
+        second = upload('b.jpg')
+
+        self.assertEqual(second['key'], first['key'])
+        self.assertTrue(second['duplicate'])
+        pictures = [key for key in self.s3.objects if key.startswith(unified_lambda.PICTURES_PREFIX)]
+        self.assertEqual(pictures, [first['key']])
+        self.assertEqual(unified_lambda.load_stats()['total_pictures'], 1)
+
+    def test_invalid_hashes_are_rejected(self):
+        self.call('/api/uploads', {'name': 'a.jpg', 'size': 10, 'sha256': 'abc'}, status=400)
+        self.call('/api/uploads/check', {'hashes': 'abc'}, status=400)
+
+
+if __name__ == '__main__':
+    unittest.main()
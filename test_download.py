@@ -5,12 +5,15 @@ Test script for bulk download functionality
 """
 
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import patch
 import json
 import base64
 import zipfile
 import io
+import random
+import unified_lambda
 from unified_lambda import download_pictures
+from fake_s3 import FakeS3Client
 
 class TestDownloadFunctionality(unittest.TestCase):
     
@@ -18,34 +21,15 @@ class TestDownloadFunctionality(unittest.TestCase):
     def test_download_pictures_success(self, mock_s3):
         """Test successful download of multiple pictures"""
         
-        # Mock S3 responses
-        mock_s3.list_objects_v2.return_value = {
-            'Contents': [
-                {'Key': 'pictures/20240101_123456_abc123.jpg'},
-                {'Key': 'pictures/20240102_234567_def456.png'}
-            ]
-        }
-        
-        # Mock head_object responses for metadata
-        def mock_head_object(Bucket, Key):
-            if 'abc123.jpg' in Key:
-                return {'Metadata': {'original-name': 'sunset.jpg'}}
-            elif 'def456.png' in Key:
-                return {'Metadata': {'original-name': 'mountain.png'}}
-            return {'Metadata': {}}
-        
-        mock_s3.head_object.side_effect = mock_head_object
-        
-        # Mock get_object responses for actual image data
-        def mock_get_object(Bucket, Key):
-            mock_body = Mock()
-            if 'abc123.jpg' in Key:
-                mock_body.read.return_value = b'fake_jpg_data'
-            elif 'def456.png' in Key:
-                mock_body.read.return_value = b'fake_png_data'
-            return {'Body': mock_body}
-        
-        mock_s3.get_object.side_effect = mock_get_object
+        # Stand-in S3 holding the two pictures and their original names
+        fake_s3 = FakeS3Client()
+        fake_s3.add_object('pictures/20240101_123456_abc123.jpg', b'fake_jpg_data',
+                           metadata={'original-name': 'sunset.jpg'})
+        fake_s3.add_object('pictures/20240102_234567_def456.png', b'fake_png_data',
+                           metadata={'original-name': 'mountain.png'}, content_type='image/png')
+        for name in ('list_objects_v2', 'head_object', 'get_object', 'put_object'):
+            getattr(mock_s3, name).side_effect = getattr(fake_s3, name)
+        unified_lambda._metadata_cache.clear()
         
         # Create test event
         event = {
@@ -110,6 +94,98 @@ class TestDownloadFunctionality(unittest.TestCase):
         error_data = json.loads(response['body'])
         self.assertIn('None of the requested pictures were found', error_data['error'])
 
+class TestStreamingDownload(unittest.TestCase):
+    
+    PART_SIZE = 64 * 1024
+    
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.s3.min_part_size = self.PART_SIZE
+        self.payloads = {}
+        for i in range(6):
+            # Incompressible bodies so the archive spans several parts
+            body = random.Random(i).randbytes(50 * 1024)
+            self.payloads[f'photo{i}.jpg'] = body
+            self.s3.add_object(f'pictures/20240101_00000{i}_{i:08x}.jpg', body,
+                               metadata={'original-name': f'photo{i}.jpg'})
+        for target, value in (('s3_client', self.s3),
+                              ('DOWNLOAD_INLINE_LIMIT', 100 * 1024),
+                              ('MULTIPART_PART_SIZE', self.PART_SIZE),
+                              ('MULTIPART_MIN_PART_SIZE', self.PART_SIZE)):
+            patcher = patch(f'unified_lambda.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+    
+    def download(self, names):
+        return download_pictures({'body': json.dumps({'pictures': names})})
+    
+    def archive_keys(self):
+        return [key for key in self.s3.objects if key.startswith(unified_lambda.DOWNLOADS_PREFIX)]
+    
+    def test_large_selection_streams_to_multipart_upload(self):
+        response = self.download(sorted(self.payloads) + ['missing.jpg'])
+        
+        self.assertEqual(response['statusCode'], 200)
+        result = json.loads(response['body'])
+        self.assertEqual(result['count'], 6)
+        self.assertIn('url', result)
+        self.assertGreater(self.s3.calls['upload_part'], 1)
+        self.assertEqual(self.s3.uploads, {})
+        
+        [archive_key] = self.archive_keys()
+        with zipfile.ZipFile(io.BytesIO(self.s3.objects[archive_key]['Body'])) as zip_file:
+            self.assertEqual(sorted(zip_file.namelist()), sorted(self.payloads))
+            for name, body in self.payloads.items():
+                self.assertEqual(zip_file.read(name), body)
+    
+    def test_small_selection_is_returned_inline(self):
+        response = self.download(['photo0.jpg'])
+        
+        self.assertTrue(response['isBase64Encoded'])
+        self.assertEqual(self.s3.calls['create_multipart_upload'], 0)
+        with zipfile.ZipFile(io.BytesIO(base64.b64decode(response['body']))) as zip_file:
+            self.assertEqual(zip_file.read('photo0.jpg'), self.payloads['photo0.jpg'])
+    
+    def test_failed_upload_is_aborted(self):
+        with patch.object(self.s3, 'upload_part', side_effect=RuntimeError('boom')):
+            response = self.download(sorted(self.payloads))
+        
+        self.assertEqual(response['statusCode'], 500)
+        self.assertEqual(self.s3.calls['abort_multipart_upload'], 1)
+        self.assertEqual(self.s3.uploads, {})
+        self.assertEqual(self.archive_keys(), [])
+
+class TestCompressionPolicy(unittest.TestCase):
+    
+    def test_compressed_formats_are_stored(self):
+        text = b'plain text ' * 1000
+        self.assertEqual(unified_lambda.choose_compression('image/jpeg', text), zipfile.ZIP_STORED)
+        self.assertEqual(unified_lambda.choose_compression('IMAGE/PNG; charset=binary', text),
+                         zipfile.ZIP_STORED)
+    
+    def test_probe_decides_other_types(self):
+        noise = random.Random(0).randbytes(100 * 1024)
+        text = b'{"caption": "sunset over the bay"}\n' * 2000
+        self.assertEqual(unified_lambda.choose_compression('binary/octet-stream', noise), zipfile.ZIP_STORED)
+        self.assertEqual(unified_lambda.choose_compression('binary/octet-stream', text), zipfile.ZIP_DEFLATED)
+        self.assertEqual(unified_lambda.choose_compression(None, b''), zipfile.ZIP_STORED)
+    
+    @patch('unified_lambda.s3_client')
+    def test_archive_entries_use_their_own_method(self, mock_s3):
+        fake_s3 = FakeS3Client()
+        fake_s3.add_object('pictures/a.jpg', random.Random(1).randbytes(4096), content_type='image/jpeg')
+        fake_s3.add_object('pictures/b.bmp', b'\x00' * 4096, content_type='image/bmp')
+        mock_s3.get_object.side_effect = fake_s3.get_object
+        
+        buffer = io.BytesIO()
+        unified_lambda.write_zip_entries(buffer, [('a.jpg', 'pictures/a.jpg'), ('b.bmp', 'pictures/b.bmp')])
+        
+        with zipfile.ZipFile(buffer) as zip_file:
+            methods = {info.filename: info.compress_type for info in zip_file.infolist()}
+            self.assertEqual(zip_file.read('b.bmp'), b'\x00' * 4096)
+        self.assertEqual(methods, {'a.jpg': zipfile.ZIP_STORED, 'b.bmp': zipfile.ZIP_DEFLATED})
+
 def run_tests():
     """Run the download functionality tests"""
     print("🧪 Testing bulk download functionality...")
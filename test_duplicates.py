@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Tests for perceptual-hash near-duplicate detection
+"""
+
+import base64
+import io
+import json
+import random
+import unittest
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+
+def scene(seed, size=(800, 600)):
+    """Soft blocks of colour, standing in for a photograph's large shapes"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle([x, y, x + rng.randint(50, 300), y + rng.randint(50, 300)],
+                       fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    return image.filter(ImageFilter.GaussianBlur(6))
+
+
+def encode(image, format='JPEG', **options):
+    output = io.BytesIO()
+    image.save(output, format=format, **options)
+    return output.getvalue()
+
+
+class TestPerceptualHash(unittest.TestCase):
+
+    def test_copies_are_close_and_other_pictures_are_far(self):
+        original = unified_lambda.perceptual_hash(encode(scene(1), quality=95))
+        resized = unified_lambda.perceptual_hash(encode(scene(1).resize((400, 300)), quality=40))
+        as_png = unified_lambda.perceptual_hash(encode(scene(1), 'PNG'))
+        other = unified_lambda.perceptual_hash(encode(scene(2), quality=95))
+
+        self.assertRegex(original, r'^[0-9a-f]{16}$')
+        self.assertLessEqual(unified_lambda.hamming_distance(original, resized), 4)
+        self.assertLessEqual(unified_lambda.hamming_distance(original, as_png), 4)
+        self.assertGreater(unified_lambda.hamming_distance(original, other), unified_lambda.NEAR_DUPLICATE_DISTANCE)
+        self.assertIsNone(unified_lambda.perceptual_hash(b'not an image'))
+
+    def test_tree_search_matches_a_linear_scan_while_visiting_fewer_nodes(self):
+        rng = random.Random(0)
+        hashes = {f'pictures/{i}.jpg': f'{rng.getrandbits(64):016x}' for i in range(2000)}
+        tree = None
+        for key, phash in hashes.items():
+            tree = unified_lambda.phash_tree_insert(tree, phash, key)
+        # A near copy of an existing picture, plus an exact duplicate hash
+        probe = f"{int(hashes['pictures/7.jpg'], 16) ^ 0b1011:016x}"
+        tree = unified_lambda.phash_tree_insert(tree, hashes['pictures/7.jpg'], 'pictures/copy.jpg')
+
+        with patch('unified_lambda.hamming_distance', wraps=unified_lambda.hamming_distance) as distance:
+            found = dict(unified_lambda.phash_tree_search(tree, probe, 4))
+
+        linear = {key: unified_lambda.hamming_distance(probe, phash) for key, phash in hashes.items()}
+        linear['pictures/copy.jpg'] = linear['pictures/7.jpg']
+        self.assertEqual(found, {key: distance for key, distance in linear.items() if distance <= 4})
+        self.assertEqual(found['pictures/copy.jpg'], 3)
+        self.assertLess(distance.call_count, len(hashes) // 2)
+
+        unified_lambda.phash_tree_remove(tree, hashes['pictures/7.jpg'], 'pictures/7.jpg')
+        self.assertEqual(dict(unified_lambda.phash_tree_search(tree, probe, 4)), {'pictures/copy.jpg': 3})
+
+
+class TestDuplicateReport(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+        unified_lambda.load_stats()
+
+    def call(self, method, path, body=None, query=None, status=200):
+        response = unified_lambda.lambda_handler(api_event(method, path, body, query), {})
+        self.assertEqual(response['statusCode'], status, response['body'])
+        return json.loads(response['body'])
+
+    def upload(self, name, data):
+        return self.call('POST', '/api/pictures', {
+            'name': name,
+            'data': base64.b64encode(data).decode('ascii'),
+            'contentType': 'image/jpeg'
+        })['key']
+
+    def test_report_groups_copies_and_cleanup_keeps_the_largest(self):
+        small = self.upload('beach.jpg', encode(scene(1).resize((400, 300)), quality=50))
+        large = self.upload('beach.jpg', encode(scene(1), quality=95))
+        self.upload('forest.jpg', encode(scene(2)))
+
+        report = self.call('GET', '/api/pictures/duplicates')
+
+        self.assertEqual(report['duplicate_count'], 1)
+        [group] = report['groups']
+        self.assertEqual([picture['id'] for picture in group],
+                         [large[len('pictures/'):], small[len('pictures/'):]])
+
+        # Both copies share a name, so cleanup deletes by id
+        self.call('DELETE', '/api/pictures', {'ids': [group[1]['id']]})
+
+        self.assertNotIn(small, self.s3.objects)
+        self.assertIn(large, self.s3.objects)
+        self.assertEqual(self.call('GET', '/api/pictures/duplicates')['groups'], [])
+
+    def test_near_duplicates_of_one_picture(self):
+        self.upload('original.jpg', encode(scene(3), quality=95))
+        self.upload('shared.jpg', encode(scene(3).resize((600, 450)), quality=60))
+
+        result = self.call('GET', '/api/pictures/duplicates', query={'picture': 'original.jpg', 'distance': '6'})
+
+        self.assertEqual([match['name'] for match in result['duplicates']], ['shared.jpg'])
+        self.assertLessEqual(result['duplicates'][0]['distance'], 6)
+        self.call('GET', '/api/pictures/duplicates', query={'picture': 'missing.jpg'}, status=404)
+        self.call('GET', '/api/pictures/duplicates', query={'distance': '65'}, status=400)
+
+    def test_concurrent_index_updates_are_all_kept(self):
+        self.upload('seed.jpg', encode(scene(5)))
+        read_document_version = unified_lambda.read_document_version
+        interleaved = []
+
+        def read_then_race(*args):
+            result = read_document_version(*args)
+            if args[0] == unified_lambda.PHASH_INDEX_KEY and not interleaved:
+                # Another upload lands between this writer's read and its write
+                interleaved.append(True)
+                unified_lambda.update_phash_index(added=[{'key': 'pictures/b.jpg', 'phash': 'f' * 16}])
+            return result
+
+        with patch('unified_lambda.read_document_version', side_effect=read_then_race):
+            unified_lambda.update_phash_index(added=[{'key': 'pictures/a.jpg', 'phash': '0' * 16}])
+
+        tree = unified_lambda.load_phash_index()['tree']
+        self.assertEqual([key for key, _ in unified_lambda.phash_tree_search(tree, '0' * 16, 0)], ['pictures/a.jpg'])
+        self.assertEqual([key for key, _ in unified_lambda.phash_tree_search(tree, 'f' * 16, 0)], ['pictures/b.jpg'])
+
+    def test_reconcile_rebuilds_the_index(self):
+        first = self.upload('one.jpg', encode(scene(4), quality=95))
+        second = self.upload('two.jpg', encode(scene(4), quality=70))
+        # An index that lost both pictures to a concurrent writer
+        unified_lambda.save_phash_index({'version': 1, 'tree': None})
+
+        unified_lambda.lambda_handler({'source': 'aws.events'}, {})
+
+        tree = unified_lambda.load_phash_index()['tree']
+        phash = unified_lambda.load_manifest()['pictures'][first]['phash']
+        self.assertEqual({key for key, _ in unified_lambda.phash_tree_search(tree, phash, 4)}, {first, second})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Tests for upload-time image properties in the gallery manifest
+"""
+
+import base64
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+from PIL import Image, ImageFile
+
+import gallery_common
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+
+def jpeg_bytes(size, orientation=None, taken=None, make=None, model=None):
+    exif = Image.Exif()
+    if orientation:
+        exif[gallery_common.EXIF_ORIENTATION] = orientation
+    if make:
+        exif[gallery_common.EXIF_MAKE] = make
+    if model:
+        exif[gallery_common.EXIF_MODEL] = model
+    if taken:
+        exif.get_ifd(gallery_common.EXIF_IFD)[gallery_common.EXIF_DATETIME_ORIGINAL] = taken
+    output = io.BytesIO()
+    Image.new('RGB', size, (30, 120, 200)).save(output, format='JPEG', exif=exif)
+    return output.getvalue()
+
+
+class TestReadImageProperties(unittest.TestCase):
+
+    def test_exif_details_are_read_from_the_header(self):
+        data = jpeg_bytes((3000, 2000), orientation=6, taken='2023:07:04 18:30:00',
+                          make='Canon', model='EOS R6')
+
+        with patch.object(ImageFile.ImageFile, 'load', side_effect=AssertionError('decoded pixels')):
+            properties = unified_lambda.read_image_properties(data)
+
+        self.assertEqual(properties, {
+            'width': 2000,
+            'height': 3000,
+            'orientation': 6,
+            'taken': '2023-07-04T18:30:00',
+            'camera': 'Canon EOS R6'
+        })
+
+    def test_truncated_upload_still_yields_dimensions(self):
+        data = jpeg_bytes((1600, 900), model='Pixel 8')
+
+        properties = unified_lambda.read_image_properties(data[:1024])
+
+        self.assertEqual((properties['width'], properties['height']), (1600, 900))
+        self.assertEqual(properties['camera'], 'Pixel 8')
+        self.assertIsNone(properties['taken'])
+
+    def test_unreadable_data_records_unknown_properties(self):
+        properties = unified_lambda.read_image_properties(b'not an image')
+
+        self.assertEqual(properties, dict.fromkeys(unified_lambda.IMAGE_HEADER_FIELDS))
+        self.assertIsNone(gallery_common.parse_exif_datetime('0000:00:00 00:00:00'))
+
+
+class TestManifestProperties(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+        unified_lambda.load_stats()
+
+    def call(self, method, path, body=None, query=None):
+        response = unified_lambda.lambda_handler(api_event(method, path, body, query), {})
+        self.assertEqual(response['statusCode'], 200, response['body'])
+        return json.loads(response['body'])
+
+    def upload(self, name, data):
+        return self.call('POST', '/api/pictures', {
+            'name': name,
+            'data': base64.b64encode(data).decode('ascii'),
+            'contentType': 'image/jpeg'
+        })['key']
+
+    def test_listing_sorts_by_date_taken_across_pages(self):
+        self.upload('2021.jpg', jpeg_bytes((400, 300), taken='2021:01:01 09:00:00'))
+        self.upload('2019.jpg', jpeg_bytes((300, 400), taken='2019:06:01 12:00:00', model='iPhone 12'))
+        self.upload('2020.jpg', jpeg_bytes((400, 300), taken='2020:03:15 08:00:00'))
+        self.s3.reset_calls()
+
+        first = self.call('GET', '/api/pictures', query={'sort': 'taken', 'limit': '2'})
+        second = self.call('GET', '/api/pictures', query={'sort': 'taken', 'limit': '2',
+                                                          'cursor': first['next_cursor']})
+
+        names = [p['name'] for p in first['pictures'] + second['pictures']]
+        self.assertEqual(names, ['2021.jpg', '2020.jpg', '2019.jpg'])
+        oldest = second['pictures'][0]
+        self.assertEqual((oldest['width'], oldest['height']), (300, 400))
+        self.assertEqual((oldest['taken'], oldest['camera']), ('2019-06-01T12:00:00', 'iPhone 12'))
+        # Sorting is answered from the manifest alone
+        self.assertEqual(self.s3.calls['get_object'], 2)
+        self.assertEqual(self.s3.calls['head_object'], 0)
+
+    def test_unknown_sort_order_is_rejected(self):
+        response = unified_lambda.lambda_handler(api_event('GET', '/api/pictures', query={'sort': 'size'}), {})
+        self.assertEqual(response['statusCode'], 400)
+
+    def test_reconcile_keeps_and_backfills_properties(self):
+        key = self.upload('kept.jpg', jpeg_bytes((640, 480), taken='2022:02:02 10:00:00'))
+        legacy = 'pictures/20200101_000000_legacy00.jpg'
+        self.s3.add_object(legacy, jpeg_bytes((800, 600), orientation=8), metadata={'original-name': 'legacy.jpg'})
+
+        with patch('unified_lambda.read_image_properties', wraps=unified_lambda.read_image_properties) as read:
+            unified_lambda.lambda_handler({'source': 'aws.events'}, {})
+
+        # Only the picture that was never registered is read again
+        read.assert_called_once()
+        pictures = unified_lambda.load_manifest()['pictures']
+        self.assertEqual(pictures[key]['taken'], '2022-02-02T10:00:00')
+        self.assertEqual((pictures[legacy]['width'], pictures[legacy]['height'], pictures[legacy]['orientation']),
+                         (600, 800, 8))
+
+    def test_properties_survive_a_rebuild_from_scratch(self):
+        key = self.upload('kept.jpg', jpeg_bytes((640, 480), taken='2022:02:02 10:00:00', model='Pixel 8'))
+        unified_lambda.invalidate_manifest()
+
+        with patch('unified_lambda.read_image_properties', side_effect=AssertionError('decoded again')):
+            entry = unified_lambda.load_manifest()['pictures'][key]
+
+        self.assertEqual((entry['width'], entry['height']), (640, 480))
+        self.assertEqual((entry['taken'], entry['camera']), ('2022-02-02T10:00:00', 'Pixel 8'))
+        self.assertIn('phash', entry)
+
+    def test_deleting_a_picture_removes_its_properties(self):
+        key = self.upload('gone.jpg', jpeg_bytes((64, 48)))
+        self.assertIn(unified_lambda.image_properties_key(key), self.s3.objects)
+
+        self.call('DELETE', '/api/pictures', {'ids': [key[len(unified_lambda.PICTURES_PREFIX):]]})
+
+        self.assertNotIn(unified_lambda.image_properties_key(key), self.s3.objects)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the paginated, parallel bucket listing engine
+"""
+
+import unittest
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import gallery_common
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+
+class TestBucketListing(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+
+    def listed_keys(self, prefix='pictures/'):
+        return [obj['Key'] for obj in unified_lambda.iter_bucket_objects(prefix, client=self.s3)]
+
+    def test_small_listing_is_a_single_request(self):
+        for i in range(10):
+            self.s3.add_object(f'pictures/20240101_{i:06d}_abcd.jpg')
+
+        self.assertEqual(len(self.listed_keys()), 10)
+        self.assertEqual(self.s3.calls['list_objects_v2'], 1)
+
+    def test_date_keys_past_first_page_are_all_listed_once(self):
+        keys = set()
+        for month in range(1, 13):
+            for i in range(250):
+                keys.add(f'pictures/2024{month:02d}15_{i:06d}_{uuid.uuid4().hex[:8]}.jpg')
+        for key in keys:
+            self.s3.add_object(key)
+        self.s3.add_object('pictures/sunset.jpg')
+        keys.add('pictures/sunset.jpg')
+
+        listed = self.listed_keys()
+
+        self.assertEqual(len(listed), len(keys))
+        self.assertEqual(set(listed), keys)
+        self.assertGreater(self.s3.calls['list_objects_v2'], 3)
+
+    def test_hash_keys_are_split_on_leading_character(self):
+        keys = {f'pictures/{uuid.uuid4().hex}.jpg' for _ in range(2600)}
+        for key in keys:
+            self.s3.add_object(key)
+
+        listed = self.listed_keys()
+
+        self.assertEqual(sorted(listed), sorted(keys))
+
+    def test_partitions_are_bounded_for_old_galleries(self):
+        boundaries = gallery_common.listing_partitions('pictures/', 'pictures/19900101_000000_x.jpg')
+
+        self.assertLessEqual(len(boundaries), gallery_common.LIST_MAX_PARTITIONS)
+        self.assertEqual(boundaries, sorted(boundaries))
+        now = datetime.now(timezone.utc)
+        self.assertGreaterEqual(boundaries[-1], f'pictures/{now.year:04d}{now.month:02d}')
+
+    def test_stats_count_objects_beyond_first_page(self):
+        for i in range(1500):
+            self.s3.add_object(f'pictures/20240101_{i:06d}_abcd.jpg', b'12345')
+
+        with patch('unified_lambda.s3_client', self.s3):
+            response = unified_lambda.get_stats()
+
+        self.assertIn('"totalPictures": 1500', response['body'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the gallery manifest that backs GET /api/pictures
+"""
+
+import json
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+
+class TestGalleryManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.s3.add_object(
+            'pictures/20240101_120000_aaaa1111.jpg',
+            b'sunset-bytes',
+            metadata={'original-name': 'sunset.jpg', 'rating': '4'},
+            last_modified=datetime(2024, 1, 1, tzinfo=timezone.utc)
+        )
+        self.s3.add_object(
+            'pictures/20240102_120000_bbbb2222.png',
+            b'mountain-bytes',
+            metadata={'original-name': 'mountain.png'},
+            content_type='image/png',
+            last_modified=datetime(2024, 1, 2, tzinfo=timezone.utc)
+        )
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+
+    def list_pictures(self):
+        response = unified_lambda.lambda_handler(api_event('GET', '/api/pictures'), {})
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])['pictures']
+
+    def test_missing_manifest_is_rebuilt_and_saved(self):
+        pictures = self.list_pictures()
+
+        self.assertEqual([p['name'] for p in pictures], ['mountain.png', 'sunset.jpg'])
+        self.assertEqual(pictures[1]['rating'], 4)
+        self.assertEqual(pictures[1]['size'], len(b'sunset-bytes'))
+        self.assertIn(unified_lambda.MANIFEST_KEY, self.s3.objects)
+
+    def test_listing_with_manifest_costs_one_get(self):
+        self.list_pictures()
+        self.s3.reset_calls()
+
+        pictures = self.list_pictures()
+
+        self.assertEqual(len(pictures), 2)
+        self.assertEqual(self.s3.calls['get_object'], 1)
+        self.assertEqual(self.s3.calls['head_object'], 0)
+        self.assertEqual(self.s3.calls['list_objects_v2'], 0)
+
+    def test_upload_adds_manifest_entry(self):
+        self.list_pictures()
+
+        response = unified_lambda.lambda_handler(api_event('POST', '/api/pictures', {
+            'name': 'beach.jpg',
+            'data': 'YmVhY2g=',
+            'contentType': 'image/jpeg'
+        }), {})
+        self.assertEqual(response['statusCode'], 200)
+
+        pictures = self.list_pictures()
+        self.assertEqual(pictures[0]['name'], 'beach.jpg')
+        self.assertEqual(pictures[0]['size'], len(b'beach'))
+
+    def test_rate_and_comment_reach_manifest_at_rebuild(self):
+        self.list_pictures()
+
+        unified_lambda.lambda_handler(api_event('POST', '/api/pictures/rate', {
+            'picture': 'mountain.png', 'rating': 5
+        }), {})
+        unified_lambda.lambda_handler(api_event('POST', '/api/pictures/comment', {
+            'picture': 'mountain.png', 'author': 'Ann', 'text': 'Wow'
+        }), {})
+        unified_lambda.lambda_handler({'source': 'aws.events'}, {})
+
+        manifest = json.loads(self.s3.objects[unified_lambda.MANIFEST_KEY]['Body'])
+        entry = manifest['pictures']['pictures/20240102_120000_bbbb2222.png']
+        self.assertEqual(entry['rating'], 5)
+        self.assertEqual(entry['comment_count'], 1)
+
+    def test_delete_removes_manifest_entry(self):
+        self.list_pictures()
+
+        response = unified_lambda.lambda_handler(api_event('DELETE', '/api/pictures', {
+            'pictures': ['sunset.jpg']
+        }), {})
+        self.assertEqual(response['statusCode'], 200)
+
+        self.assertEqual([p['name'] for p in self.list_pictures()], ['mountain.png'])
+
+
+    def test_concurrent_writers_do_not_drop_each_others_entries(self):
+        self.list_pictures()
+        read_manifest_version = unified_lambda.read_manifest_version
+        interleaved = []
+
+        def read_then_race(*args):
+            result = read_manifest_version(*args)
+            if not interleaved:
+                # Another upload lands between this writer's read and its write
+                interleaved.append(True)
+                unified_lambda.upsert_manifest_entry(unified_lambda.build_manifest_entry('pictures/b.jpg', 'b.jpg', ''))
+            return result
+
+        with patch('unified_lambda.read_manifest_version', side_effect=read_then_race):
+            unified_lambda.upsert_manifest_entry(unified_lambda.build_manifest_entry('pictures/a.jpg', 'a.jpg', ''))
+
+        pictures = json.loads(self.s3.objects[unified_lambda.MANIFEST_KEY]['Body'])['pictures']
+        self.assertIn('pictures/a.jpg', pictures)
+        self.assertIn('pictures/b.jpg', pictures)
+        self.assertEqual(len(pictures), 4)
+
+    def test_registration_does_not_write_a_copy_read_before_rendering(self):
+        self.list_pictures()
+        self.s3.add_object('pictures/new.jpg', b'not really an image')
+
+        def render_while_others_delete(key, image_bytes):
+            unified_lambda.remove_manifest_entries(['pictures/20240101_120000_aaaa1111.jpg'])
+            return []
+
+        with patch('unified_lambda.generate_derivatives', side_effect=render_while_others_delete):
+            unified_lambda.register_picture('pictures/new.jpg', 'new.jpg', 19, 'image/jpeg')
+
+        self.assertEqual(sorted(json.loads(self.s3.objects[unified_lambda.MANIFEST_KEY]['Body'])['pictures']),
+                         ['pictures/20240102_120000_bbbb2222.png', 'pictures/new.jpg'])
+
+    def test_failed_update_keeps_the_manifest(self):
+        self.list_pictures()
+
+        with patch('unified_lambda.modify_manifest', side_effect=RuntimeError('Manifest kept changing')):
+            unified_lambda.upsert_manifest_entry(unified_lambda.build_manifest_entry('pictures/a.jpg', 'a.jpg', ''))
+
+        self.assertIn(unified_lambda.MANIFEST_KEY, self.s3.objects)
+        self.assertEqual(len(self.list_pictures()), 2)
+
+    def test_rebuilt_manifest_does_not_overwrite_a_concurrent_write(self):
+        rebuild_manifest = unified_lambda.rebuild_manifest
+
+        def rebuild_while_others_write(**kwargs):
+            manifest = rebuild_manifest(**kwargs)
+            # Another request saves its manifest while this one was rebuilding
+            unified_lambda.upsert_manifest_entry(unified_lambda.build_manifest_entry('pictures/b.jpg', 'b.jpg', ''))
+            return manifest
+
+        with patch('unified_lambda.rebuild_manifest', side_effect=rebuild_while_others_write):
+            unified_lambda.load_manifest()
+
+        pictures = json.loads(self.s3.objects[unified_lambda.MANIFEST_KEY]['Body'])['pictures']
+        self.assertIn('pictures/b.jpg', pictures)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the warm-container object metadata cache
+"""
+
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        for i in range(3):
+            self.s3.add_object(
+                f'pictures/2024010{i}_000000_{i:08x}.jpg',
+                f'image-{i}',
+                metadata={'original-name': f'photo{i}.jpg'},
+                last_modified=datetime(2024, 1, 1 + i, tzinfo=timezone.utc)
+            )
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+        self.addCleanup(unified_lambda._metadata_cache.clear)
+
+    def test_unchanged_objects_are_not_fetched_twice(self):
+        unified_lambda.rebuild_manifest()
+        self.assertEqual(self.s3.calls['head_object'], 3)
+
+        self.s3.reset_calls()
+        manifest = unified_lambda.rebuild_manifest()
+
+        self.assertEqual(self.s3.calls['head_object'], 0)
+        self.assertEqual(len(manifest['pictures']), 3)
+
+    def test_metadata_rewrite_is_revalidated_by_last_modified(self):
+        unified_lambda.rebuild_manifest()
+        key = 'pictures/20240101_000000_00000001.jpg'
+        etag = self.s3.objects[key]['ETag']
+
+        # Same bytes, so the ETag is unchanged - only LastModified moves
+        self.s3.add_object(key, 'image-1', metadata={'original-name': 'renamed.jpg'})
+        self.assertEqual(self.s3.objects[key]['ETag'], etag)
+
+        self.s3.reset_calls()
+        manifest = unified_lambda.rebuild_manifest()
+
+        self.assertEqual(self.s3.calls['head_object'], 1)
+        self.assertEqual(manifest['pictures'][key]['name'], 'renamed.jpg')
+
+    def test_cache_is_bounded_with_lru_eviction(self):
+        listing = self.s3.list_objects_v2(Bucket='b', Prefix='pictures/')['Contents']
+        with patch('unified_lambda.METADATA_CACHE_SIZE', 2):
+            for obj in listing:
+                unified_lambda.get_object_metadata(obj)
+
+        self.assertEqual(list(unified_lambda._metadata_cache), [o['Key'] for o in listing[1:]])
+
+    def test_returned_metadata_is_a_copy(self):
+        obj = self.s3.list_objects_v2(Bucket='b', Prefix='pictures/')['Contents'][0]
+        unified_lambda.get_object_metadata(obj)['Metadata']['rating'] = '5'
+
+        self.assertNotIn('rating', unified_lambda.get_object_metadata(obj)['Metadata'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the streaming multipart parser behind backend_lambda uploads
+"""
+
+import base64
+import io
+import json
+import tracemalloc
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+import backend_lambda
+from fake_s3 import FakeS3Client
+
+BOUNDARY = 'gallery-boundary'
+
+
+def multipart_body(fields=(), files=()):
+    body = b''
+    for name, value in fields:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                 f'{value}\r\n').encode()
+    for filename, data in files:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n').encode() + data + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def jpeg_bytes(size, color):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+class TestMultipartParser(unittest.TestCase):
+
+    content_type = f'multipart/form-data; boundary={BOUNDARY}'
+
+    def test_parts_are_views_into_the_body(self):
+        # File data may itself contain CRLFs and partial boundaries
+        tricky = b'\r\n--gallery\r\n\x00' * 100
+        body = multipart_body(fields=[('picture_date', '2024-05-01')],
+                              files=[('a.jpg', tricky), ('b.jpg', b'second')])
+
+        parts = list(backend_lambda.iter_multipart_parts(body, self.content_type))
+
+        self.assertEqual([(p['name'], p['filename']) for p in parts],
+                         [('picture_date', None), ('file', 'a.jpg'), ('file', 'b.jpg')])
+        self.assertEqual(bytes(parts[1]['data']), tricky)
+        self.assertEqual(parts[2]['content_type'], 'image/jpeg')
+        for part in parts:
+            self.assertIsInstance(part['data'], memoryview)
+            self.assertIs(part['data'].obj, body)
+
+    def test_parsing_does_not_copy_file_data(self):
+        files = [(f'{i}.jpg', bytes([i]) * (2 * 1024 * 1024)) for i in range(4)]
+        body = multipart_body(files=files)
+
+        tracemalloc.start()
+        try:
+            sizes = [len(part['data']) for part in backend_lambda.iter_multipart_parts(body, self.content_type)]
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(sizes, [2 * 1024 * 1024] * 4)
+        self.assertLess(peak, 64 * 1024)
+
+    def test_quoted_boundary_and_bare_newlines(self):
+        body = multipart_body(fields=[('picture_name', 'Été')]).replace(b'\r\n', b'\n')
+
+        [part] = backend_lambda.iter_multipart_parts(body, f'multipart/form-data; boundary="{BOUNDARY}"')
+
+        self.assertEqual(str(part['data'], 'utf-8'), 'Été')
+
+    def test_malformed_bodies_are_rejected(self):
+        unterminated = multipart_body(files=[('a.jpg', b'data')])[:-len(BOUNDARY) - 10]
+        for body, content_type in ((b'no parts', self.content_type),
+                                   (unterminated, self.content_type),
+                                   (multipart_body(), 'multipart/form-data')):
+            with self.assertRaises(ValueError):
+                list(backend_lambda.iter_multipart_parts(body, content_type))
+
+    def test_reader_serves_pillow_without_copying(self):
+        data = memoryview(jpeg_bytes((320, 240), 'red'))
+
+        image = backend_lambda.decode_downscaled(backend_lambda.MemoryviewReader(data), (160, 160))
+
+        self.assertEqual(image.size, (160, 120))
+
+
+class TestMultiFileUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        for target, value in (('s3_client', self.s3), ('insert_into_iceberg_table', lambda *args, **kwargs: None)):
+            patcher = patch(f'backend_lambda.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload(self, body):
+        response = backend_lambda.lambda_handler({
+            'requestContext': {'http': {'method': 'POST'}},
+            'rawPath': '/upload',
+            'headers': {'content-type': f'multipart/form-data; boundary={BOUNDARY}'},
+            'body': base64.b64encode(body).decode('ascii'),
+            'isBase64Encoded': True
+        }, {})
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_every_file_in_the_request_is_stored(self):
+        status, result = self.upload(multipart_body(
+            fields=[('picture_date', '2024-05-01')],
+            files=[('red.jpg', jpeg_bytes((64, 48), 'red')), ('blue.jpg', jpeg_bytes((64, 48), 'blue')),
+                   ('notes.txt', b'not a picture')]
+        ))
+
+        self.assertEqual(status, 201)
+        self.assertEqual(result['uploaded'], 2)
+        self.assertEqual([p['status'] for p in result['pictures']], [201, 201, 400])
+        self.assertEqual([p.get('picture_name') for p in result['pictures'][:2]], ['red.jpg', 'blue.jpg'])
+        stored = {key: obj['Metadata'] for key, obj in self.s3.objects.items()}
+        self.assertEqual(sorted(meta['picture_name'] for meta in stored.values()), ['blue.jpg', 'red.jpg'])
+        self.assertTrue(all(meta['picture_date'] == '2024-05-01' for meta in stored.values()))
+
+    def test_single_file_keeps_the_original_response(self):
+        status, result = self.upload(multipart_body(
+            fields=[('picture_name', 'Sunset')], files=[('IMG_1.jpg', jpeg_bytes((64, 48), 'orange'))]
+        ))
+
+        self.assertEqual(status, 201)
+        self.assertEqual(result['picture_name'], 'Sunset')
+        self.assertIn(result['id'], self.s3.objects)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""
+Tests for resolving picture names to S3 keys through the manifest name index
+"""
+
+import base64
+import io
+import json
+import unittest
+import zipfile
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+
+class TestNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        for i in range(50):
+            self.s3.add_object(
+                f'pictures/20240101_{i:06d}_{i:08x}.jpg',
+                f'image-{i}',
+                metadata={'original-name': f'photo{i:02d}.jpg'}
+            )
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+        unified_lambda.load_manifest()
+        self.s3.reset_calls()
+
+    def manifest(self):
+        return json.loads(self.s3.objects[unified_lambda.MANIFEST_KEY]['Body'])
+
+    def test_rating_costs_constant_s3_calls(self):
+        response = unified_lambda.rate_picture(api_event('POST', '/api/pictures/rate', {
+            'picture': 'photo07.jpg', 'rating': 3
+        }))
+
+        self.assertEqual(response['statusCode'], 200)
+        # The gallery is never listed
+        self.assertEqual(self.s3.calls['list_objects_v2'], 0)
+        self.assertEqual(self.s3.calls['head_object'], 1)
+        self.assertEqual(self.s3.calls['copy_object'], 0)
+        self.assertEqual(sum(self.s3.calls.values()), 5)  # GET manifest, HEAD, PUT vote, GET + PUT manifest
+
+    def test_comment_costs_constant_s3_calls(self):
+        response = unified_lambda.add_comment(api_event('POST', '/api/pictures/comment', {
+            'picture': 'photo33.jpg', 'author': 'Ann', 'text': 'Nice'
+        }))
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(self.s3.calls['head_object'], 0)
+        self.assertEqual(self.s3.calls['copy_object'], 0)
+        self.assertEqual(sum(self.s3.calls.values()), 4)  # GET manifest, PUT log entry, GET + PUT manifest
+
+    def test_download_resolves_all_names_without_head_requests(self):
+        names = [f'photo{i:02d}.jpg' for i in range(50)]
+        response = unified_lambda.download_pictures(api_event('POST', '/api/pictures/download', {
+            'pictures': names
+        }))
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(self.s3.calls['head_object'], 0)
+        self.assertEqual(self.s3.calls['get_object'], 51)  # manifest + 50 pictures
+
+    def test_delete_keeps_loose_name_matching(self):
+        response = unified_lambda.delete_pictures(api_event('DELETE', '/api/pictures', {
+            'pictures': ['PHOTO05', 'missing.jpg']
+        }))
+
+        body = json.loads(response['body'])
+        self.assertEqual(body['deleted_count'], 1)
+        self.assertEqual(body['not_found'], ['missing.jpg'])
+        self.assertNotIn('photo05.jpg', self.manifest()['names'])
+
+    def test_duplicate_names_fall_back_to_remaining_picture(self):
+        manifest = self.manifest()
+        duplicate = unified_lambda.build_manifest_entry('pictures/zzz.jpg', 'photo01.jpg', '')
+        unified_lambda.upsert_manifest_entry(duplicate, manifest=manifest)
+        original_key = manifest['names']['photo01.jpg']
+        self.assertNotEqual(original_key, 'pictures/zzz.jpg')
+
+        unified_lambda.remove_manifest_entries([original_key], manifest=manifest)
+
+        self.assertEqual(unified_lambda.find_picture_key(manifest, 'photo01.jpg'), 'pictures/zzz.jpg')
+
+    def test_selected_pictures_sharing_a_name_are_each_deleted(self):
+        self.s3.add_object('pictures/20240102_000000_ffffffff.jpg', b'copy', metadata={'original-name': 'photo01.jpg'})
+        unified_lambda.invalidate_manifest()
+        ids = ['20240101_000001_00000001.jpg', '20240102_000000_ffffffff.jpg']
+
+        response = unified_lambda.delete_pictures(api_event('DELETE', '/api/pictures', {'ids': ids}))
+
+        self.assertEqual(json.loads(response['body'])['deleted_count'], 2)
+        self.assertNotIn('photo01.jpg', self.manifest()['names'])
+        # The gallery deletes its selection by id, never by name
+        self.assertIn('ids: selectedItems.map(item => item.dataset.pictureId)', unified_lambda.js_source())
+
+    def test_selected_pictures_sharing_a_name_are_each_downloaded(self):
+        self.s3.add_object('pictures/20240102_000000_ffffffff.jpg', b'copy', metadata={'original-name': 'photo01.jpg'})
+        unified_lambda.invalidate_manifest()
+        ids = ['20240101_000001_00000001.jpg', '20240102_000000_ffffffff.jpg']
+
+        response = unified_lambda.download_pictures(api_event('POST', '/api/pictures/download', {'ids': ids}))
+
+        self.assertEqual(response['statusCode'], 200)
+        with zipfile.ZipFile(io.BytesIO(base64.b64decode(response['body']))) as archive:
+            contents = {name: archive.read(name) for name in archive.namelist()}
+        self.assertEqual(contents, {'photo01.jpg': b'image-1', 'photo01 (2).jpg': b'copy'})
+        self.assertIn('ids: pictureIds', unified_lambda.js_source())
+
+    def test_rating_and_comments_resolve_pictures_by_id(self):
+        self.s3.add_object('pictures/20240102_000000_ffffffff.jpg', b'copy', metadata={'original-name': 'photo01.jpg'})
+        unified_lambda.invalidate_manifest()
+        picture_id = '20240102_000000_ffffffff.jpg'
+
+        rated = unified_lambda.rate_picture(api_event('POST', '/api/pictures/rate', {'id': picture_id, 'rating': 5}))
+        unified_lambda.add_comment(api_event('POST', '/api/pictures/comment', {
+            'id': picture_id, 'author': 'Ann', 'text': 'The copy'
+        }))
+        comments = unified_lambda.get_comments(api_event('GET', '/api/pictures/comments', query={'id': picture_id}))
+
+        self.assertEqual(json.loads(rated['body'])['rating_count'], 1)
+        self.assertEqual([c['text'] for c in json.loads(comments['body'])['comments']], ['The copy'])
+        pictures = self.manifest()['pictures']
+        self.assertEqual(pictures['pictures/' + picture_id]['rating_count'], 1)
+        self.assertEqual(pictures['pictures/20240101_000001_00000001.jpg'].get('rating_count', 0), 0)
+
+    def test_stale_entry_is_dropped(self):
+        del self.s3.objects['pictures/20240101_000002_00000002.jpg']
+
+        response = unified_lambda.rate_picture(api_event('POST', '/api/pictures/rate', {
+            'picture': 'photo02.jpg', 'rating': 4
+        }))
+
+        self.assertEqual(response['statusCode'], 404)
+        self.assertNotIn('photo02.jpg', self.manifest()['names'])
+
+
+if __name__ == '__main__':
+    unittest.main()
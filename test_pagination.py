@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Tests for cursor-based pagination of GET /api/pictures
+"""
+
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+
+class TestPicturePagination(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for i in range(25):
+            self.s3.add_object(
+                f'pictures/20240101_{i:06d}_{i:08x}.jpg',
+                f'image-{i}',
+                metadata={'original-name': f'photo{i:02d}.jpg'},
+                last_modified=start + timedelta(hours=i)
+            )
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+
+    def get_page(self, **query):
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'rawPath': '/api/pictures',
+            'queryStringParameters': {k: str(v) for k, v in query.items()}
+        }
+        return unified_lambda.lambda_handler(event, {})
+
+    def collect(self, limit):
+        names, cursor = [], None
+        while True:
+            query = {'limit': limit}
+            if cursor:
+                query['cursor'] = cursor
+            body = json.loads(self.get_page(**query)['body'])
+            names.extend(p['name'] for p in body['pictures'])
+            cursor = body['next_cursor']
+            if not cursor:
+                return names
+
+    def test_pages_cover_gallery_newest_first(self):
+        names = self.collect(limit=10)
+
+        self.assertEqual(names, [f'photo{i:02d}.jpg' for i in reversed(range(25))])
+
+    def test_last_page_has_no_cursor(self):
+        body = json.loads(self.get_page(limit=25)['body'])
+
+        self.assertEqual(body['count'], 25)
+        self.assertEqual(body['total'], 25)
+        self.assertIsNone(body['next_cursor'])
+
+    def test_uploads_between_pages_do_not_shift_later_pages(self):
+        first = json.loads(self.get_page(limit=10)['body'])
+
+        unified_lambda.upload_picture({'body': json.dumps({
+            'name': 'brand-new.jpg', 'data': 'bmV3', 'contentType': 'image/jpeg'
+        })})
+
+        second = json.loads(self.get_page(limit=10, cursor=first['next_cursor'])['body'])
+        self.assertEqual([p['name'] for p in second['pictures']],
+                         [f'photo{i:02d}.jpg' for i in range(14, 4, -1)])
+
+    def test_capture_times_sort_by_the_moment_they_name(self):
+        unified_lambda.load_manifest()
+        for key, name, taken in (('pictures/a.jpg', 'berlin.jpg', '2024-01-02T18:30:00+02:00'),
+                                 ('pictures/b.jpg', 'london.jpg', '2024-01-02T17:00:00'),
+                                 ('pictures/c.jpg', 'tokyo.jpg', '2024-01-03T01:00:00+09:00')):
+            unified_lambda.upsert_manifest_entry(unified_lambda.build_manifest_entry(
+                key, name, '2024-02-01T00:00:00+00:00', properties={'taken': taken}))
+
+        body = json.loads(self.get_page(limit=3, sort='taken')['body'])
+        second = json.loads(self.get_page(limit=2, sort='taken', cursor=body['next_cursor'])['body'])
+
+        # 17:00Z, 16:30Z, 16:00Z, then the uploads without a capture time
+        self.assertEqual([p['name'] for p in body['pictures']], ['london.jpg', 'berlin.jpg', 'tokyo.jpg'])
+        self.assertEqual([p['name'] for p in second['pictures']], ['photo24.jpg', 'photo23.jpg'])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.get_page(limit='abc')['statusCode'], 400)
+        self.assertEqual(self.get_page(limit=0)['statusCode'], 400)
+        self.assertEqual(self.get_page(cursor='not-a-cursor')['statusCode'], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
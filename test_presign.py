@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the windowed SigV4 presigned URL engine
+"""
+
+import datetime as dt
+import unittest
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import boto3
+from botocore.config import Config
+from botocore.credentials import Credentials
+
+import gallery_common
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+NOW = 1700000123
+WINDOW_START = NOW // 3600 * 3600
+
+
+class FixedDatetime(dt.datetime):
+    @classmethod
+    def utcnow(cls):
+        return dt.datetime.utcfromtimestamp(WINDOW_START)
+
+
+class TestPresignedUrls(unittest.TestCase):
+
+    def setUp(self):
+        self.client = boto3.client(
+            's3',
+            region_name='eu-west-1',
+            aws_access_key_id='AKIDEXAMPLE',
+            aws_secret_access_key='wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+            config=Config(signature_version='s3v4', s3={'addressing_style': 'virtual'})
+        )
+        credentials = Credentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY')
+        for name, value in (('_signing_credentials', credentials), ('PRESIGN_WINDOW', 3600)):
+            patcher = patch(f'gallery_common.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def presign(self, key, now=NOW):
+        return gallery_common.presign_get_url(key, 'gallery-bucket', self.client, now=now)
+
+    def test_signature_matches_botocore(self):
+        key = 'pictures/summer trip/a+b~c.jpg'
+        with patch('botocore.auth.datetime.datetime', FixedDatetime):
+            expected = self.client.generate_presigned_url('get_object', Params={
+                'Bucket': 'gallery-bucket',
+                'Key': key,
+                'ResponseCacheControl': 'private, max-age=7200'
+            }, ExpiresIn=7200)
+
+        url = urlparse(self.presign(key))
+        expected = urlparse(expected)
+        self.assertEqual(url.netloc, expected.netloc)
+        self.assertEqual(url.path, expected.path)
+        self.assertEqual(parse_qs(url.query), parse_qs(expected.query))
+
+    def test_urls_are_stable_within_a_window(self):
+        self.assertEqual(self.presign('pictures/a.jpg', NOW), self.presign('pictures/a.jpg', WINDOW_START + 3599))
+        self.assertNotEqual(self.presign('pictures/a.jpg', NOW), self.presign('pictures/a.jpg', WINDOW_START + 3600))
+
+    def test_url_outlives_its_window(self):
+        query = parse_qs(urlparse(self.presign('pictures/a.jpg')).query)
+
+        self.assertEqual(query['X-Amz-Expires'], ['7200'])
+        self.assertEqual(query['X-Amz-Date'], [dt.datetime.utcfromtimestamp(WINDOW_START).strftime('%Y%m%dT%H%M%SZ')])
+
+    def test_session_token_is_signed(self):
+        with patch('gallery_common._signing_credentials', Credentials('AKID', 'secret', 'TOKEN')):
+            query = parse_qs(urlparse(self.presign('pictures/a.jpg')).query)
+
+        self.assertEqual(query['X-Amz-Security-Token'], ['TOKEN'])
+
+    def test_signing_key_is_reused_across_objects(self):
+        with patch('gallery_common.hmac.new', wraps=gallery_common.hmac.new) as hmac_new:
+            gallery_common._signing_key_cache.clear()
+            for i in range(100):
+                self.presign(f'pictures/{i}.jpg')
+
+        # Four derivation steps once, then one signature per URL
+        self.assertEqual(hmac_new.call_count, 4 + 100)
+
+    def test_test_doubles_fall_back_to_boto(self):
+        url = unified_lambda.presign_get_url('pictures/a.jpg', client=FakeS3Client())
+
+        self.assertTrue(url.startswith('https://fake-s3.local/pictures/a.jpg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
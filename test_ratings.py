@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Tests for multi-user ratings stored as one object per vote
+"""
+
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+PICTURE_KEY = 'pictures/20240101_120000_aaaa1111.jpg'
+
+
+class TestRatingVotes(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.s3.add_object(PICTURE_KEY, b'image', metadata={'original-name': 'sunset.jpg'})
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+
+    def vote(self, rating):
+        response = unified_lambda.lambda_handler(api_event('POST', '/api/pictures/rate', {
+            'picture': 'sunset.jpg', 'rating': rating
+        }), {})
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def listed_picture(self):
+        response = unified_lambda.lambda_handler(api_event('GET', '/api/pictures'), {})
+        return json.loads(response['body'])['pictures'][0]
+
+    def vote_keys(self):
+        return [key for key in self.s3.objects if key.startswith(unified_lambda.RATINGS_PREFIX)]
+
+    def test_votes_are_aggregated(self):
+        for rating in (5, 4, 4, 2):
+            result = self.vote(rating)
+
+        self.assertEqual(result['rating'], 3.75)
+        self.assertEqual(result['rating_count'], 4)
+
+        # Listings show the votes right away
+        picture = self.listed_picture()
+        self.assertEqual((picture['rating'], picture['rating_count']), (3.75, 4))
+
+        # and the scheduled rebuild agrees with them
+        unified_lambda.lambda_handler({'source': 'aws.events'}, {})
+        picture = self.listed_picture()
+        self.assertEqual((picture['rating'], picture['rating_count']), (3.75, 4))
+
+    def test_votes_never_rewrite_the_image(self):
+        self.vote(5)
+
+        self.assertEqual(self.s3.calls['copy_object'], 0)
+        self.assertEqual(self.s3.objects[PICTURE_KEY]['Body'], b'image')
+        self.assertEqual(len(self.vote_keys()), 1)
+
+    def test_concurrent_votes_are_all_kept(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self.vote, [5, 1] * 16))
+
+        self.assertEqual(len(self.vote_keys()), 32)
+        self.assertEqual(unified_lambda.tally_ratings(), {PICTURE_KEY: (32, 96)})
+        entry = unified_lambda.load_manifest()['pictures'][PICTURE_KEY]
+        self.assertEqual((entry['rating_count'], entry['rating_sum']), (32, 96))
+
+    def test_rebuild_counts_votes_shards_and_legacy_rating(self):
+        self.s3.objects[PICTURE_KEY]['Metadata']['rating'] = '1'
+        self.s3.add_object('ratings/20240101_120000_aaaa1111.jpg/shard-3.json',
+                           json.dumps({'votes': {'4': 2}}).encode('utf-8'), content_type='application/json')
+        for rating in (5, 3):
+            self.vote(rating)
+        del self.s3.objects[unified_lambda.MANIFEST_KEY]
+        unified_lambda._metadata_cache.clear()
+
+        entry = unified_lambda.load_manifest()['pictures'][PICTURE_KEY]
+
+        self.assertEqual((entry['rating_count'], entry['rating_sum'], entry['rating']), (5, 17, 3.4))
+
+
+if __name__ == '__main__':
+    unittest.main()
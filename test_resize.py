@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the on-demand resize endpoint and its two cache levels
+"""
+
+import base64
+import io
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+import unified_lambda
+from fake_s3 import FakeS3Client
+
+
+PICTURE_ID = '20240101_120000_aaaa1111.jpg'
+
+
+def resize_event(picture_id, headers=None, **params):
+    return {
+        'requestContext': {'http': {'method': 'GET'}},
+        'rawPath': f'/api/pictures/{picture_id}/image',
+        'queryStringParameters': {name: str(value) for name, value in params.items()},
+        'headers': headers or {},
+        'isBase64Encoded': False
+    }
+
+
+class TestResizeEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        output = io.BytesIO()
+        Image.new('RGB', (1600, 1200), (10, 120, 200)).save(output, format='JPEG')
+        self.s3.add_object(unified_lambda.PICTURES_PREFIX + PICTURE_ID, output.getvalue())
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        for target, value in (('s3_client', self.s3), ('RESIZE_TMP_DIR', self.tmp_dir)):
+            patcher = patch(f'unified_lambda.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        unified_lambda._resize_cache.clear()
+        self.addCleanup(unified_lambda._resize_cache.clear)
+
+    def fetch(self, picture_id=PICTURE_ID, status=200, **params):
+        response = unified_lambda.lambda_handler(resize_event(picture_id, **params), {})
+        self.assertEqual(response['statusCode'], status, response['body'])
+        return response
+
+    def image(self, response):
+        return Image.open(io.BytesIO(base64.b64decode(response['body'])))
+
+    def test_resizes_to_fit_the_requested_box(self):
+        response = self.fetch(w=400, h=400, fmt='webp')
+
+        image = self.image(response)
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.size, (400, 300))
+        self.assertEqual(response['headers']['Content-Type'], 'image/webp')
+
+    def test_each_transform_is_computed_once(self):
+        first = self.fetch(w=300)
+        second = self.fetch(w=300)
+
+        self.assertEqual((first['headers']['X-Cache'], second['headers']['X-Cache']), ('miss', 'memory'))
+        self.assertEqual(self.s3.calls['put_object'], 1)
+
+        # A cold container finds the transform in S3 instead of rendering it
+        unified_lambda._resize_cache.clear()
+        third = self.fetch(w=300)
+        self.assertEqual(third['headers']['X-Cache'], 's3')
+        self.assertEqual(third['body'], first['body'])
+        self.assertEqual(self.s3.calls['put_object'], 1)
+
+    def test_nearby_sizes_share_a_transform(self):
+        self.fetch(w=290)
+        response = self.fetch(w=300)
+
+        self.assertEqual(response['headers']['X-Cache'], 'memory')
+        self.assertEqual(self.image(response).width, 304)
+
+    def test_tmp_cache_is_bounded(self):
+        with patch('unified_lambda.RESIZE_TMP_CACHE_BYTES', 1):
+            self.fetch(w=100)
+            self.fetch(w=200)
+
+        self.assertEqual(len(unified_lambda._resize_cache), 1)
+        self.assertEqual(len(list(unified_lambda.os.scandir(self.tmp_dir))), 1)
+
+    def test_conditional_request_returns_not_modified(self):
+        etag = self.fetch(w=100)['headers']['ETag']
+
+        response = unified_lambda.lambda_handler(resize_event(PICTURE_ID, {'If-None-Match': etag}, w=100), {})
+        self.assertEqual(response['statusCode'], 304)
+
+        # Weak validators and lists of tags match too
+        response = unified_lambda.lambda_handler(resize_event(PICTURE_ID, {'if-none-match': f'"other", W/{etag}'},
+                                                              w=100), {})
+        self.assertEqual(response['statusCode'], 304)
+
+    def test_warm_cache_follows_the_original(self):
+        key = unified_lambda.PICTURES_PREFIX + PICTURE_ID
+        blue = self.image(self.fetch(w=100))
+        self.assertGreater(blue.getpixel((50, 37))[2], 150)
+
+        del self.s3.objects[key]
+        self.fetch(status=404, w=100)
+
+        # The same key stored again with other bytes is rendered afresh
+        output = io.BytesIO()
+        Image.new('RGB', (1600, 1200), (200, 20, 10)).save(output, format='JPEG')
+        self.s3.add_object(key, output.getvalue())
+        response = self.fetch(w=100)
+        self.assertEqual(response['headers']['X-Cache'], 'miss')
+        self.assertGreater(self.image(response).getpixel((50, 37))[0], 150)
+
+    def test_invalid_requests(self):
+        self.fetch(status=400)
+        self.fetch(status=400, w=0)
+        self.fetch(status=400, w=100, fmt='tiff')
+        self.fetch(picture_id='missing.jpg', status=404, w=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
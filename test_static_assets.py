@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""
+Tests for precompressed, ETag-validated static asset serving
+"""
+
+import base64
+import gzip
+import re
+import unittest
+from unittest.mock import patch
+
+import brotli
+
+import frontend_lambda
+import static_assets
+import unified_lambda
+
+
+def asset_event(path, **headers):
+    return {
+        'requestContext': {'http': {'method': 'GET'}},
+        'rawPath': path,
+        'headers': headers
+    }
+
+
+def response_bytes(response):
+    body = response['body']
+    return base64.b64decode(body) if response.get('isBase64Encoded') else body.encode('utf-8')
+
+
+class TestStaticAssets(unittest.TestCase):
+
+    def test_response_follows_accept_encoding(self):
+        source = static_assets.minify_js(unified_lambda.js_source()).encode('utf-8')
+        cases = (
+            ({}, None, lambda data: data),
+            ({'Accept-Encoding': 'gzip, deflate'}, 'gzip', gzip.decompress),
+            ({'accept-encoding': 'gzip, deflate, br'}, 'br', brotli.decompress),
+            ({'accept-encoding': 'br;q=0.5, gzip'}, 'gzip', gzip.decompress),
+            ({'accept-encoding': '*;q=0.1, br;q=0'}, 'gzip', gzip.decompress),
+            ({'accept-encoding': 'deflate'}, None, lambda data: data),
+        )
+        for headers, encoding, decode in cases:
+            with self.subTest(headers=headers):
+                response = unified_lambda.lambda_handler(asset_event('/script.js', **headers), {})
+
+                self.assertEqual(response['statusCode'], 200)
+                self.assertEqual(response['headers'].get('Content-Encoding'), encoding)
+                self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+                self.assertEqual(decode(response_bytes(response)), source)
+
+        # The compressed script is under a quarter of its size
+        compressed = unified_lambda.lambda_handler(asset_event('/script.js', **{'accept-encoding': 'br'}), {})
+        self.assertLess(len(response_bytes(compressed)), len(source) // 4)
+
+    def test_assets_are_built_once_per_container(self):
+        with patch('unified_lambda.js_source', side_effect=AssertionError('rendered again')), \
+                patch('static_assets.gzip.compress', side_effect=AssertionError('compressed again')):
+            for _ in range(3):
+                response = unified_lambda.lambda_handler(asset_event('/script.js', **{'accept-encoding': 'gzip'}), {})
+                self.assertEqual(response['statusCode'], 200)
+
+    def test_revalidation_answers_304_for_the_same_representation(self):
+        first = unified_lambda.lambda_handler(asset_event('/style.css', **{'accept-encoding': 'gzip'}), {})
+        etag = first['headers']['ETag']
+        self.assertRegex(etag, r'^"[0-9a-f]{32}-gzip"$')
+        self.assertEqual(first['headers']['Cache-Control'], 'no-cache')
+
+        again = unified_lambda.lambda_handler(asset_event('/style.css', **{
+            'accept-encoding': 'gzip', 'if-none-match': f'"stale", W/{etag}'
+        }), {})
+        self.assertEqual((again['statusCode'], again['body'], again['headers']['ETag']), (304, '', etag))
+
+        # A client that now takes brotli gets a different representation
+        switched = unified_lambda.lambda_handler(asset_event('/style.css', **{
+            'accept-encoding': 'br', 'if-none-match': etag
+        }), {})
+        self.assertEqual(switched['statusCode'], 200)
+        self.assertNotEqual(switched['headers']['ETag'], etag)
+
+    def test_etags_are_stable_across_containers(self):
+        rebuilt = unified_lambda.build_static_assets()
+
+        self.assertEqual(rebuilt, unified_lambda._static_assets)
+
+    def test_brotli_is_optional(self):
+        with patch.dict('sys.modules', {'brotli': None}):
+            asset = static_assets.build_static_asset(unified_lambda.css_source(), 'text/css')
+
+        self.assertEqual(set(asset['variants']), {'identity', 'gzip'})
+        self.assertEqual(static_assets.choose_asset_encoding(asset, 'br, gzip;q=0.8'), 'gzip')
+
+    def test_frontend_lambda_shares_the_compressed_assets(self):
+        response = frontend_lambda.lambda_handler(asset_event('/script.js', **{'accept-encoding': 'gzip'}), {})
+
+        script = gzip.decompress(response_bytes(response)).decode('utf-8')
+        self.assertIn('const API_BASE_URL = "https://your-backend-lambda-url', script)
+        self.assertEqual(response['headers']['Access-Control-Allow-Headers'], 'Content-Type, Authorization')
+        again = frontend_lambda.lambda_handler(asset_event('/script.js', **{
+            'accept-encoding': 'gzip', 'if-none-match': response['headers']['ETag']
+        }), {})
+        self.assertEqual(again['statusCode'], 304)
+
+
+class TestAssetBundle(unittest.TestCase):
+
+    def page_links(self):
+        page = unified_lambda.lambda_handler(asset_event('/'), {})['body']
+        return re.findall(r'(?:href|src)="(/static/[^"]+)"', page)
+
+    def test_page_links_an_immutable_content_hashed_bundle(self):
+        stylesheet, script = self.page_links()
+        self.assertRegex(stylesheet, r'^/static/app\.[0-9a-f]{12}\.css$')
+        self.assertRegex(script, r'^/static/app\.[0-9a-f]{12}\.js$')
+
+        for url, fixed_path in ((stylesheet, '/style.css'), (script, '/script.js')):
+            response = unified_lambda.lambda_handler(asset_event(url, **{'accept-encoding': 'br'}), {})
+            self.assertEqual(response['statusCode'], 200)
+            self.assertEqual(response['headers']['Cache-Control'], 'public, max-age=31536000, immutable')
+            # The old fixed paths serve the same bundle, revalidated
+            fixed = unified_lambda.lambda_handler(asset_event(fixed_path, **{'accept-encoding': 'br'}), {})
+            self.assertEqual(fixed['body'], response['body'])
+            self.assertEqual(fixed['headers']['Cache-Control'], 'no-cache')
+
+        # Only the page itself is revalidated on a repeat visit
+        self.assertEqual(unified_lambda.lambda_handler(asset_event('/'), {})['headers']['Cache-Control'], 'no-cache')
+        missing = unified_lambda.lambda_handler(asset_event('/static/app.000000000000.js'), {})
+        self.assertEqual(missing['statusCode'], 404)
+
+    def test_bundle_names_follow_the_content(self):
+        links = self.page_links()
+
+        with patch('unified_lambda.css_source', return_value='body { color: red; }'):
+            changed = unified_lambda.build_static_assets()
+
+        self.assertEqual(changed['/style.css']['variants']['identity'][0], b'body{color:red}')
+        self.assertNotIn(links[0], changed)
+        self.assertIn(links[1], changed)
+        self.assertEqual(unified_lambda.build_static_assets().keys(), unified_lambda._static_assets.keys())
+
+    def test_minified_script_keeps_code_and_template_literals(self):
+        source = """
+    // Comment lines go
+    const title = 'a // b';
+    
+    gallery.innerHTML = `
+        <div class="card">
+            ${title}
+        </div>`;
+        """
+
+        self.assertEqual(static_assets.minify_js(source),
+                         "const title = 'a // b';\n"
+                         "gallery.innerHTML = `\n"
+                         '        <div class="card">\n'
+                         '            ${title}\n'
+                         '        </div>`;')
+
+
+if __name__ == '__main__':
+    unittest.main()
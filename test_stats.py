@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+Tests for the incrementally maintained gallery statistics
+"""
+
+import json
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import unified_lambda
+from fake_s3 import FakeS3Client, api_event
+
+
+class TestGalleryStats(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.s3.add_object('pictures/20240101_120000_aaaa1111.jpg', b'a' * 100,
+                           metadata={'original-name': 'sunset.jpg'},
+                           last_modified=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.s3.add_object('pictures/20240102_120000_bbbb2222.png', b'b' * 50,
+                           metadata={'original-name': 'mountain.png'}, content_type='image/png',
+                           last_modified=datetime(2024, 1, 2, tzinfo=timezone.utc))
+        patcher = patch('unified_lambda.s3_client', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        unified_lambda._metadata_cache.clear()
+
+    def stats(self):
+        response = unified_lambda.lambda_handler(api_event('GET', '/api/stats'), {})
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def test_breakdowns(self):
+        stats = self.stats()
+
+        self.assertEqual((stats['totalPictures'], stats['totalStorage']), (2, 150))
+        self.assertEqual(stats['contentTypes'], {
+            'image/jpeg': {'count': 1, 'bytes': 100},
+            'image/png': {'count': 1, 'bytes': 50}
+        })
+        self.assertEqual(stats['uploadsPerDay'], {'2024-01-01': 1, '2024-01-02': 1})
+
+    def test_stats_cost_one_get_once_stored(self):
+        self.stats()
+        self.s3.reset_calls()
+
+        self.stats()
+
+        self.assertEqual(dict(self.s3.calls), {'get_object': 1})
+
+    def test_upload_and_delete_update_incrementally(self):
+        self.stats()
+        unified_lambda.lambda_handler(api_event('POST', '/api/pictures', {
+            'name': 'beach.jpg', 'data': 'YmVhY2g=', 'contentType': 'image/jpeg'
+        }), {})
+        unified_lambda.lambda_handler(api_event('DELETE', '/api/pictures', {
+            'pictures': ['mountain.png']
+        }), {})
+        self.s3.reset_calls()
+
+        stats = self.stats()
+
+        self.assertEqual(self.s3.calls['list_objects_v2'], 0)
+        self.assertEqual((stats['totalPictures'], stats['totalStorage']), (2, 105))
+        self.assertEqual(stats['contentTypes'], {'image/jpeg': {'count': 2, 'bytes': 105}})
+        self.assertNotIn('2024-01-02', stats['uploadsPerDay'])
+
+    def test_concurrent_updates_are_all_counted(self):
+        self.stats()
+        read_document_version = unified_lambda.read_document_version
+        interleaved = []
+
+        def read_then_race(*args):
+            result = read_document_version(*args)
+            if not interleaved:
+                # Another upload lands between this writer's read and its write
+                interleaved.append(True)
+                unified_lambda.update_stats(added=[{'key': 'pictures/b.jpg', 'size': 7, 'date': '2024-01-03'}])
+            return result
+
+        with patch('unified_lambda.read_document_version', side_effect=read_then_race):
+            unified_lambda.update_stats(added=[{'key': 'pictures/a.jpg', 'size': 3, 'date': '2024-01-03'}])
+
+        stats = self.stats()
+        self.assertEqual((stats['totalPictures'], stats['totalStorage']), (4, 160))
+        self.assertEqual(stats['uploadsPerDay']['2024-01-03'], 2)
+
+    def test_scheduled_event_reconciles_drift(self):
+        self.stats()
+        self.s3.add_object('pictures/20240103_120000_cccc3333.jpg', b'c' * 10,
+                           metadata={'original-name': 'lake.jpg'})
+
+        response = unified_lambda.lambda_handler({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        stats = self.stats()
+        self.assertEqual((stats['totalPictures'], stats['totalStorage']), (3, 160))
+        self.assertIsNotNone(stats['reconciled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
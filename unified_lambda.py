@@ -1,17 +1,108 @@
 import json
 import base64
+import hashlib
+import heapq
+import io
 import os
+import random
+import re
+import threading
+import time
 import boto3
 import uuid
-from datetime import datetime
-from urllib.parse import parse_qs
+import zipfile
+import zlib
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import unquote
 
-# Initialize AWS clients
-s3_client = boto3.client('s3')
+import gallery_common
+from gallery_common import IMAGE_HEADER_FIELDS, decode_downscaled, map_concurrently, read_image_properties
+from static_assets import build_static_asset, etag_matches, minify_css, minify_js, static_asset_response
+
+# Initialize AWS clients (sized for the concurrent S3 requests below)
+s3_client = boto3.client('s3', config=Config(
+    max_pool_connections=int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '50'))
+))
 
 # Configuration
 PICTURES_BUCKET = os.environ.get('PICTURES_BUCKET', 'your-pictures-bucket')
 ICEBERG_WAREHOUSE_PATH = os.environ.get('ICEBERG_WAREHOUSE_PATH', 'warehouse')
+MANIFEST_KEY = os.environ.get('MANIFEST_KEY', 'index/manifest.json')
+STATS_KEY = os.environ.get('STATS_KEY', 'index/stats.json')
+PHASH_INDEX_KEY = os.environ.get('PHASH_INDEX_KEY', 'index/phash-tree.json')
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', '4096'))
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '50'))
+COMMENT_COMPACT_THRESHOLD = int(os.environ.get('COMMENT_COMPACT_THRESHOLD', '50'))
+DERIVATIVE_BACKFILL_LIMIT = int(os.environ.get('DERIVATIVE_BACKFILL_LIMIT', '200'))
+RESIZE_TMP_DIR = os.environ.get('RESIZE_TMP_DIR', '/tmp/resized')
+RESIZE_TMP_CACHE_BYTES = int(os.environ.get('RESIZE_TMP_CACHE_BYTES', str(256 * 1024 * 1024)))
+RESIZE_STEP = int(os.environ.get('RESIZE_STEP', '16'))
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_DISTANCE', '8'))
+DOWNLOAD_INLINE_LIMIT = int(os.environ.get('DOWNLOAD_INLINE_LIMIT', str(4 * 1024 * 1024)))
+DOWNLOAD_PREFETCH = int(os.environ.get('DOWNLOAD_PREFETCH', '4'))
+MULTIPART_PART_SIZE = int(os.environ.get('MULTIPART_PART_SIZE', str(8 * 1024 * 1024)))
+DOWNLOAD_URL_EXPIRY = 3600
+UPLOAD_URL_EXPIRY = 3600
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', str(24 * 3600)))
+MAX_PAGE_SIZE = 500
+MAX_DUPLICATE_DISTANCE = 16
+MANIFEST_WRITE_ATTEMPTS = 8
+MANIFEST_RETRY_DELAY = 0.05
+
+PICTURES_PREFIX = 'pictures/'
+COMMENTS_PREFIX = 'comments/'
+RATINGS_PREFIX = 'ratings/'
+DOWNLOADS_PREFIX = 'downloads/'
+UPLOADS_PREFIX = 'uploads/'
+DERIVATIVES_PREFIX = 'derivatives/'
+RESIZED_PREFIX = 'resized/'
+# Sidecar under a picture's derivatives prefix that keeps its image properties
+IMAGE_PROPERTIES_FILE = 'properties.json'
+DELETE_BATCH_SIZE = 1000
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+# copy_object copies at most 5 GB; larger objects are copied part by part
+COPY_OBJECT_LIMIT = 5 * 1024 ** 3
+MULTIPART_COPY_PART_SIZE = 256 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+RESIZE_MAX_DIMENSION = 4096
+# fmt parameter -> (Pillow format, content type)
+RESIZE_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png')
+}
+# Content-hashed stylesheet and script, named app.<hash>.<ext>
+STATIC_PREFIX = '/static/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+COMPRESSION_PROBE_SIZE = 64 * 1024
+COMPRESSION_PROBE_RATIO = 0.9
+PRECOMPRESSED_CONTENT_TYPES = frozenset({
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif', 'image/heic',
+    'video/mp4', 'video/quicktime', 'application/zip', 'application/gzip'
+})
+# Picture key extensions; every upload key uses one, and only these are listed
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+# Extension of content-addressed keys by content type
+CONTENT_TYPE_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif'}
+# Hashes accepted by one /api/uploads/check call
+HASH_CHECK_LIMIT = 1000
+# Derivative name and longest edge, largest first so each is resized from the last
+DERIVATIVE_SIZES = (('medium', 1280), ('thumb', 400))
+# Every manifest field computed from the image once, at registration
+IMAGE_PROPERTY_FIELDS = IMAGE_HEADER_FIELDS + ('phash',)
+
+# Object metadata cached across warm invocations, in LRU order
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
+# Resized images kept in /tmp across warm invocations: file name -> size, in LRU order
+_resize_cache = OrderedDict()
+_resize_cache_lock = threading.Lock()
 
 def lambda_handler(event, context):
     """
@@ -27,19 +118,30 @@ def lambda_handler(event, context):
         
         print(f"Path: {path}, Method: {method}")
         
+        # Scheduled EventBridge invocations clean up abandoned uploads and
+        # reconcile the stats document
+        if event.get('source') == 'aws.events':
+            try:
+                abort_stale_uploads()
+            except Exception as e:
+                print(f"Error cleaning up stale uploads: {e}")
+            return reconcile_stats()
+        
         # Handle CORS preflight requests
         if method == 'OPTIONS':
             return cors_response()
         
         # Route requests
         if path == '/' or path == '/index.html':
-            return serve_html()
+            return serve_html(event)
         elif path == '/style.css':
-            return serve_css()
+            return serve_css(event)
         elif path == '/script.js':
-            return serve_js()
+            return serve_js(event)
+        elif path.startswith(STATIC_PREFIX):
+            return serve_static(event, path)
         elif path == '/api/pictures' and method == 'GET':
-            return get_pictures()
+            return get_pictures(event)
         elif path == '/api/pictures' and method == 'POST':
             return upload_picture(event)
         elif path == '/api/pictures' and method == 'DELETE':
@@ -48,10 +150,26 @@ def lambda_handler(event, context):
             return rate_picture(event)
         elif path == '/api/pictures/comment' and method == 'POST':
             return add_comment(event)
+        elif path == '/api/pictures/comments' and method == 'GET':
+            return get_comments(event)
+        elif path == '/api/pictures/duplicates' and method == 'GET':
+            return get_duplicates(event)
         elif path == '/api/pictures/download' and method == 'POST':
             return download_pictures(event)
+        elif path == '/api/uploads' and method == 'POST':
+            return create_upload(event)
+        elif path == '/api/uploads/check' and method == 'POST':
+            return check_uploads(event)
+        elif path == '/api/uploads/complete' and method == 'POST':
+            return complete_upload(event)
+        elif path == '/api/uploads/resume' and method == 'POST':
+            return resume_upload(event)
+        elif path == '/api/uploads/abort' and method == 'POST':
+            return abort_upload(event)
         elif path == '/api/stats' and method == 'GET':
             return get_stats()
+        elif re.fullmatch(r'/api/pictures/[^/]+/image', path) and method == 'GET':
+            return get_resized_picture(event, unquote(path.split('/')[3]))
         else:
             return {
                 'statusCode': 404,
@@ -87,8 +205,8 @@ def cors_response():
         'body': ''
     }
 
-def serve_html():
-    """Serve the main HTML page"""
+def html_source(stylesheet_url='/style.css', script_url='/script.js'):
+    """Source of the main HTML page, linking the given stylesheet and script"""
     html_content = """
     <!DOCTYPE html>
     <html lang="en">
@@ -96,7 +214,7 @@ def serve_html():
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>Picture Gallery</title>
-        <link rel="stylesheet" href="/style.css">
+        <link rel="stylesheet" href="__STYLESHEET_URL__">
     </head>
     <body>
         <div class="container">
@@ -105,9 +223,14 @@ def serve_html():
                 <button id="statsButton" class="stats-button" onclick="showStats()">📊 Stats</button>
                 <button id="selectModeBtn" class="select-mode-button" onclick="enterSelectMode()">✓ Select</button>
                 <button id="downloadModeBtn" class="download-mode-button" onclick="enterDownloadMode()">📥 Download</button>
+                <button id="duplicatesButton" class="duplicates-button" onclick="showDuplicates()">🧬 Duplicates</button>
                 <div class="upload-section">
                     <input type="file" id="fileInput" accept="image/*" multiple>
                     <button onclick="uploadPictures()">Upload Pictures</button>
+                    <select id="sortOrder" class="sort-order" onchange="changeSortOrder()">
+                        <option value="uploaded">Newest uploads</option>
+                        <option value="taken">Date taken</option>
+                    </select>
                 </div>
                 
                 <div id="deleteSection" class="delete-section" style="display: none;">
@@ -129,6 +252,9 @@ def serve_html():
                 <div id="loadingMessage" class="loading">Loading pictures...</div>
                 <div id="errorMessage" class="error" style="display: none;"></div>
                 <div id="gallery" class="gallery"></div>
+                <div id="loadMore" class="load-more" style="display: none;">
+                    <button onclick="loadMorePictures()">Load more</button>
+                </div>
             </main>
         </div>
         
@@ -143,22 +269,26 @@ def serve_html():
             </div>
         </div>
         
-        <script src="/script.js"></script>
+        <!-- Near-duplicates Modal -->
+        <div id="duplicatesModal" class="modal" style="display: none;">
+            <div class="modal-content duplicates-content">
+                <span class="close" onclick="closeDuplicates()">&times;</span>
+                <h2>🧬 Near-duplicates</h2>
+                <div id="duplicatesList">
+                    <div class="loading">Looking for near-duplicates...</div>
+                </div>
+            </div>
+        </div>
+        
+        <script src="__SCRIPT_URL__"></script>
     </body>
     </html>
     """
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/html',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': html_content
-    }
+    return html_content.replace('__STYLESHEET_URL__', stylesheet_url).replace('__SCRIPT_URL__', script_url)
 
-def serve_css():
-    """Serve the CSS styles"""
+def css_source():
+    """Source of the CSS styles"""
     css_content = """
     * {
         margin: 0;
@@ -256,6 +386,28 @@ def serve_css():
         box-shadow: 0 4px 12px rgba(49, 130, 206, 0.4);
     }
 
+    .duplicates-button {
+        position: absolute;
+        top: 20px;
+        right: 330px;
+        background: #805ad5;
+        color: white;
+        border: none;
+        padding: 10px 15px;
+        border-radius: 8px;
+        cursor: pointer;
+        font-size: 14px;
+        font-weight: 500;
+        transition: all 0.3s ease;
+        box-shadow: 0 2px 8px rgba(128, 90, 213, 0.3);
+    }
+
+    .duplicates-button:hover {
+        background: #6b46c1;
+        transform: translateY(-2px);
+        box-shadow: 0 4px 12px rgba(128, 90, 213, 0.4);
+    }
+
     .delete-section, .download-section {
         display: flex;
         gap: 10px;
@@ -556,6 +708,15 @@ def serve_css():
         flex-wrap: wrap;
     }
 
+    .sort-order {
+        padding: 10px;
+        border: 2px solid #667eea;
+        border-radius: 8px;
+        background: #f8f9ff;
+        font-size: 14px;
+        cursor: pointer;
+    }
+
     input[type="file"] {
         padding: 10px;
         border: 2px dashed #667eea;
@@ -637,6 +798,11 @@ def serve_css():
         font-size: 0.9em;
     }
 
+    .load-more {
+        text-align: center;
+        margin: 20px 0;
+    }
+
     .loading, .error {
         text-align: center;
         padding: 40px;
@@ -714,6 +880,47 @@ def serve_css():
         color: #667eea;
     }
 
+    .duplicates-content {
+        max-width: 760px;
+        max-height: 80vh;
+        overflow-y: auto;
+    }
+
+    .duplicate-group {
+        padding: 15px 0;
+        border-bottom: 1px solid #eee;
+    }
+
+    .duplicate-group:last-child {
+        border-bottom: none;
+    }
+
+    .duplicate-pictures {
+        display: flex;
+        gap: 10px;
+        flex-wrap: wrap;
+        margin-bottom: 10px;
+    }
+
+    .duplicate-picture {
+        width: 120px;
+        font-size: 0.8em;
+        color: #718096;
+        word-break: break-all;
+    }
+
+    .duplicate-picture img {
+        width: 120px;
+        height: 90px;
+        object-fit: cover;
+        border-radius: 8px;
+        border: 3px solid transparent;
+    }
+
+    .duplicate-picture.keep img {
+        border-color: #48bb78;
+    }
+
     .stats-item {
         display: flex;
         justify-content: space-between;
@@ -757,26 +964,50 @@ def serve_css():
     }
     """
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/css',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': css_content
-    }
+    return css_content
 
-def serve_js():
-    """Serve the JavaScript code"""
+def js_source():
+    """Source of the JavaScript code"""
     js_content = """
     // Configuration - API calls to same Lambda function
     const API_BASE_URL = window.location.origin;
     
+    // Pictures are fetched one page at a time, newest first by upload or capture date
+    const PAGE_SIZE = 50;
+    let nextCursor = null;
+    let loadingMore = false;
+    let sortOrder = 'uploaded';
+    
+    // Fetch the next page as the end of the gallery scrolls into view
+    const loadMoreObserver = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMorePictures();
+        }
+    }, { rootMargin: '600px' });
+    
     // Load pictures when page loads
     document.addEventListener('DOMContentLoaded', function() {
+        loadMoreObserver.observe(document.getElementById('loadMore'));
         loadPictures();
     });
     
+    async function fetchPicturesPage(cursor) {
+        const params = new URLSearchParams({ limit: PAGE_SIZE, sort: sortOrder });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        
+        const response = await fetch(`${API_BASE_URL}/api/pictures?${params}`);
+        
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const data = await response.json();
+        nextCursor = data.next_cursor || null;
+        return data;
+    }
+    
     async function loadPictures() {
         const loadingMessage = document.getElementById('loadingMessage');
         const errorMessage = document.getElementById('errorMessage');
@@ -786,13 +1017,7 @@ def serve_js():
             loadingMessage.style.display = 'block';
             errorMessage.style.display = 'none';
             
-            const response = await fetch(`${API_BASE_URL}/api/pictures`);
-            
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            
-            const data = await response.json();
+            const data = await fetchPicturesPage(null);
             
             loadingMessage.style.display = 'none';
             
@@ -807,58 +1032,101 @@ def serve_js():
             loadingMessage.style.display = 'none';
             errorMessage.textContent = `Error loading pictures: ${error.message}`;
             errorMessage.style.display = 'block';
+        } finally {
+            updateLoadMore();
+        }
+    }
+    
+    async function loadMorePictures() {
+        if (!nextCursor || loadingMore) {
+            return;
+        }
+        
+        loadingMore = true;
+        try {
+            const data = await fetchPicturesPage(nextCursor);
+            displayPictures(data.pictures || [], true);
+        } catch (error) {
+            console.error('Error loading more pictures:', error);
+            const errorMessage = document.getElementById('errorMessage');
+            errorMessage.textContent = `Error loading pictures: ${error.message}`;
+            errorMessage.style.display = 'block';
+        } finally {
+            loadingMore = false;
+            updateLoadMore();
+        }
+    }
+    
+    function changeSortOrder() {
+        sortOrder = document.getElementById('sortOrder').value;
+        nextCursor = null;
+        document.getElementById('gallery').innerHTML = '';
+        loadPictures();
+    }
+    
+    function pictureDateLabel(picture) {
+        if (!picture.taken) {
+            return new Date(picture.date).toLocaleDateString();
         }
+        // EXIF times are camera-local; only parse the calendar date
+        const [year, month, day] = picture.taken.slice(0, 10).split('-').map(Number);
+        const taken = new Date(year, month - 1, day).toLocaleDateString();
+        return picture.camera ? `📷 ${taken} · ${picture.camera}` : `📷 ${taken}`;
+    }
+    
+    function updateLoadMore() {
+        document.getElementById('loadMore').style.display = nextCursor ? 'block' : 'none';
     }
     
-    function displayPictures(pictures) {
+    function displayPictures(pictures, append = false) {
         const gallery = document.getElementById('gallery');
         
-        gallery.innerHTML = pictures.map(picture => `
-            <div class="picture-card picture-item" data-picture-name="${picture.name}">
+        const html = pictures.map(picture => `
+            <div class="picture-card picture-item" data-picture-name="${picture.name}" data-picture-id="${picture.id}">
                 <input type="checkbox" class="picture-checkbox" onchange="handleCheckboxChange()">
-                <img src="${picture.url}" alt="${picture.name}" onclick="openFullSize('${picture.url}')">
+                <img src="${picture.thumb_url || picture.url}" alt="${picture.name}" loading="lazy"
+                     ${picture.width && picture.height ? `width="${picture.width}" height="${picture.height}"` : ''}
+                     srcset="${picture.thumb_url || picture.url} 400w, ${picture.medium_url || picture.url} 1280w"
+                     sizes="(max-width: 768px) 100vw, 400px"
+                     onclick="openFullSize('${picture.url}')">
                 <div class="picture-info">
                     <div class="picture-name">${picture.name}</div>
-                    <div class="picture-date">${new Date(picture.date).toLocaleDateString()}</div>
+                    <div class="picture-date">${pictureDateLabel(picture)}</div>
                     <div class="picture-rating">
-                        <div class="stars" data-picture="${picture.name}">
+                        <div class="stars" data-picture="${picture.id}">
                             ${[1,2,3,4,5].map(star => `
-                                <span class="star ${(picture.rating || 0) >= star ? 'filled' : ''}" 
+                                <span class="star ${Math.round(picture.rating || 0) >= star ? 'filled' : ''}" 
                                       data-rating="${star}" 
-                                      onclick="ratePicture('${picture.name}', ${star})">★</span>
+                                      onclick="ratePicture('${picture.id}', ${star})">★</span>
                             `).join('')}
                         </div>
-                        <span class="rating-text">${picture.rating ? `${picture.rating}/5` : 'Not rated'}</span>
+                        <span class="rating-text">${formatRating(picture.rating, picture.rating_count)}</span>
                     </div>
                     <div class="comments-section">
                         <div class="comments-header">
                             <span class="comments-title">💬 Comments</span>
-                            <button class="toggle-comments" onclick="toggleComments('${picture.name}')">
-                                ${(picture.comments && picture.comments.length > 0) ? `Show ${picture.comments.length}` : 'Add Comment'}
+                            <button class="toggle-comments" data-count="${picture.comment_count || 0}" onclick="toggleComments('${picture.id}')">
+                                ${picture.comment_count > 0 ? `Show ${picture.comment_count}` : 'Add Comment'}
                             </button>
                         </div>
-                        <div class="comments-container" id="comments-${picture.name.replace(/[^a-zA-Z0-9]/g, '_')}" style="display: none;">
-                            <div class="existing-comments">
-                                ${(picture.comments || []).map(comment => `
-                                    <div class="comment">
-                                        <div class="comment-header">
-                                            <span class="comment-author">${comment.author}</span>
-                                            <span class="comment-date">${new Date(comment.date).toLocaleDateString()}</span>
-                                        </div>
-                                        <div class="comment-text">${comment.text}</div>
-                                    </div>
-                                `).join('')}
-                            </div>
+                        <div class="comments-container" id="comments-${picture.id.replace(/[^a-zA-Z0-9]/g, '_')}" style="display: none;">
+                            <div class="existing-comments"></div>
                             <div class="add-comment-form">
                                 <input type="text" class="comment-name" placeholder="Your name" maxlength="50">
                                 <textarea class="comment-input" placeholder="Write a comment..." maxlength="500"></textarea>
-                                <button class="submit-comment" onclick="submitComment('${picture.name}')">Post Comment</button>
+                                <button class="submit-comment" onclick="submitComment('${picture.id}')">Post Comment</button>
                             </div>
                         </div>
                     </div>
                 </div>
             </div>
         `).join('');
+        
+        if (append) {
+            gallery.insertAdjacentHTML('beforeend', html);
+        } else {
+            gallery.innerHTML = html;
+        }
     }
     
     function openFullSize(url) {
@@ -888,79 +1156,286 @@ def serve_js():
         uploadButton.disabled = true;
         uploadButton.textContent = 'Uploading...';
         
+        // One failed file does not stop the rest of the batch
+        const failed = [];
+        const duplicates = [];
         try {
+            uploadButton.textContent = 'Checking for duplicates...';
+            const hashes = await hashFiles(files);
+            const existing = await findExistingHashes(hashes.filter(Boolean));
+            
             for (let i = 0; i < files.length; i++) {
                 const file = files[i];
-                await uploadSinglePicture(file);
+                if (hashes[i] && existing[hashes[i]]) {
+                    // Already in the gallery: nothing to send
+                    duplicates.push(file.name);
+                    continue;
+                }
+                uploadButton.textContent = `Uploading ${i + 1} of ${files.length}...`;
+                try {
+                    const result = await uploadSinglePicture(file, hashes[i]);
+                    if (result.duplicate) {
+                        duplicates.push(file.name);
+                    }
+                } catch (error) {
+                    console.error(`Upload error for ${file.name}:`, error);
+                    failed.push(`${file.name} (${error.message})`);
+                }
             }
             
-            // Show success message
-            const successDiv = document.createElement('div');
-            successDiv.className = 'success';
-            successDiv.textContent = `Successfully uploaded ${files.length} picture(s)!`;
-            document.querySelector('.container').insertBefore(successDiv, document.querySelector('main'));
-            
-            // Remove success message after 3 seconds
-            setTimeout(() => {
-                successDiv.remove();
-            }, 3000);
+            const uploaded = files.length - failed.length - duplicates.length;
+            if (uploaded > 0 || duplicates.length > 0) {
+                // Show success message
+                const successDiv = document.createElement('div');
+                successDiv.className = 'success';
+                successDiv.textContent = duplicates.length > 0
+                    ? `Successfully uploaded ${uploaded} picture(s); ${duplicates.length} already in the gallery.`
+                    : `Successfully uploaded ${uploaded} picture(s)!`;
+                document.querySelector('.container').insertBefore(successDiv, document.querySelector('main'));
+                
+                // Remove success message after 3 seconds
+                setTimeout(() => {
+                    successDiv.remove();
+                }, 3000);
+                
+                loadPictures();
+            }
             
-            // Clear file input and reload pictures
-            fileInput.value = '';
-            loadPictures();
+            if (failed.length > 0) {
+                alert(`Upload failed for ${failed.length} picture(s): ${failed.join(', ')}. Upload them again to resume.`);
+            } else {
+                // Clear file input
+                fileInput.value = '';
+            }
             
-        } catch (error) {
-            console.error('Upload error:', error);
-            alert(`Upload failed: ${error.message}`);
         } finally {
             uploadButton.disabled = false;
             uploadButton.textContent = 'Upload Pictures';
         }
     }
     
-    async function uploadSinglePicture(file) {
-        return new Promise((resolve, reject) => {
-            const reader = new FileReader();
-            
-            reader.onload = async function(e) {
+    async function postJson(path, payload) {
+        const response = await fetch(`${API_BASE_URL}${path}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(payload)
+        });
+        
+        if (!response.ok) {
+            const errorData = await response.json();
+            const error = new Error(errorData.error || `HTTP error! status: ${response.status}`);
+            error.status = response.status;
+            throw error;
+        }
+        
+        return response.json();
+    }
+    
+    async function putToS3(url, body, headers = {}) {
+        const response = await fetch(url, { method: 'PUT', headers, body });
+        
+        if (!response.ok) {
+            const error = new Error(`Upload to storage failed with status ${response.status}`);
+            error.status = response.status;
+            throw error;
+        }
+        
+        return response.headers.get('ETag');
+    }
+    
+    // Files are identified by their SHA-256, so content the gallery already
+    // has is never sent again
+    const HASH_CHECK_BATCH = 1000;
+    
+    async function sha256Hex(file) {
+        if (!window.crypto || !crypto.subtle) {
+            return null;
+        }
+        try {
+            const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+            return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+        } catch (error) {
+            console.warn(`Could not hash ${file.name}:`, error);
+            return null;
+        }
+    }
+    
+    async function hashFiles(files) {
+        // One at a time, so only one file is held in memory
+        const hashes = [];
+        for (const file of files) {
+            hashes.push(await sha256Hex(file));
+        }
+        return hashes;
+    }
+    
+    async function findExistingHashes(hashes) {
+        const existing = {};
+        for (let start = 0; start < hashes.length; start += HASH_CHECK_BATCH) {
+            try {
+                const data = await withRetries(() => postJson('/api/uploads/check', {
+                    hashes: hashes.slice(start, start + HASH_CHECK_BATCH)
+                }));
+                Object.assign(existing, data.existing);
+            } catch (error) {
+                // The upload itself still detects duplicates
+                console.warn('Duplicate check failed:', error);
+            }
+        }
+        return existing;
+    }
+    
+    // Parts of a multipart upload sent at the same time
+    const UPLOAD_PART_CONCURRENCY = 4;
+    
+    // Network errors and 5xx responses are retried this many times with
+    // exponential backoff; a multipart upload gets as many resume rounds
+    const UPLOAD_RETRIES = 5;
+    
+    async function withRetries(task) {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                return await task();
+            } catch (error) {
+                if (attempt >= UPLOAD_RETRIES || (error.status && error.status < 500)) {
+                    throw error;
+                }
+                const delay = Math.min(1000 * 2 ** attempt, 30000) * (0.5 + Math.random() / 2);
+                await new Promise(resolve => setTimeout(resolve, delay));
+            }
+        }
+    }
+    
+    // Multipart sessions are remembered per file, so selecting the same file
+    // again (even after a reload) resumes instead of starting over
+    function uploadSessionKey(file) {
+        return `upload:${file.name}:${file.size}:${file.lastModified}`;
+    }
+    
+    function loadUploadSession(file) {
+        try {
+            return JSON.parse(localStorage.getItem(uploadSessionKey(file)));
+        } catch (error) {
+            return null;
+        }
+    }
+    
+    function saveUploadSession(file, session) {
+        try {
+            localStorage.setItem(uploadSessionKey(file), JSON.stringify({
+                key: session.key,
+                uploadId: session.uploadId,
+                partSize: session.partSize
+            }));
+        } catch (error) {
+            console.warn('Could not save upload session:', error);
+        }
+    }
+    
+    function forgetUploadSession(file) {
+        try {
+            localStorage.removeItem(uploadSessionKey(file));
+        } catch (error) {
+            console.warn('Could not clear upload session:', error);
+        }
+    }
+    
+    async function resumeUpload(file, saved) {
+        return withRetries(() => postJson('/api/uploads/resume', {
+            key: saved.key,
+            uploadId: saved.uploadId,
+            size: file.size,
+            partSize: saved.partSize
+        }));
+    }
+    
+    async function uploadParts(file, session) {
+        // Sends every listed part and returns how many still failed after retries
+        let next = 0;
+        let failures = 0;
+        const worker = async () => {
+            while (next < session.parts.length) {
+                const part = session.parts[next++];
+                const start = (part.partNumber - 1) * session.partSize;
                 try {
-                    const base64Data = e.target.result.split(',')[1];
-                    
-                    const uploadData = {
-                        name: file.name,
-                        data: base64Data,
-                        contentType: file.type
-                    };
-                    
-                    const response = await fetch(`${API_BASE_URL}/api/pictures`, {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify(uploadData)
-                    });
-                    
-                    if (!response.ok) {
-                        const errorData = await response.json();
-                        throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
-                    }
-                    
-                    const result = await response.json();
-                    console.log('Upload successful:', result);
-                    resolve(result);
-                    
+                    await withRetries(() => putToS3(part.url, file.slice(start, start + session.partSize)));
                 } catch (error) {
-                    console.error('Error uploading file:', error);
-                    reject(error);
+                    console.error(`Error uploading part ${part.partNumber}:`, error);
+                    failures++;
                 }
-            };
-            
-            reader.onerror = function() {
-                reject(new Error('Error reading file'));
-            };
-            
-            reader.readAsDataURL(file);
-        });
+            }
+        };
+        await Promise.all(Array.from({ length: UPLOAD_PART_CONCURRENCY }, worker));
+        return failures;
+    }
+    
+    async function uploadSinglePicture(file, sha256 = null) {
+        // The file goes straight to S3; the API only signs URLs and registers it
+        const contentType = file.type || 'image/jpeg';
+        let session = null;
+        
+        const saved = loadUploadSession(file);
+        if (saved) {
+            try {
+                session = await resumeUpload(file, saved);
+                console.log(`Resuming ${file.name}: ${session.completed.length} part(s) already uploaded`);
+            } catch (error) {
+                if (!error.status || error.status >= 500) {
+                    throw error;
+                }
+                // The session is gone, so start over
+                forgetUploadSession(file);
+            }
+        }
+        
+        if (!session) {
+            session = await withRetries(() => postJson('/api/uploads', {
+                name: file.name,
+                contentType: contentType,
+                size: file.size,
+                sha256: sha256
+            }));
+            if (session.duplicate) {
+                return session;
+            }
+        }
+        
+        if (!session.uploadId) {
+            await withRetries(() => putToS3(session.url, file, session.headers));
+            const result = await withRetries(() => postJson('/api/uploads/complete', {
+                key: session.key,
+                name: file.name
+            }));
+            console.log('Upload successful:', result);
+            return result;
+        }
+        
+        saveUploadSession(file, session);
+        
+        // After a round with failed parts, ask the server which parts arrived
+        // and send only the rest, with freshly signed URLs
+        for (let round = 0; session.parts.length > 0; round++) {
+            const failures = await uploadParts(file, session);
+            if (failures === 0) {
+                break;
+            }
+            if (round >= UPLOAD_RETRIES) {
+                throw new Error(`${failures} part(s) could not be uploaded; upload the file again to resume`);
+            }
+            session = await resumeUpload(file, session);
+        }
+        
+        // The server completes the upload from the parts S3 has confirmed
+        const result = await withRetries(() => postJson('/api/uploads/complete', {
+            key: session.key,
+            name: file.name,
+            uploadId: session.uploadId
+        }));
+        forgetUploadSession(file);
+        console.log('Upload successful:', result);
+        return result;
     }
     
     async function showStats() {
@@ -1001,9 +1476,21 @@ def serve_js():
                     <span class="stats-label">💾 Total Storage</span>
                     <span class="stats-value">${formatBytes(stats.totalStorage)}</span>
                 </div>
+                ${Object.entries(stats.contentTypes || {}).map(([type, breakdown]) => `
+                    <div class="stats-item">
+                        <span class="stats-label">🖼️ ${type}</span>
+                        <span class="stats-value">${breakdown.count} (${formatBytes(breakdown.bytes)})</span>
+                    </div>
+                `).join('')}
+                ${Object.entries(stats.uploadsPerDay || {}).sort().reverse().slice(0, 7).map(([day, count]) => `
+                    <div class="stats-item">
+                        <span class="stats-label">⬆️ ${day}</span>
+                        <span class="stats-value">${count} uploaded</span>
+                    </div>
+                `).join('')}
                 <div class="stats-item">
                     <span class="stats-label">📅 Last Updated</span>
-                    <span class="stats-value">${new Date().toLocaleString()}</span>
+                    <span class="stats-value">${new Date(stats.updated || Date.now()).toLocaleString()}</span>
                 </div>
             `;
             
@@ -1022,42 +1509,133 @@ def serve_js():
         modal.style.display = 'none';
     }
     
-    // Close modal when clicking outside of it
-    window.onclick = function(event) {
-        const modal = document.getElementById('statsModal');
-        if (event.target === modal) {
-            closeStats();
-        }
-    }
+    // Groups in the open near-duplicates report, largest copy first
+    let duplicateGroups = [];
     
-    // Delete functionality
-    function enterSelectMode() {
-        const gallery = document.getElementById('gallery');
-        const deleteSection = document.getElementById('deleteSection');
-        const uploadSection = document.querySelector('.upload-section');
-        const selectModeBtn = document.getElementById('selectModeBtn');
+    async function showDuplicates() {
+        const modal = document.getElementById('duplicatesModal');
+        const list = document.getElementById('duplicatesList');
         
-        gallery.classList.add('selection-mode');
-        deleteSection.style.display = 'flex';
-        uploadSection.style.display = 'none';
-        selectModeBtn.style.display = 'none';
+        modal.style.display = 'block';
+        list.innerHTML = '<div class="loading">Looking for near-duplicates...</div>';
         
-        updateSelection();
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/pictures/duplicates`);
+            
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            
+            const report = await response.json();
+            duplicateGroups = report.groups || [];
+            
+            if (duplicateGroups.length === 0) {
+                list.innerHTML = '<div class="loading">No near-duplicates found.</div>';
+                return;
+            }
+            
+            list.innerHTML = duplicateGroups.map((group, index) => `
+                <div class="duplicate-group">
+                    <div class="duplicate-pictures">
+                        ${group.map((picture, position) => `
+                            <div class="duplicate-picture ${position === 0 ? 'keep' : ''}">
+                                <img src="${picture.thumb_url}" alt="${picture.name}" loading="lazy"
+                                     onclick="openFullSize('${picture.url}')">
+                                <div>${position === 0 ? '✓ Keep: ' : ''}${picture.name}</div>
+                                <div>${picture.width && picture.height ? `${picture.width}×${picture.height}` : ''}</div>
+                            </div>
+                        `).join('')}
+                    </div>
+                    <button class="delete-btn" onclick="deleteDuplicates(${index})">
+                        🗑️ Delete ${group.length - 1} cop${group.length > 2 ? 'ies' : 'y'}
+                    </button>
+                </div>
+            `).join('');
+            
+        } catch (error) {
+            console.error('Error loading duplicates:', error);
+            list.innerHTML = `
+                <div class="error">
+                    Failed to find near-duplicates: ${error.message}
+                </div>
+            `;
+        }
     }
     
-    function cancelSelection() {
-        const gallery = document.getElementById('gallery');
-        const deleteSection = document.getElementById('deleteSection');
-        const uploadSection = document.querySelector('.upload-section');
-        const selectModeBtn = document.getElementById('selectModeBtn');
-        const checkboxes = document.querySelectorAll('.picture-checkbox');
-        
-        gallery.classList.remove('selection-mode');
-        deleteSection.style.display = 'none';
-        uploadSection.style.display = 'flex';
-        selectModeBtn.style.display = 'block';
+    async function deleteDuplicates(index) {
+        const copies = duplicateGroups[index].slice(1);
+        const names = copies.map(picture => picture.name).join(', ');
+        if (!confirm(`Delete ${copies.length} near-duplicate(s) and keep "${duplicateGroups[index][0].name}"?\n\n${names}`)) {
+            return;
+        }
         
-        // Uncheck all checkboxes and remove selected class
+        try {
+            // Copies often share a file name, so delete them by id
+            const response = await fetch(`${API_BASE_URL}/api/pictures`, {
+                method: 'DELETE',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    ids: copies.map(picture => picture.id)
+                })
+            });
+            
+            if (!response.ok) {
+                const errorData = await response.json();
+                throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+            }
+            
+            loadPictures();
+            showDuplicates();
+        } catch (error) {
+            console.error('Error deleting duplicates:', error);
+            alert(`Failed to delete duplicates: ${error.message}`);
+        }
+    }
+    
+    function closeDuplicates() {
+        document.getElementById('duplicatesModal').style.display = 'none';
+    }
+    
+    // Close modals when clicking outside of them
+    window.onclick = function(event) {
+        if (event.target === document.getElementById('statsModal')) {
+            closeStats();
+        }
+        if (event.target === document.getElementById('duplicatesModal')) {
+            closeDuplicates();
+        }
+    }
+    
+    // Delete functionality
+    function enterSelectMode() {
+        const gallery = document.getElementById('gallery');
+        const deleteSection = document.getElementById('deleteSection');
+        const uploadSection = document.querySelector('.upload-section');
+        const selectModeBtn = document.getElementById('selectModeBtn');
+        
+        gallery.classList.add('selection-mode');
+        deleteSection.style.display = 'flex';
+        uploadSection.style.display = 'none';
+        selectModeBtn.style.display = 'none';
+        
+        updateSelection();
+    }
+    
+    function cancelSelection() {
+        const gallery = document.getElementById('gallery');
+        const deleteSection = document.getElementById('deleteSection');
+        const uploadSection = document.querySelector('.upload-section');
+        const selectModeBtn = document.getElementById('selectModeBtn');
+        const checkboxes = document.querySelectorAll('.picture-checkbox');
+        
+        gallery.classList.remove('selection-mode');
+        deleteSection.style.display = 'none';
+        uploadSection.style.display = 'flex';
+        selectModeBtn.style.display = 'block';
+        
+        // Uncheck all checkboxes and remove selected class
         checkboxes.forEach(checkbox => {
             checkbox.checked = false;
             checkbox.closest('.picture-item').classList.remove('selected');
@@ -1120,9 +1698,8 @@ def serve_js():
     
     async function deleteSelected() {
         const checkboxes = document.querySelectorAll('.picture-checkbox:checked');
-        const pictureNames = Array.from(checkboxes).map(cb => 
-            cb.closest('.picture-item').dataset.pictureName
-        );
+        const selectedItems = Array.from(checkboxes).map(cb => cb.closest('.picture-item'));
+        const pictureNames = selectedItems.map(item => item.dataset.pictureName);
         
         if (pictureNames.length === 0) {
             alert('Please select at least one picture to delete.');
@@ -1147,8 +1724,9 @@ def serve_js():
                 headers: {
                     'Content-Type': 'application/json',
                 },
+                // Several pictures can share a name, so delete exactly the selected ones by id
                 body: JSON.stringify({
-                    pictures: pictureNames
+                    ids: selectedItems.map(item => item.dataset.pictureId)
                 })
             });
             
@@ -1264,11 +1842,11 @@ def serve_js():
     
     async function downloadSelected() {
         const checkboxes = document.querySelectorAll('.picture-checkbox:checked');
-        const pictureNames = Array.from(checkboxes).map(cb => 
-            cb.closest('.picture-item').dataset.pictureName
+        const pictureIds = Array.from(checkboxes).map(cb => 
+            cb.closest('.picture-item').dataset.pictureId
         );
         
-        if (pictureNames.length === 0) {
+        if (pictureIds.length === 0) {
             alert('Please select at least one picture to download.');
             return;
         }
@@ -1285,7 +1863,7 @@ def serve_js():
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    pictures: pictureNames
+                    ids: pictureIds
                 })
             });
             
@@ -1294,27 +1872,35 @@ def serve_js():
                 throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
             }
             
-            // Get the ZIP file as blob
-            const blob = await response.blob();
-            
-            // Create download link
-            const url = window.URL.createObjectURL(blob);
             const a = document.createElement('a');
             a.style.display = 'none';
-            a.href = url;
-            a.download = `photos_${new Date().toISOString().split('T')[0]}.zip`;
+            
+            // Large archives are stored in S3 and returned as a link
+            let url = null;
+            if ((response.headers.get('Content-Type') || '').includes('application/json')) {
+                const result = await response.json();
+                a.href = result.url;
+            } else {
+                // Get the ZIP file as blob
+                const blob = await response.blob();
+                url = window.URL.createObjectURL(blob);
+                a.href = url;
+                a.download = `photos_${new Date().toISOString().split('T')[0]}.zip`;
+            }
             
             document.body.appendChild(a);
             a.click();
             
             // Cleanup
-            window.URL.revokeObjectURL(url);
+            if (url) {
+                window.URL.revokeObjectURL(url);
+            }
             document.body.removeChild(a);
             
             // Show success message
             const successDiv = document.createElement('div');
             successDiv.className = 'success';
-            successDiv.textContent = `Successfully prepared download of ${pictureNames.length} picture(s)!`;
+            successDiv.textContent = `Successfully prepared download of ${pictureIds.length} picture(s)!`;
             document.querySelector('.container').insertBefore(successDiv, document.querySelector('main'));
             
             setTimeout(() => successDiv.remove(), 3000);
@@ -1331,7 +1917,14 @@ def serve_js():
         }
     }
     
-    async function ratePicture(pictureName, rating) {
+    function formatRating(rating, count) {
+        if (!count) {
+            return 'Not rated';
+        }
+        return `${Number(rating).toFixed(1)}/5 (${count} ${count === 1 ? 'vote' : 'votes'})`;
+    }
+    
+    async function ratePicture(pictureId, rating) {
         try {
             const response = await fetch(`${API_BASE_URL}/api/pictures/rate`, {
                 method: 'POST',
@@ -1339,7 +1932,7 @@ def serve_js():
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    picture: pictureName,
+                    id: pictureId,
                     rating: rating
                 })
             });
@@ -1353,20 +1946,20 @@ def serve_js():
             console.log('Rating saved:', result);
             
             // Update the stars display immediately
-            const starsContainer = document.querySelector(`[data-picture="${pictureName}"]`);
+            const starsContainer = document.querySelector(`[data-picture="${pictureId}"]`);
             if (starsContainer) {
                 const stars = starsContainer.querySelectorAll('.star');
                 const ratingText = starsContainer.parentElement.querySelector('.rating-text');
                 
                 stars.forEach((star, index) => {
-                    if (index < rating) {
+                    if (index < Math.round(result.rating)) {
                         star.classList.add('filled');
                     } else {
                         star.classList.remove('filled');
                     }
                 });
                 
-                ratingText.textContent = `${rating}/5`;
+                ratingText.textContent = formatRating(result.rating, result.rating_count);
             }
             
         } catch (error) {
@@ -1375,24 +1968,61 @@ def serve_js():
         }
     }
 
-    function toggleComments(pictureName) {
-        const containerId = `comments-${pictureName.replace(/[^a-zA-Z0-9]/g, '_')}`;
+    function toggleComments(pictureId) {
+        const containerId = `comments-${pictureId.replace(/[^a-zA-Z0-9]/g, '_')}`;
         const container = document.getElementById(containerId);
         const button = container.previousElementSibling.querySelector('.toggle-comments');
         
         if (container.style.display === 'none') {
             container.style.display = 'block';
             button.textContent = 'Hide Comments';
+            if (!container.dataset.loaded && Number(button.dataset.count) > 0) {
+                loadComments(pictureId, container);
+            }
         } else {
             container.style.display = 'none';
             // Reset button text based on comment count
-            const existingComments = container.querySelectorAll('.comment');
-            button.textContent = existingComments.length > 0 ? `Show ${existingComments.length}` : 'Add Comment';
+            const commentCount = Number(button.dataset.count);
+            button.textContent = commentCount > 0 ? `Show ${commentCount}` : 'Add Comment';
+        }
+    }
+    
+    function renderComment(comment) {
+        return `
+            <div class="comment">
+                <div class="comment-header">
+                    <span class="comment-author">${comment.author}</span>
+                    <span class="comment-date">${new Date(comment.date).toLocaleDateString()}</span>
+                </div>
+                <div class="comment-text">${comment.text}</div>
+            </div>
+        `;
+    }
+    
+    // Threads are fetched the first time they are opened; listings only carry counts
+    async function loadComments(pictureId, container) {
+        const existingComments = container.querySelector('.existing-comments');
+        existingComments.innerHTML = '<div class="comment">Loading comments...</div>';
+        
+        try {
+            const params = new URLSearchParams({ id: pictureId });
+            const response = await fetch(`${API_BASE_URL}/api/pictures/comments?${params}`);
+            
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            
+            const data = await response.json();
+            existingComments.innerHTML = data.comments.map(renderComment).join('');
+            container.dataset.loaded = 'true';
+        } catch (error) {
+            console.error('Error loading comments:', error);
+            existingComments.innerHTML = `<div class="comment">Failed to load comments: ${error.message}</div>`;
         }
     }
 
-    async function submitComment(pictureName) {
-        const containerId = `comments-${pictureName.replace(/[^a-zA-Z0-9]/g, '_')}`;
+    async function submitComment(pictureId) {
+        const containerId = `comments-${pictureId.replace(/[^a-zA-Z0-9]/g, '_')}`;
         const container = document.getElementById(containerId);
         const nameInput = container.querySelector('.comment-name');
         const textInput = container.querySelector('.comment-input');
@@ -1424,7 +2054,7 @@ def serve_js():
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    picture: pictureName,
+                    id: pictureId,
                     author: authorName,
                     text: commentText
                 })
@@ -1457,8 +2087,8 @@ def serve_js():
             
             // Update the toggle button text
             const button = container.previousElementSibling.querySelector('.toggle-comments');
-            const commentCount = existingComments.querySelectorAll('.comment').length;
-            button.textContent = `Show ${commentCount}`;
+            button.dataset.count = result.comment_count;
+            button.textContent = `Show ${result.comment_count}`;
             
             // Show success message
             alert('Comment posted successfully!');
@@ -1473,272 +2103,2133 @@ def serve_js():
     }
     """
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/javascript',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': js_content
-    }
+    return js_content
 
-def get_pictures():
-    """Get list of pictures from S3"""
-    try:
-        print(f"Getting pictures from bucket: {PICTURES_BUCKET}")
-        
-        response = s3_client.list_objects_v2(
-            Bucket=PICTURES_BUCKET,
-            Prefix='pictures/'
-        )
-        
-        print(f"S3 response keys: {list(response.keys())}")
-        
-        pictures = []
-        if 'Contents' in response:
-            print(f"Found {len(response['Contents'])} objects")
-            for obj in response['Contents']:
-                print(f"Processing object: {obj['Key']}")
-                if obj['Key'].lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                    # Generate presigned URL for the image
-                    url = s3_client.generate_presigned_url(
-                        'get_object',
-                        Params={'Bucket': PICTURES_BUCKET, 'Key': obj['Key']},
-                        ExpiresIn=3600  # 1 hour
-                    )
-                    
-                    # Get object metadata to retrieve rating
-                    try:
-                        head_response = s3_client.head_object(
-                            Bucket=PICTURES_BUCKET,
-                            Key=obj['Key']
-                        )
-                        metadata = head_response.get('Metadata', {})
-                        rating = int(metadata.get('rating', 0)) if metadata.get('rating') else 0
-                        original_name = metadata.get('original-name', obj['Key'].split('/')[-1])
-                        
-                        # Parse comments from metadata
-                        comments = []
-                        comments_json = metadata.get('comments', '')
-                        if comments_json:
-                            try:
-                                comments = json.loads(comments_json)
-                            except json.JSONDecodeError as json_error:
-                                print(f"Error parsing comments JSON for {obj['Key']}: {json_error}")
-                                comments = []
-                    except Exception as meta_error:
-                        print(f"Error getting metadata for {obj['Key']}: {meta_error}")
-                        rating = 0
-                        original_name = obj['Key'].split('/')[-1]
-                        comments = []
-                    
-                    picture_info = {
-                        'name': original_name,
-                        'date': obj['LastModified'].isoformat(),
-                        'url': url,
-                        'rating': rating,
-                        'comments': comments
-                    }
-                    pictures.append(picture_info)
-                    print(f"Added picture: {picture_info['name']} (rating: {rating})")
-        else:
-            print("No 'Contents' key in S3 response - bucket may be empty or prefix not found")
-        
-        # Sort by date (newest first)
-        pictures.sort(key=lambda x: x['date'], reverse=True)
-        
-        print(f"Returning {len(pictures)} pictures")
-        
-        return {
-            'statusCode': 200,
-            'headers': get_cors_headers(),
-            'body': json.dumps({
-                'pictures': pictures,
-                'count': len(pictures)
-            })
-        }
-        
-    except Exception as e:
-        print(f"Error getting pictures: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+# Static assets
+#
+# The page, stylesheet and script never change within a deployment, so they
+# are built once per container, at import, by static_assets, which keeps every
+# compressed representation with its own ETag and answers revalidations with
+# 304.
+#
+# The page itself links a minified bundle under /static/ whose file names
+# carry a hash of their content. A deploy that changes the stylesheet or
+# script changes its URL, so the bundle is served as immutable and repeat
+# visitors only revalidate the page. Every container derives the same names
+# from the same source. /style.css and /script.js still serve the bundle,
+# revalidated, for pages rendered before it existed.
+
+def build_static_assets():
+    """Minify and hash the stylesheet and script, then render the page linking them, by path"""
+    assets = {}
+    bundle = {}
+    for path, source, extension, content_type in (
+        ('/style.css', minify_css(css_source()), 'css', 'text/css'),
+        ('/script.js', minify_js(js_source()), 'js', 'application/javascript')
+    ):
+        asset = build_static_asset(source, content_type)
+        bundle[path] = f"{STATIC_PREFIX}app.{hashlib.sha256(source.encode('utf-8')).hexdigest()[:12]}.{extension}"
+        assets[path] = asset
+        assets[bundle[path]] = {**asset, 'cache_control': IMMUTABLE_CACHE_CONTROL}
+    assets['/'] = build_static_asset(html_source(bundle['/style.css'], bundle['/script.js']), 'text/html')
+    return assets
+
+def serve_html(event=None):
+    """Serve the main HTML page"""
+    return static_asset_response(_static_assets['/'], event)
+
+def serve_css(event=None):
+    """Serve the CSS styles"""
+    return static_asset_response(_static_assets['/style.css'], event)
+
+def serve_js(event=None):
+    """Serve the JavaScript code"""
+    return static_asset_response(_static_assets['/script.js'], event)
+
+def serve_static(event, path):
+    """Serve a file of the content-hashed bundle"""
+    asset = _static_assets.get(path) if path.startswith(STATIC_PREFIX) else None
+    if asset is None:
         return {
-            'statusCode': 500,
+            'statusCode': 404,
             'headers': get_cors_headers(),
-            'body': json.dumps({'error': f'Failed to get pictures: {str(e)}'})
+            'body': json.dumps({'error': 'Not found'})
         }
+    
+    return static_asset_response(asset, event)
 
-def get_stats():
-    """Get gallery statistics from S3"""
-    try:
-        print(f"Getting stats from bucket: {PICTURES_BUCKET}")
+# Pictures bucket helpers
+#
+# Presigning, listing, concurrency and image decoding live in gallery_common,
+# which the split frontend and backend Lambdas import as well. These
+# wrappers default them to this function's client and pictures bucket.
+
+def presign_get_url(key, bucket=None, client=None, now=None):
+    """Get a presigned GET URL for an object that is stable within a time window"""
+    return gallery_common.presign_get_url(key, bucket or PICTURES_BUCKET, client or s3_client, now)
+
+def iter_bucket_objects(prefix=PICTURES_PREFIX, bucket=None, client=None):
+    """Yield every object under a prefix, listing key ranges in parallel when needed"""
+    return gallery_common.iter_bucket_objects(prefix, bucket or PICTURES_BUCKET, client or s3_client)
+
+# Bulk delete
+#
+# delete_objects accepts at most 1000 keys, so deletes are split into
+# batches that are issued concurrently. Per-picture artifacts are removed in
+# the same pass. Derivative keys follow from the names in the manifest entry
+# and the properties sidecar has a fixed name; comment logs, rating votes and
+# resized copies have generated names under <root>/<picture file name>/, so
+# only those per-picture prefixes are listed, never a whole artifact root. Each prefix is small and paged through in
+# order, so the listings share one bounded pool and never start pools of
+# their own while holding its connections.
+
+LISTED_DERIVED_PREFIXES = (COMMENTS_PREFIX, RATINGS_PREFIX, RESIZED_PREFIX)
+
+def list_prefix_keys(prefix):
+    """List every key under a small prefix, one page after another"""
+    params = {'Bucket': PICTURES_BUCKET, 'Prefix': prefix}
+    keys = []
+    while True:
+        response = s3_client.list_objects_v2(**params)
+        keys.extend(obj['Key'] for obj in response.get('Contents', []))
+        if not response.get('IsTruncated'):
+            return keys
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+def derived_object_keys(picture_keys, manifest):
+    """Find the artifact objects that belong to a set of pictures"""
+    picture_keys = sorted(set(picture_keys))
+    keys = [
+        derivative_key(key, name)
+        for key in picture_keys
+        for name in manifest['pictures'].get(key, {}).get('derivatives', [])
+    ]
+    # Only pictures whose properties were read have a sidecar
+    keys.extend(
+        image_properties_key(key) for key in picture_keys
+        if any(field in manifest['pictures'].get(key, {}) for field in IMAGE_PROPERTY_FIELDS)
+    )
+    prefixes = [f"{root}{key[len(PICTURES_PREFIX):]}/" for root in LISTED_DERIVED_PREFIXES for key in picture_keys]
+    for listing in map_concurrently(list_prefix_keys, prefixes):
+        keys.extend(listing)
+    return keys
+
+def delete_keys(keys):
+    """Delete keys in concurrent batches, returning {key: error or None}"""
+    keys = list(dict.fromkeys(keys))
+    batches = [keys[start:start + DELETE_BATCH_SIZE] for start in range(0, len(keys), DELETE_BATCH_SIZE)]
+    
+    def delete_batch(batch):
+        try:
+            # Quiet mode only reports failures, which keeps responses small
+            response = s3_client.delete_objects(
+                Bucket=PICTURES_BUCKET,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            return {error['Key']: error.get('Message') or error.get('Code', 'Error')
+                    for error in response.get('Errors', [])}
+        except Exception as e:
+            print(f"Error deleting batch of {len(batch)} keys: {e}")
+            return {key: str(e) for key in batch}
+    
+    outcomes = dict.fromkeys(keys)
+    for errors in map_concurrently(delete_batch, batches):
+        outcomes.update(errors)
+    return outcomes
+
+# Streaming ZIP archives
+#
+# zipfile writes to non-seekable file objects by emitting a data descriptor
+# after each entry, so an archive can be produced front to back without ever
+# holding it in memory. Objects are fetched a few entries ahead so S3
+# latency overlaps with compression, and each body is copied in chunks.
+# Archives too large for a Lambda response are written straight into an S3
+# multipart upload; memory stays bounded by a few parts in flight.
+#
+# Deflating data that is already compressed costs CPU for no size gain, so
+# each entry is stored or deflated on its own: known compressed formats are
+# stored outright, anything else is deflated only if a fast compression of a
+# sample of its first chunk saves at least a tenth of the bytes.
+
+class S3MultipartWriter:
+    """Write-only file object that streams into an S3 multipart upload"""
+    
+    def __init__(self, key, content_type='application/octet-stream', part_size=None,
+                 max_in_flight=2, bucket=None, client=None):
+        self.client = client or s3_client
+        self.bucket = bucket or PICTURES_BUCKET
+        self.key = key
+        self.part_size = max(part_size or MULTIPART_PART_SIZE, MULTIPART_MIN_PART_SIZE)
+        self.upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=content_type
+        )['UploadId']
+        self.buffer = bytearray()
+        self.position = 0
+        self.parts = []
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.closed = False
+    
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def flush(self):
+        pass
+    
+    def _upload_part(self, data):
+        # Blocks while max_in_flight parts are still uploading
+        self.slots.acquire()
+        part_number = len(self.parts) + 1
         
-        # List all objects in the pictures folder
-        response = s3_client.list_objects_v2(
+        def upload():
+            try:
+                response = self.client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=data
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                self.slots.release()
+        
+        self.parts.append(self.executor.submit(upload))
+    
+    def close(self):
+        """Upload the final part and complete the upload"""
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.parts:
+                self._upload_part(bytes(self.buffer))
+                self.buffer.clear()
+            parts = [future.result() for future in self.parts]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            self.closed = True
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=True)
+    
+    def abort(self):
+        """Discard every uploaded part"""
+        if self.closed:
+            return
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            print(f"Error aborting multipart upload {self.upload_id}: {e}")
+
+def choose_compression(content_type, sample):
+    """Pick ZIP_STORED or ZIP_DEFLATED for an archive entry"""
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type in PRECOMPRESSED_CONTENT_TYPES:
+        return zipfile.ZIP_STORED
+    probe = sample[:COMPRESSION_PROBE_SIZE]
+    if not probe or len(zlib.compress(probe, 1)) > len(probe) * COMPRESSION_PROBE_RATIO:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def unique_archive_names(entries):
+    """Number repeated archive names in (archive name, S3 key) pairs, so pictures sharing a name are all kept"""
+    seen = set()
+    unique = []
+    for name, key in entries:
+        stem, dot, extension = name.rpartition('.')
+        if not dot:
+            stem, extension = name, ''
+        candidate, copy = name, 1
+        while candidate.lower() in seen:
+            copy += 1
+            candidate = f"{stem} ({copy}){dot}{extension}"
+        seen.add(candidate.lower())
+        unique.append((candidate, key))
+    return unique
+
+def write_zip_entries(fileobj, entries):
+    """Stream (archive name, S3 key) pairs into a ZIP archive, returning the number written"""
+    def fetch(key):
+        return s3_client.get_object(Bucket=PICTURES_BUCKET, Key=key)
+    
+    entries = iter(entries)
+    written = 0
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_PREFETCH) as executor, \
+            zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        pending = deque()
+        
+        def prefetch_next():
+            for name, key in entries:
+                pending.append((name, key, executor.submit(fetch, key)))
+                return
+        
+        for _ in range(DOWNLOAD_PREFETCH):
+            prefetch_next()
+        
+        while pending:
+            name, key, future = pending.popleft()
+            prefetch_next()
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f"Error downloading {key}: {e}")
+                continue
+            
+            body = response['Body']
+            first_chunk = body.read(STREAM_CHUNK_SIZE)
+            entry_info = zipfile.ZipInfo(name, time.localtime()[:6])
+            entry_info.compress_type = choose_compression(response.get('ContentType'), first_chunk)
+            large = (response.get('ContentLength') or 0) >= zipfile.ZIP64_LIMIT
+            with zip_file.open(entry_info, 'w', force_zip64=large) as entry:
+                entry.write(first_chunk)
+                for chunk in iter(lambda: body.read(STREAM_CHUNK_SIZE), b''):
+                    entry.write(chunk)
+            written += 1
+    return written
+
+# Object metadata cache
+#
+# head_object results are kept per S3 key for the life of a warm container and
+# revalidated against the ETag and LastModified values that list_objects_v2
+# already returns, so unchanged objects are never fetched twice. ETags alone
+# are not enough: copy_object with replaced metadata keeps the ETag.
+
+def get_object_metadata(obj):
+    """Get head_object data for a listed object, using the warm-container cache"""
+    key = obj['Key']
+    etag = obj.get('ETag')
+    last_modified = obj.get('LastModified')
+    
+    with _metadata_cache_lock:
+        cached = _metadata_cache.get(key)
+        if cached is not None and etag and cached['etag'] == etag and cached['last_modified'] == last_modified:
+            _metadata_cache.move_to_end(key)
+        else:
+            cached = None
+    
+    if cached is not None:
+        head = cached['head']
+    else:
+        head_response = s3_client.head_object(
             Bucket=PICTURES_BUCKET,
-            Prefix='pictures/'
+            Key=key
         )
-        
-        total_pictures = 0
-        total_storage = 0
-        
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                if obj['Key'].lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                    total_pictures += 1
-                    total_storage += obj['Size']
-        
-        print(f"Stats: {total_pictures} pictures, {total_storage} bytes")
-        
-        return {
-            'statusCode': 200,
-            'headers': get_cors_headers(),
-            'body': json.dumps({
-                'totalPictures': total_pictures,
-                'totalStorage': total_storage
-            })
+        head = {
+            'Metadata': head_response.get('Metadata', {}),
+            'ContentType': head_response.get('ContentType', 'image/jpeg'),
+            'ContentLength': head_response.get('ContentLength', 0)
         }
-        
+        # Listings without validators cannot be revalidated, so don't cache them
+        if etag:
+            with _metadata_cache_lock:
+                _metadata_cache[key] = {'etag': etag, 'last_modified': last_modified, 'head': head}
+                _metadata_cache.move_to_end(key)
+                while len(_metadata_cache) > METADATA_CACHE_SIZE:
+                    _metadata_cache.popitem(last=False)
+    
+    # Callers update metadata in place before writing it back
+    return {**head, 'Metadata': dict(head['Metadata'])}
+
+def forget_object_metadata(*keys):
+    """Drop cached metadata for objects this container has rewritten or deleted"""
+    with _metadata_cache_lock:
+        for key in keys:
+            _metadata_cache.pop(key, None)
+
+# Gallery manifest
+#
+# The manifest is a single JSON document that mirrors the listing-relevant
+# metadata of every picture, so the gallery can be listed with one GET instead
+# of a HEAD request per object. It is kept up to date by every write path and
+# rebuilt from the bucket whenever it is missing or unreadable.
+#
+# Writers never save a copy they read earlier. modify_manifest re-reads the
+# document, applies one change and writes it back with If-Match on the ETag
+# it read, so a concurrent writer's update makes the PUT fail instead of
+# being overwritten; the change is then reapplied to the newer document.
+# Rebuilt manifests are saved under the ETag read before the rebuild began.
+# An update that still fails leaves the stored manifest as it is, and the
+# scheduled rebuild reconciles it; the manifest is never dropped.
+
+def build_manifest_entry(key, name, date, size=0, content_type='image/jpeg',
+                         rating_count=0, rating_sum=0, comment_count=0, derivatives=(), properties=None):
+    """Build a manifest entry for a single picture"""
+    entry = {
+        'key': key,
+        'name': name,
+        'date': date,
+        'size': size,
+        'content_type': content_type,
+        'comment_count': comment_count,
+        'derivatives': list(derivatives)
+    }
+    entry.update(rating_summary(rating_count, rating_sum))
+    if properties:
+        entry.update((field, properties[field]) for field in IMAGE_PROPERTY_FIELDS if field in properties)
+    return entry
+
+def read_manifest_version():
+    """Read the manifest document and its ETag; the document is None if it is missing or unreadable"""
+    try:
+        response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=MANIFEST_KEY)
     except Exception as e:
-        print(f"Error getting stats: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        return {
-            'statusCode': 500,
-            'headers': get_cors_headers(),
-            'body': json.dumps({'error': f'Failed to get stats: {str(e)}'})
-        }
+        print(f"Could not read manifest {MANIFEST_KEY}: {e}")
+        return None, None
+    try:
+        manifest = json.loads(response['Body'].read())
+        if isinstance(manifest, dict) and isinstance(manifest.get('pictures'), dict):
+            return manifest, response['ETag']
+        print("Manifest has an unexpected format")
+    except Exception as e:
+        print(f"Could not parse manifest {MANIFEST_KEY}: {e}")
+    return None, response['ETag']
 
-def delete_pictures(event):
-    """Delete multiple pictures from S3"""
+def read_stored_manifest():
+    """Read the manifest document from S3, returning None if it is missing or unreadable"""
+    return read_manifest_version()[0]
+
+def load_manifest():
+    """Load the gallery manifest, rebuilding it from S3 if it is missing"""
+    manifest, etag = read_manifest_version()
+    if manifest is not None:
+        return manifest
+    
+    print("Rebuilding manifest")
+    manifest = rebuild_manifest(previous={'pictures': {}})
     try:
-        # Parse the request body
-        body = event.get('body', '')
-        if event.get('isBase64Encoded', False):
-            body = base64.b64decode(body).decode('utf-8')
-        
-        if not body:
-            return {
-                'statusCode': 400,
-                'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'No request body provided'})
-            }
-        
-        data = json.loads(body)
-        picture_names = data.get('pictures', [])
-        
-        if not picture_names:
-            return {
-                'statusCode': 400,
-                'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'No pictures specified for deletion'})
-            }
-        
-        print(f"Deleting pictures: {picture_names}")
-        print(f"Picture names type: {type(picture_names)}")
-        for i, name in enumerate(picture_names):
-            print(f"Picture {i}: '{name}' (type: {type(name)})")
-        
-        # First, get all objects to find the actual S3 keys
-        response = s3_client.list_objects_v2(
-            Bucket=PICTURES_BUCKET,
-            Prefix='pictures/'
-        )
-        
-        # Create a mapping of picture names to S3 keys using metadata
-        name_to_key = {}
-        keys_to_delete = []
-        not_found = []
-        
-        if 'Contents' in response:
-            print(f"Found {len(response['Contents'])} objects in S3")
-            for obj in response['Contents']:
-                key = obj['Key']
-                try:
-                    # Get object metadata to find original name
-                    head_response = s3_client.head_object(
-                        Bucket=PICTURES_BUCKET,
-                        Key=key
-                    )
-                    metadata = head_response.get('Metadata', {})
-                    original_name = metadata.get('original-name', key.split('/')[-1])
-                    print(f"S3 object: {key} -> original_name: '{original_name}' (metadata: {metadata})")
-                    
-                    # Check if this picture should be deleted
-                    for picture_name in picture_names:
-                        print(f"Comparing '{picture_name}' with '{original_name}'")
-                        if (original_name == picture_name or 
-                            picture_name.lower() in original_name.lower() or
-                            original_name.lower() in picture_name.lower()):
-                            keys_to_delete.append({'Key': key})
-                            name_to_key[picture_name] = key
-                            print(f"Found match: {picture_name} -> {key} (original: {original_name})")
-                            break
-                            
-                except Exception as meta_error:
-                    print(f"Error getting metadata for {key}: {meta_error}")
-                    # Fallback to filename matching
-                    filename = key.split('/')[-1]
-                    for picture_name in picture_names:
-                        if (picture_name.lower() in filename.lower() or
-                            filename.lower().startswith(picture_name.lower())):
-                            keys_to_delete.append({'Key': key})
-                            name_to_key[picture_name] = key
-                            print(f"Found fallback match: {picture_name} -> {key}")
-                            break
-        
-        # Check for pictures that weren't found
-        for picture_name in picture_names:
-            if picture_name not in name_to_key:
-                not_found.append(picture_name)
-                print(f"Picture not found: {picture_name}")
-        
-        if not keys_to_delete:
-            return {
-                'statusCode': 404,
-                'headers': get_cors_headers(),
-                'body': json.dumps({
-                    'error': 'No matching pictures found for deletion',
-                    'not_found': not_found
-                })
-            }
-        
-        # Delete the objects from S3
-        delete_response = s3_client.delete_objects(
-            Bucket=PICTURES_BUCKET,
-            Delete={
-                'Objects': keys_to_delete,
-                'Quiet': False
-            }
-        )
-        
-        deleted_count = len(delete_response.get('Deleted', []))
-        errors = delete_response.get('Errors', [])
-        
-        print(f"Successfully deleted {deleted_count} pictures")
-        if errors:
-            print(f"Errors during deletion: {errors}")
-        
-        result = {
-            'deleted_count': deleted_count,
-            'requested_count': len(picture_names)
-        }
-        
-        if not_found:
-            result['not_found'] = not_found
-        
-        if errors:
-            result['errors'] = errors
-        
-        return {
-            'statusCode': 200,
-            'headers': get_cors_headers(),
-            'body': json.dumps(result)
-        }
-        
+        save_manifest(manifest, **manifest_write_conditions(etag))
     except Exception as e:
-        print(f"Error deleting pictures: {str(e)}")
-        import traceback
+        # Another writer stored a manifest during the rebuild; theirs is kept
+        print(f"Error saving rebuilt manifest: {e}")
+    return manifest
+
+def save_manifest(manifest, **conditions):
+    """Write the gallery manifest back to S3, under IfMatch/IfNoneMatch conditions if given"""
+    manifest['updated'] = datetime.now(timezone.utc).isoformat()
+    s3_client.put_object(
+        Bucket=PICTURES_BUCKET,
+        Key=MANIFEST_KEY,
+        Body=json.dumps(manifest, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json',
+        CacheControl='no-cache',
+        **conditions
+    )
+
+def manifest_write_conditions(etag):
+    """PUT conditions that only succeed if the document read with etag (None: no document) is still current"""
+    return {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+
+def is_write_conflict(error):
+    """Whether a conditional PUT failed because the object changed, or was removed, since it was read"""
+    return error.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict',
+                                                           'NoSuchKey', '404')
+
+def modify_manifest(change):
+    """Apply change(manifest) to the stored manifest and write it back unless another writer got in first, retrying"""
+    for attempt in range(MANIFEST_WRITE_ATTEMPTS):
+        manifest, etag = read_manifest_version()
+        if manifest is None:
+            manifest = rebuild_manifest(previous={'pictures': {}})
+        if change(manifest) is False:
+            # Nothing to write
+            return manifest
+        try:
+            save_manifest(manifest, **manifest_write_conditions(etag))
+            return manifest
+        except ClientError as e:
+            if not is_write_conflict(e):
+                raise
+        print(f"Manifest changed during update (attempt {attempt + 1}), retrying")
+        time.sleep(random.uniform(0, MANIFEST_RETRY_DELAY * 2 ** attempt))
+    raise RuntimeError(f'Manifest kept changing; gave up after {MANIFEST_WRITE_ATTEMPTS} attempts')
+
+def manifest_entry_for_object(obj):
+    """Build a manifest entry for a listed object from its S3 metadata"""
+    key = obj['Key']
+    fallback_name = key.split('/')[-1]
+    last_modified = obj.get('LastModified')
+    date = last_modified.isoformat() if last_modified else ''
+    try:
+        head_response = get_object_metadata(obj)
+        metadata = head_response.get('Metadata', {})
+        rating = int(metadata.get('rating', 0)) if metadata.get('rating') else 0
+        return build_manifest_entry(
+            key,
+            metadata.get('original-name', fallback_name),
+            date or metadata.get('upload_date', ''),
+            size=obj.get('Size', head_response.get('ContentLength', 0)),
+            content_type=head_response.get('ContentType', 'image/jpeg'),
+            rating_count=1 if rating else 0,
+            rating_sum=rating,
+            comment_count=len(legacy_comments(metadata, key))
+        )
+    except Exception as meta_error:
+        print(f"Error getting metadata for {key}: {meta_error}")
+        return build_manifest_entry(key, fallback_name, date, size=obj.get('Size', 0))
+
+def rebuild_manifest(previous=None):
+    """Rebuild the gallery manifest by scanning the pictures prefix, carrying image properties over from previous"""
+    print(f"Rebuilding manifest from bucket: {PICTURES_BUCKET}")
+    if previous is None:
+        previous = read_stored_manifest() or {'pictures': {}}
+    
+    image_objects = [
+        obj for obj in iter_bucket_objects(PICTURES_PREFIX)
+        if obj['Key'].lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    entries = map_concurrently(manifest_entry_for_object, image_objects)
+    pictures = {entry['key']: entry for entry in entries}
+    
+    for key, (count, total) in tally_ratings().items():
+        entry = pictures.get(key)
+        if entry:
+            entry.update(rating_summary(entry['rating_count'] + count, entry['rating_sum'] + total))
+    
+    for key, (compacted, pending) in count_comment_threads().items():
+        entry = pictures.get(key)
+        if entry:
+            base = entry['comment_count'] if compacted is None else compacted
+            entry['comment_count'] = base + pending
+    
+    derivatives, saved_properties = list_derivatives()
+    for key, names in derivatives.items():
+        entry = pictures.get(key)
+        if entry:
+            entry['derivatives'] = names
+    
+    # Image properties never change for a key, so they carry over from the
+    # previous document; pictures it lacks read their properties sidecar
+    for key, old_entry in previous['pictures'].items():
+        entry = pictures.get(key)
+        if entry:
+            entry.update((field, old_entry[field]) for field in IMAGE_PROPERTY_FIELDS if field in old_entry)
+    unknown = [
+        key for key in saved_properties
+        if key in pictures and any(field not in pictures[key] for field in IMAGE_PROPERTY_FIELDS)
+    ]
+    for key, properties in zip(unknown, map_concurrently(load_image_properties, unknown)):
+        if properties:
+            pictures[key].update((field, properties[field]) for field in IMAGE_PROPERTY_FIELDS if field in properties)
+    
+    manifest = {'version': 1, 'pictures': pictures, 'names': {}}
+    for entry in pictures.values():
+        index_picture_name(manifest, entry)
+    
+    print(f"Rebuilt manifest with {len(pictures)} pictures")
+    return manifest
+
+def invalidate_manifest():
+    """Drop the manifest so the next read rebuilds it from the bucket"""
+    try:
+        s3_client.delete_object(Bucket=PICTURES_BUCKET, Key=MANIFEST_KEY)
+    except Exception as e:
+        print(f"Error invalidating manifest: {e}")
+
+def index_picture_name(manifest, entry):
+    """Point the name index at an entry (the lowest key wins for duplicate names)"""
+    # Name lookups are for clients that only know a name; the gallery itself
+    # addresses pictures by id, since several pictures can share one name
+    names = manifest.setdefault('names', {})
+    current = names.get(entry['name'])
+    if current is None or current not in manifest['pictures'] or entry['key'] < current:
+        names[entry['name']] = entry['key']
+
+def unindex_picture_name(manifest, entry):
+    """Remove an entry from the name index, falling back to another picture with that name"""
+    names = manifest.setdefault('names', {})
+    if names.get(entry['name']) != entry['key']:
+        return
+    del names[entry['name']]
+    for other in manifest['pictures'].values():
+        if other['name'] == entry['name'] and other['key'] != entry['key']:
+            index_picture_name(manifest, other)
+
+def find_picture_key(manifest, picture_name, fuzzy=False):
+    """Resolve a picture name to its S3 key without touching S3"""
+    if 'names' not in manifest:
+        # Manifests written before the name index existed
+        for entry in manifest['pictures'].values():
+            index_picture_name(manifest, entry)
+    
+    key = manifest['names'].get(picture_name)
+    if key or not fuzzy:
+        return key
+    
+    # Loose matching on the original name, as the old bucket scan did
+    lowered = picture_name.lower()
+    for entry in sorted(manifest['pictures'].values(), key=lambda e: e['key']):
+        original_name = entry['name'].lower()
+        if lowered in original_name or original_name in lowered:
+            return entry['key']
+    return None
+
+def find_picture_key_by_id(manifest, picture_id):
+    """Resolve a picture id, its key below the pictures prefix, to its S3 key without touching S3"""
+    key = f"{PICTURES_PREFIX}{picture_id}"
+    return key if key in manifest['pictures'] else None
+
+def head_picture(key, manifest):
+    """Fetch current metadata for a manifest entry, dropping it if the object is gone"""
+    try:
+        return s3_client.head_object(Bucket=PICTURES_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+            raise
+        print(f"Manifest entry {key} no longer exists in S3")
+        forget_object_metadata(key)
+        remove_manifest_entries([key], manifest=manifest)
+        return None
+
+def upsert_manifest_entry(entry, manifest=None, replace=True):
+    """Add or replace a single picture in the manifest, returning the entry stored for its key"""
+    stored = {}
+    
+    def change(current):
+        previous = current['pictures'].get(entry['key'])
+        if previous and not replace:
+            stored['entry'] = previous
+            return False
+        if previous:
+            unindex_picture_name(current, previous)
+        current['pictures'][entry['key']] = entry
+        index_picture_name(current, entry)
+        stored['entry'] = entry
+    
+    try:
+        modify_manifest(change)
+        if manifest is not None:
+            change(manifest)
+    except Exception as e:
+        # The stored manifest is kept; the scheduled rebuild adds the picture
+        print(f"Error updating manifest for {entry['key']}: {e}")
+    return stored.get('entry', entry)
+
+def update_manifest_entry(key, manifest=None, **changes):
+    """Update fields of a picture that is already in the manifest"""
+    def change(current):
+        entry = current['pictures'].get(key)
+        if entry is None:
+            # A rebuilt manifest already reflects the change
+            return False
+        unindex_picture_name(current, entry)
+        entry.update(changes)
+        index_picture_name(current, entry)
+    
+    try:
+        modify_manifest(change)
+        if manifest is not None:
+            change(manifest)
+    except Exception as e:
+        # The stored manifest is kept; the scheduled rebuild applies the change
+        print(f"Error updating manifest for {key}: {e}")
+
+def add_to_manifest_counters(key, manifest=None, votes=0, stars=0, comments=0):
+    """Add votes and comments to a picture's counters in the manifest, returning its updated entry"""
+    updated = {}
+    
+    def change(current):
+        entry = current['pictures'].get(key)
+        if entry is None:
+            # A rebuilt manifest already counted every stored vote and comment
+            updated['entry'] = None
+            return False
+        entry.update(rating_summary(entry.get('rating_count', 0) + votes, entry.get('rating_sum', 0) + stars))
+        entry['comment_count'] = entry.get('comment_count', 0) + comments
+        updated['entry'] = entry
+    
+    try:
+        modify_manifest(change)
+        if manifest is not None:
+            change(manifest)
+    except Exception as e:
+        # The stored manifest is kept; the scheduled rebuild applies the change
+        print(f"Error updating manifest for {key}: {e}")
+    return updated.get('entry')
+
+def remove_manifest_entries(keys, manifest=None):
+    """Remove deleted pictures from the manifest"""
+    def change(current):
+        removed = [current['pictures'].pop(key, None) for key in keys]
+        for entry in removed:
+            if entry:
+                unindex_picture_name(current, entry)
+        return any(removed)
+    
+    try:
+        modify_manifest(change)
+        if manifest is not None:
+            change(manifest)
+    except Exception as e:
+        # The stored manifest is kept; stale entries are dropped when they are
+        # next resolved, or by the scheduled rebuild
+        print(f"Error removing {len(keys)} pictures from manifest: {e}")
+
+# Gallery statistics
+#
+# /api/stats reads a single stats document instead of listing the bucket.
+# Uploads and deletes apply their delta to it the way the manifest is
+# updated: re-read, change and write back under If-Match on the ETag that was
+# read, retrying when another writer got in first. A missing document is
+# rebuilt from the manifest, which already holds the change. If an update
+# still fails the document is dropped and rebuilt on the next read, and a
+# scheduled job rebuilds the manifest from the bucket and recomputes the
+# stats from scratch.
+
+def read_document_version(key, is_valid):
+    """Read a JSON document and its ETag; the document is None if it is missing or fails is_valid"""
+    try:
+        response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=key)
+    except Exception as e:
+        print(f"Could not read {key}: {e}")
+        return None, None
+    try:
+        document = json.loads(response['Body'].read())
+        if is_valid(document):
+            return document, response['ETag']
+        print(f"{key} has an unexpected format")
+    except Exception as e:
+        print(f"Could not parse {key}: {e}")
+    return None, response['ETag']
+
+def modify_document(key, is_valid, rebuild, change, save):
+    """Apply change(document) to a document derived from the manifest and write it back unless another writer got in first, retrying"""
+    for attempt in range(MANIFEST_WRITE_ATTEMPTS):
+        document, etag = read_document_version(key, is_valid)
+        if document is None:
+            # The manifest already holds the change being applied
+            document = rebuild(load_manifest())
+        else:
+            change(document)
+        try:
+            save(document, **manifest_write_conditions(etag))
+            return document
+        except ClientError as e:
+            if not is_write_conflict(e):
+                raise
+        print(f"{key} changed during update (attempt {attempt + 1}), retrying")
+        time.sleep(random.uniform(0, MANIFEST_RETRY_DELAY * 2 ** attempt))
+    raise RuntimeError(f'{key} kept changing; gave up after {MANIFEST_WRITE_ATTEMPTS} attempts')
+
+def empty_stats():
+    """Build a stats document for an empty gallery"""
+    return {
+        'version': 1,
+        'total_pictures': 0,
+        'total_storage': 0,
+        'content_types': {},
+        'uploads_per_day': {}
+    }
+
+def apply_stats_delta(stats, entries, sign):
+    """Add (sign=1) or remove (sign=-1) manifest entries from a stats document"""
+    for entry in entries:
+        size = entry.get('size', 0) or 0
+        stats['total_pictures'] += sign
+        stats['total_storage'] += sign * size
+        
+        content_type = entry.get('content_type', 'image/jpeg')
+        breakdown = stats['content_types'].setdefault(content_type, {'count': 0, 'bytes': 0})
+        breakdown['count'] += sign
+        breakdown['bytes'] += sign * size
+        if breakdown['count'] <= 0:
+            del stats['content_types'][content_type]
+        
+        day = (entry.get('date') or '')[:10] or 'unknown'
+        uploads = stats['uploads_per_day'].get(day, 0) + sign
+        if uploads > 0:
+            stats['uploads_per_day'][day] = uploads
+        else:
+            stats['uploads_per_day'].pop(day, None)
+    return stats
+
+def build_stats(manifest):
+    """Compute a stats document from every entry in the manifest"""
+    return apply_stats_delta(empty_stats(), manifest['pictures'].values(), 1)
+
+def is_stats_document(stats):
+    """Whether a stored document looks like gallery stats"""
+    return isinstance(stats, dict) and 'total_pictures' in stats
+
+def load_stats():
+    """Load the stats document, recomputing it from the manifest if it is missing"""
+    stats, etag = read_document_version(STATS_KEY, is_stats_document)
+    if stats is not None:
+        return stats
+    
+    print("Rebuilding stats")
+    stats = build_stats(load_manifest())
+    try:
+        save_stats(stats, **manifest_write_conditions(etag))
+    except Exception as e:
+        # Another writer stored the stats during the rebuild; theirs are kept
+        print(f"Error saving rebuilt stats: {e}")
+    return stats
+
+def save_stats(stats, **conditions):
+    """Write the stats document back to S3, under IfMatch/IfNoneMatch conditions if given"""
+    stats['updated'] = datetime.now(timezone.utc).isoformat()
+    s3_client.put_object(
+        Bucket=PICTURES_BUCKET,
+        Key=STATS_KEY,
+        Body=json.dumps(stats, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json',
+        CacheControl='no-cache',
+        **conditions
+    )
+
+def update_stats(added=(), removed=()):
+    """Apply uploaded and deleted manifest entries to the stats document"""
+    def change(stats):
+        apply_stats_delta(stats, added, 1)
+        apply_stats_delta(stats, removed, -1)
+    
+    try:
+        modify_document(STATS_KEY, is_stats_document, build_stats, change, save_stats)
+    except Exception as e:
+        print(f"Error updating stats: {e}")
+        try:
+            s3_client.delete_object(Bucket=PICTURES_BUCKET, Key=STATS_KEY)
+        except Exception as delete_error:
+            print(f"Error invalidating stats: {delete_error}")
+
+def reconcile_stats():
+    """Rebuild the manifest, the stats document and the perceptual hash index from the bucket"""
+    try:
+        for attempt in range(MANIFEST_WRITE_ATTEMPTS):
+            previous, etag = read_manifest_version()
+            manifest = rebuild_manifest(previous=previous or {'pictures': {}})
+            backfill_pictures(manifest)
+            try:
+                # Votes, comments and uploads recorded during the rebuild are kept
+                save_manifest(manifest, **manifest_write_conditions(etag))
+                break
+            except ClientError as e:
+                if not is_write_conflict(e):
+                    raise
+            print(f"Manifest changed during rebuild (attempt {attempt + 1}), rebuilding again")
+        else:
+            raise RuntimeError(f'Manifest kept changing; gave up after {MANIFEST_WRITE_ATTEMPTS} rebuilds')
+        save_phash_index(build_phash_index(manifest))
+        stats = build_stats(manifest)
+        stats['reconciled'] = datetime.now(timezone.utc).isoformat()
+        save_stats(stats)
+        print(f"Reconciled stats: {stats['total_pictures']} pictures, {stats['total_storage']} bytes")
+        return {'statusCode': 200, 'body': json.dumps({'total_pictures': stats['total_pictures']})}
+    except Exception as e:
+        print(f"Error reconciling stats: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return {'statusCode': 500, 'body': json.dumps({'error': f'Failed to reconcile stats: {str(e)}'})}
+
+# Rating votes
+#
+# Every vote is counted, not just the last one. Each vote is written as its
+# own immutable object, ratings/<picture>/vote-<stars>-<uuid>.json, so
+# concurrent voters never read or overwrite a shared key and no vote can be
+# lost. The star count is part of the key, so votes are added up from a
+# listing alone. Each vote is then added to the picture's count and sum in
+# the manifest through the If-Match retry loop, so listings show it right
+# away; the scheduled rebuild recounts every vote from the objects. Counter
+# shards written by the earlier sharded scheme, and a rating stored in
+# object metadata by the single-value scheme, still count.
+
+def rating_summary(count, total):
+    """Manifest fields for an aggregated vote count and sum"""
+    return {
+        'rating': round(total / count, 2) if count else 0,
+        'rating_count': count,
+        'rating_sum': total
+    }
+
+def rating_prefix(picture_key):
+    """Prefix holding a picture's vote objects"""
+    return f"{RATINGS_PREFIX}{picture_key[len(PICTURES_PREFIX):]}/"
+
+def record_vote(picture_key, rating):
+    """Store a vote as a new object of its own"""
+    s3_client.put_object(
+        Bucket=PICTURES_BUCKET,
+        Key=f"{rating_prefix(picture_key)}vote-{rating}-{uuid.uuid4().hex}.json",
+        Body=json.dumps({'rating': rating, 'time': datetime.now(timezone.utc).isoformat()}).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+def tally_ratings(prefix=RATINGS_PREFIX):
+    """Add up the votes under a prefix into {picture key: (vote count, rating sum)}"""
+    totals = {}
+    shard_keys = []
+    
+    def add(picture_key, stars, votes):
+        count, total = totals.get(picture_key, (0, 0))
+        totals[picture_key] = (count + votes, total + stars * votes)
+    
+    for obj in iter_bucket_objects(prefix):
+        picture_id, _, name = obj['Key'][len(RATINGS_PREFIX):].rpartition('/')
+        match = re.fullmatch(r'vote-([1-5])-[0-9a-f]+\.json', name)
+        if match:
+            add(PICTURES_PREFIX + picture_id, int(match.group(1)), 1)
+        elif name.startswith('shard-'):
+            shard_keys.append(obj['Key'])
+    
+    def read_shard(shard_key):
+        try:
+            response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=shard_key)
+            return json.loads(response['Body'].read())['votes']
+        except Exception as e:
+            print(f"Error reading rating shard {shard_key}: {e}")
+            return {}
+    
+    for shard_key, votes in zip(shard_keys, map_concurrently(read_shard, shard_keys)):
+        picture_key = PICTURES_PREFIX + shard_key[len(RATINGS_PREFIX):].rpartition('/')[0]
+        for stars, votes_for_stars in votes.items():
+            add(picture_key, int(stars), votes_for_stars)
+    return totals
+
+# Comment threads
+#
+# S3 caps user metadata at 2 KB, so comments live in their own objects under
+# comments/<picture>/. Adding a comment writes one small log object named by
+# the time the server received it and a random suffix, and the picture's
+# comment count in the manifest goes up by one through the If-Match retry
+# loop. Every COMMENT_COMPACT_THRESHOLD comments the log is folded into a
+# thread.json snapshot, which lists the exact log keys it contains. Clocks
+# differ between containers, so an entry can land with a key older than one
+# already folded; it is still pending because its key is not listed. Log
+# objects are only deleted one compaction later, and only those the previous
+# snapshot lists, so readers holding it still find every comment written
+# after it. Threads written before this layout are seeded from the old
+# 'comments' metadata until their first compaction.
+
+def comment_thread_prefix(picture_key):
+    """Prefix under which a picture's comment objects are stored"""
+    return f"{COMMENTS_PREFIX}{picture_key[len(PICTURES_PREFIX):]}/"
+
+def comment_snapshot_key(picture_key):
+    """Key of a picture's compacted comment snapshot"""
+    return comment_thread_prefix(picture_key) + 'thread.json'
+
+def legacy_comments(metadata, key):
+    """Comments stored in object metadata before the comment log existed"""
+    if not metadata.get('comments'):
+        return []
+    try:
+        return json.loads(metadata['comments'])
+    except json.JSONDecodeError as json_error:
+        print(f"Error parsing comments JSON for {key}: {json_error}")
+        return []
+
+def append_comment(picture_key, comment):
+    """Append a comment to a picture's log with a single PUT"""
+    log_key = f"{comment_thread_prefix(picture_key)}log/{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+    s3_client.put_object(
+        Bucket=PICTURES_BUCKET,
+        Key=log_key,
+        Body=json.dumps(comment).encode('utf-8'),
+        ContentType='application/json'
+    )
+    return log_key
+
+def load_comment_snapshot(picture_key):
+    """Read a picture's compacted comments, seeding from legacy metadata"""
+    try:
+        response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=comment_snapshot_key(picture_key))
+        return json.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+            raise
+    
+    head_response = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=picture_key)
+    comments = legacy_comments(head_response.get('Metadata', {}), picture_key)
+    return {'count': len(comments), 'folded': [], 'comments': comments}
+
+def list_comment_log(picture_key):
+    """List a picture's comment log keys in append order"""
+    prefix = comment_thread_prefix(picture_key) + 'log/'
+    return sorted(obj['Key'] for obj in iter_bucket_objects(prefix) if obj['Key'].startswith(prefix))
+
+def pending_comment_log(snapshot, log_keys):
+    """Log keys not folded into a snapshot, in append order"""
+    if 'folded' not in snapshot:
+        # Snapshots written before folded keys were listed hold every key up to a watermark
+        return [key for key in log_keys if key > snapshot['through']]
+    folded = set(snapshot['folded'])
+    return [key for key in log_keys if key not in folded]
+
+def read_comment_log(log_keys):
+    """Fetch comment log entries concurrently, keeping their order"""
+    def read_entry(log_key):
+        response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=log_key)
+        return json.loads(response['Body'].read())
+    return map_concurrently(read_entry, log_keys)
+
+def load_comment_thread(picture_key):
+    """Read a picture's full comment thread, oldest first"""
+    snapshot = load_comment_snapshot(picture_key)
+    pending = pending_comment_log(snapshot, list_comment_log(picture_key))
+    return snapshot['comments'] + read_comment_log(pending)
+
+def compact_comment_thread(picture_key):
+    """Fold a picture's comment log into its snapshot"""
+    snapshot = load_comment_snapshot(picture_key)
+    log_keys = list_comment_log(picture_key)
+    pending = pending_comment_log(snapshot, log_keys)
+    if not pending:
+        return
+    
+    # Entries folded into the previous snapshot are listed in this one too
+    # until they are deleted, after it is written
+    pending_keys = set(pending)
+    stale = [key for key in log_keys if key not in pending_keys]
+    comments = snapshot['comments'] + read_comment_log(pending)
+    s3_client.put_object(
+        Bucket=PICTURES_BUCKET,
+        Key=comment_snapshot_key(picture_key),
+        Body=json.dumps({
+            'count': len(comments),
+            'folded': stale + pending,
+            'comments': comments
+        }, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+    
+    # Only entries the previous snapshot read are deleted; no one reads them any more
+    delete_keys(stale)
+    print(f"Compacted {len(pending)} comments for {picture_key}, dropped {len(stale)} log entries")
+
+def count_comment_threads():
+    """Count comments per picture from a listing of the comments prefix"""
+    # Returns {picture_key: (compacted count or None, pending log entries)}
+    snapshots = []
+    logs = {}
+    for obj in iter_bucket_objects(COMMENTS_PREFIX):
+        if not obj['Key'].startswith(COMMENTS_PREFIX):
+            continue
+        rest = obj['Key'][len(COMMENTS_PREFIX):]
+        if rest.endswith('/thread.json'):
+            snapshots.append(PICTURES_PREFIX + rest[:-len('/thread.json')])
+        elif '/log/' in rest:
+            picture, _, _ = rest.partition('/log/')
+            logs.setdefault(PICTURES_PREFIX + picture, []).append(obj['Key'])
+    
+    def read_snapshot(picture_key):
+        try:
+            response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=comment_snapshot_key(picture_key))
+            return json.loads(response['Body'].read())
+        except Exception as e:
+            print(f"Error reading comment snapshot for {picture_key}: {e}")
+            return None
+    
+    counts = {key: (None, len(log_keys)) for key, log_keys in logs.items()}
+    for picture_key, snapshot in zip(snapshots, map_concurrently(read_snapshot, snapshots)):
+        log_keys = sorted(logs.get(picture_key, []))
+        if snapshot is None:
+            counts[picture_key] = (None, len(log_keys))
+        else:
+            counts[picture_key] = (snapshot['count'], len(pending_comment_log(snapshot, log_keys)))
+    return counts
+
+# Image derivatives
+#
+# The gallery grid shows small cards, so every picture gets downscaled JPEG
+# copies under derivatives/<picture>/<name>.jpg when it is registered. EXIF
+# orientation is applied first, since browsers do not rotate every image the
+# same way. The manifest records which derivatives exist, so listings can
+# link them without a HEAD request; pictures without them fall back to the
+# original. Pillow is imported lazily: without it uploads still succeed and
+# the scheduled job backfills missing derivatives later. The properties read
+# from the image are also kept in a properties.json sidecar beside them, so a
+# manifest rebuilt from scratch recovers them without decoding every picture.
+
+def derivative_key(picture_key, name):
+    """S3 key of a named derivative of a picture"""
+    return f"{DERIVATIVES_PREFIX}{picture_key[len(PICTURES_PREFIX):]}/{name}.jpg"
+
+def render_derivatives(image_bytes):
+    """Downscale an image to every derivative size, returning {name: JPEG bytes}"""
+    from PIL import Image
+    
+    largest = DERIVATIVE_SIZES[0][1]
+    image = decode_downscaled(image_bytes, (largest, largest))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    rendered = {}
+    for name, edge in DERIVATIVE_SIZES:
+        image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=85, optimize=True, progressive=True)
+        rendered[name] = output.getvalue()
+    return rendered
+
+def generate_derivatives(picture_key, image_bytes=None):
+    """Render and store a picture's derivatives, returning the names stored"""
+    try:
+        if image_bytes is None:
+            response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=picture_key)
+            image_bytes = response['Body'].read()
+        rendered = render_derivatives(image_bytes)
+    except Exception as e:
+        print(f"Error rendering derivatives for {picture_key}: {e}")
+        return []
+    
+    def store(item):
+        name, data = item
+        try:
+            s3_client.put_object(
+                Bucket=PICTURES_BUCKET,
+                Key=derivative_key(picture_key, name),
+                Body=data,
+                ContentType='image/jpeg'
+            )
+            return name
+        except Exception as e:
+            print(f"Error storing {name} derivative for {picture_key}: {e}")
+            return None
+    
+    return [name for name in map_concurrently(store, rendered.items()) if name]
+
+def image_properties_key(picture_key):
+    """S3 key of the sidecar that keeps a picture's image properties"""
+    return f"{DERIVATIVES_PREFIX}{picture_key[len(PICTURES_PREFIX):]}/{IMAGE_PROPERTIES_FILE}"
+
+def store_image_properties(picture_key, properties):
+    """Keep a picture's image properties next to its derivatives, so a rebuild never has to decode it again"""
+    try:
+        s3_client.put_object(
+            Bucket=PICTURES_BUCKET,
+            Key=image_properties_key(picture_key),
+            Body=json.dumps(properties, separators=(',', ':')).encode('utf-8'),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        # The scheduled backfill stores them again
+        print(f"Error storing image properties for {picture_key}: {e}")
+
+def load_image_properties(picture_key):
+    """Read a picture's stored image properties, or None"""
+    try:
+        response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=image_properties_key(picture_key))
+        return json.loads(response['Body'].read())
+    except Exception as e:
+        print(f"Error reading image properties for {picture_key}: {e}")
+        return None
+
+def list_derivatives():
+    """Map picture keys to their stored derivative names, and find the pictures with saved properties, from one listing"""
+    derivatives = {}
+    saved_properties = set()
+    for obj in iter_bucket_objects(DERIVATIVES_PREFIX):
+        picture_id, _, file_name = obj['Key'][len(DERIVATIVES_PREFIX):].rpartition('/')
+        if not picture_id:
+            continue
+        if file_name == IMAGE_PROPERTIES_FILE:
+            saved_properties.add(PICTURES_PREFIX + picture_id)
+        elif file_name.endswith('.jpg'):
+            derivatives.setdefault(PICTURES_PREFIX + picture_id, []).append(file_name[:-len('.jpg')])
+    return derivatives, saved_properties
+
+def backfill_pictures(manifest, limit=None):
+    """Generate missing derivatives and image properties for up to limit pictures in the manifest"""
+    names = set(name for name, _ in DERIVATIVE_SIZES)
+    
+    def needs_derivatives(entry):
+        return not names <= set(entry.get('derivatives', ()))
+    
+    def needs_properties(entry):
+        return any(field not in entry for field in IMAGE_PROPERTY_FIELDS)
+    
+    missing = [
+        entry for entry in manifest['pictures'].values()
+        if needs_derivatives(entry) or needs_properties(entry)
+    ]
+    # A random sample, so pictures that cannot be rendered never block the rest
+    limit = DERIVATIVE_BACKFILL_LIMIT if limit is None else limit
+    missing = random.sample(missing, min(limit, len(missing)))
+    
+    def backfill(entry):
+        try:
+            response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=entry['key'])
+            image_bytes = response['Body'].read()
+        except Exception as e:
+            print(f"Error reading {entry['key']} for backfill: {e}")
+            return
+        if needs_derivatives(entry):
+            stored = generate_derivatives(entry['key'], image_bytes)
+            entry['derivatives'] = sorted(set(entry.get('derivatives', ())) | set(stored))
+        if needs_properties(entry):
+            properties = analyze_image(image_bytes)
+            entry.update(properties)
+            store_image_properties(entry['key'], properties)
+    
+    map_concurrently(backfill, missing)
+    print(f"Backfilled derivatives and properties for {len(missing)} pictures")
+    return len(missing)
+
+# Near-duplicate detection
+#
+# Re-encoded or resized copies of a shot have different bytes, so content
+# hashes miss them. Every picture also gets a 64-bit difference hash (dHash):
+# the oriented image is shrunk to 9x8 greyscale and each bit records whether
+# a pixel is brighter than its right-hand neighbour. Copies of one shot land
+# within a few bits of each other in Hamming distance.
+#
+# The hashes are kept in a BK-tree under index/phash-tree.json. Each child
+# hangs off its parent at their Hamming distance, so by the triangle
+# inequality a search within distance k only descends into children whose
+# edge lies within k of the distance to the node, and visits a small part of
+# the tree. Like the stats document, the tree is updated by every upload and
+# delete under If-Match, retrying on conflicts, and rebuilt from the manifest
+# by the scheduled job.
+
+def perceptual_hash(image_bytes):
+    """64-bit difference hash of an image as 16 hex digits, or None if it cannot be decoded"""
+    from PIL import Image
+    
+    try:
+        # A reduced decode is plenty for 72 pixels and keeps large JPEGs cheap
+        image = decode_downscaled(image_bytes, (64, 64))
+        pixels = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    except Exception as e:
+        print(f"Could not compute perceptual hash: {e}")
+        return None
+    
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+def hamming_distance(first, second):
+    """Number of differing bits between two hex hashes"""
+    # int.bit_count needs Python 3.10, and the Serverless deployment runs 3.9
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+def analyze_image(image_bytes):
+    """Every manifest property of an image: its header fields and its perceptual hash"""
+    properties = read_image_properties(image_bytes)
+    properties['phash'] = perceptual_hash(image_bytes)
+    return properties
+
+def phash_tree_insert(tree, phash, key):
+    """Add a picture to a BK-tree, returning the (possibly new) root"""
+    if tree is None:
+        return {'hash': phash, 'keys': [key], 'children': {}}
+    
+    node = tree
+    while True:
+        distance = hamming_distance(phash, node['hash'])
+        if distance == 0:
+            if key not in node['keys']:
+                node['keys'].append(key)
+            return tree
+        child = node['children'].get(str(distance))
+        if child is None:
+            node['children'][str(distance)] = {'hash': phash, 'keys': [key], 'children': {}}
+            return tree
+        node = child
+
+def phash_tree_remove(tree, phash, key):
+    """Remove a picture from a BK-tree; its node stays behind to route searches"""
+    node = tree
+    while node is not None:
+        distance = hamming_distance(phash, node['hash'])
+        if distance == 0:
+            if key in node['keys']:
+                node['keys'].remove(key)
+            return
+        node = node['children'].get(str(distance))
+
+def phash_tree_search(tree, phash, max_distance):
+    """Yield (key, distance) for every picture within max_distance of phash"""
+    pending = [tree] if tree is not None else []
+    while pending:
+        node = pending.pop()
+        distance = hamming_distance(phash, node['hash'])
+        if distance <= max_distance:
+            for key in node['keys']:
+                yield key, distance
+        for edge, child in node['children'].items():
+            if abs(int(edge) - distance) <= max_distance:
+                pending.append(child)
+
+def build_phash_index(manifest):
+    """Build the BK-tree index from every hashed picture in the manifest"""
+    tree = None
+    # Sorted so a rebuild produces the same tree every time
+    for entry in sorted(manifest['pictures'].values(), key=lambda entry: entry['key']):
+        if entry.get('phash'):
+            tree = phash_tree_insert(tree, entry['phash'], entry['key'])
+    return {'version': 1, 'tree': tree}
+
+def is_phash_index(index):
+    """Whether a stored document looks like the BK-tree index"""
+    return isinstance(index, dict) and 'tree' in index
+
+def load_phash_index():
+    """Load the BK-tree index, rebuilding it from the manifest if it is missing"""
+    index, etag = read_document_version(PHASH_INDEX_KEY, is_phash_index)
+    if index is not None:
+        return index
+    
+    print("Rebuilding perceptual hash index")
+    index = build_phash_index(load_manifest())
+    try:
+        save_phash_index(index, **manifest_write_conditions(etag))
+    except Exception as e:
+        # Another writer stored the index during the rebuild; theirs is kept
+        print(f"Error saving rebuilt perceptual hash index: {e}")
+    return index
+
+def save_phash_index(index, **conditions):
+    """Write the BK-tree index back to S3, under IfMatch/IfNoneMatch conditions if given"""
+    index['updated'] = datetime.now(timezone.utc).isoformat()
+    s3_client.put_object(
+        Bucket=PICTURES_BUCKET,
+        Key=PHASH_INDEX_KEY,
+        Body=json.dumps(index, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json',
+        CacheControl='no-cache',
+        **conditions
+    )
+
+def update_phash_index(added=(), removed=()):
+    """Apply uploaded and deleted manifest entries to the BK-tree index"""
+    added = [entry for entry in added if entry.get('phash')]
+    removed = [entry for entry in removed if entry.get('phash')]
+    if not added and not removed:
+        return
+    
+    def change(index):
+        for entry in added:
+            index['tree'] = phash_tree_insert(index['tree'], entry['phash'], entry['key'])
+        for entry in removed:
+            phash_tree_remove(index['tree'], entry['phash'], entry['key'])
+    
+    try:
+        modify_document(PHASH_INDEX_KEY, is_phash_index, build_phash_index, change, save_phash_index)
+    except Exception as e:
+        print(f"Error updating perceptual hash index: {e}")
+        try:
+            s3_client.delete_object(Bucket=PICTURES_BUCKET, Key=PHASH_INDEX_KEY)
+        except Exception as delete_error:
+            print(f"Error invalidating perceptual hash index: {delete_error}")
+
+def find_near_duplicates(index, manifest, entry, max_distance):
+    """Other pictures within max_distance of an entry, as (entry, distance) pairs, closest first"""
+    matches = [
+        (manifest['pictures'][key], distance)
+        for key, distance in phash_tree_search(index['tree'], entry['phash'], max_distance)
+        # The index may briefly lag behind deletes
+        if key != entry['key'] and key in manifest['pictures']
+    ]
+    return sorted(matches, key=lambda match: (match[1], match[0]['key']))
+
+def group_near_duplicates(index, manifest, max_distance):
+    """Partition hashed pictures into groups of near-duplicates, dropping singletons"""
+    # Union-find over picture keys, so chains of close copies form one group
+    parent = {}
+    
+    def find(key):
+        parent.setdefault(key, key)
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+    
+    for entry in manifest['pictures'].values():
+        if not entry.get('phash'):
+            continue
+        for match, _ in find_near_duplicates(index, manifest, entry, max_distance):
+            first, second = find(entry['key']), find(match['key'])
+            if first != second:
+                parent[max(first, second)] = min(first, second)
+    
+    groups = {}
+    for key in list(parent):
+        groups.setdefault(find(key), []).append(manifest['pictures'][key])
+    return [group for group in groups.values() if len(group) > 1]
+
+# On-demand resizing
+#
+# /api/pictures/{id}/image?w=&h=&fmt= scales a picture to fit the requested
+# box, so clients can ask for the size they actually render. Each transform
+# is computed once: results are kept in a size-bounded LRU under /tmp for the
+# life of a warm container, and under resized/<picture>/ in S3 for every
+# other container. Requested sizes are rounded up to RESIZE_STEP pixels so a
+# few pixels of difference between screens do not create new cache entries.
+# Every request HEADs the original first: a deleted picture is not served
+# from a warm container's cache, and the original's ETag is part of the cache
+# key, so a key that is stored again after a delete (content-addressed keys
+# are) never picks up a transform of an older object.
+
+def resized_cache_key(picture_id, source_etag, width, height, fmt):
+    """S3 key of a cached transform of one version of a picture"""
+    version = source_etag.strip('"')
+    return f"{RESIZED_PREFIX}{picture_id}/{version}/{width or 0}x{height or 0}.{fmt}"
+
+def resize_cache_get(cache_key):
+    """Read a transform from the /tmp cache, or None"""
+    file_name = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()
+    with _resize_cache_lock:
+        if file_name not in _resize_cache:
+            return None
+        _resize_cache.move_to_end(file_name)
+    try:
+        with open(os.path.join(RESIZE_TMP_DIR, file_name), 'rb') as cached_file:
+            return cached_file.read()
+    except OSError:
+        with _resize_cache_lock:
+            _resize_cache.pop(file_name, None)
+        return None
+
+def resize_cache_put(cache_key, data):
+    """Write a transform to the /tmp cache, evicting the least recently used"""
+    file_name = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()
+    try:
+        os.makedirs(RESIZE_TMP_DIR, exist_ok=True)
+        path = os.path.join(RESIZE_TMP_DIR, file_name)
+        with open(path + '.tmp', 'wb') as cached_file:
+            cached_file.write(data)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"Error caching {cache_key} in {RESIZE_TMP_DIR}: {e}")
+        return
+    
+    with _resize_cache_lock:
+        _resize_cache[file_name] = len(data)
+        _resize_cache.move_to_end(file_name)
+        evicted = []
+        total = sum(_resize_cache.values())
+        while total > RESIZE_TMP_CACHE_BYTES and len(_resize_cache) > 1:
+            name, size = _resize_cache.popitem(last=False)
+            total -= size
+            evicted.append(name)
+    for name in evicted:
+        try:
+            os.remove(os.path.join(RESIZE_TMP_DIR, name))
+        except OSError:
+            pass
+
+def render_resized(image_bytes, width, height, fmt):
+    """Scale an image to fit within width x height (never enlarging it)"""
+    image = decode_downscaled(image_bytes, (width or RESIZE_MAX_DIMENSION, height or RESIZE_MAX_DIMENSION))
+    
+    pillow_format, _ = RESIZE_FORMATS[fmt]
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif pillow_format != 'JPEG' and image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    
+    output = io.BytesIO()
+    if pillow_format == 'PNG':
+        image.save(output, format='PNG', optimize=True)
+    else:
+        image.save(output, format=pillow_format, quality=85)
+    return output.getvalue()
+
+# Content-addressed storage
+#
+# New pictures are stored under pictures/<sha256><ext>, so identical bytes
+# always map to the same key. Before sending a file the browser asks whether
+# its hash is already in the gallery, and uploads of known content are
+# answered from the manifest without storing anything. The server never
+# trusts a client's hash: single PUTs are signed with the checksum so S3
+# rejects other bodies, and multipart uploads are assembled under
+# uploads/<random>/ and only copied to the content key once completion has
+# re-hashed them, so a bad upload can never replace or delete the picture it
+# claims to be. The staged object is hashed as it streams in, and copied to
+# the content key by S3 itself, in parts when it is too large for one copy.
+# Pictures uploaded before content addressing keep their timestamped keys.
+
+def picture_key_extension(picture_name, content_type=None):
+    """Key extension for an uploaded picture, always one of IMAGE_EXTENSIONS so the manifest lists it"""
+    extension = CONTENT_TYPE_EXTENSIONS.get((content_type or '').split(';')[0].strip().lower())
+    if not extension:
+        extension = os.path.splitext(picture_name)[1].lower()
+        extension = extension if extension in IMAGE_EXTENSIONS else '.jpg'
+    return extension
+
+def content_picture_key(sha256, picture_name, content_type):
+    """S3 key of a picture stored under its content hash"""
+    return f"{PICTURES_PREFIX}{sha256}{picture_key_extension(picture_name, content_type)}"
+
+def staging_upload_key(content_key):
+    """Key a multipart upload of content_key is assembled under until its hash is checked"""
+    return f"{UPLOADS_PREFIX}{uuid.uuid4().hex}/{content_key[len(PICTURES_PREFIX):]}"
+
+def content_key_of_staging_key(key):
+    """The content key a staged upload is bound for, or None if key is not a staging key"""
+    match = re.fullmatch(re.escape(UPLOADS_PREFIX) + r'[0-9a-f]{32}/([0-9a-f]{64}\.\w+)', key)
+    return PICTURES_PREFIX + match.group(1) if match else None
+
+def content_hash_of_key(key):
+    """The content hash a picture key was derived from, or None for older keys"""
+    match = re.fullmatch(re.escape(PICTURES_PREFIX) + r'([0-9a-f]{64})\.\w+', key)
+    return match.group(1) if match else None
+
+def hash_stored_object(key):
+    """SHA-256 of a stored object, read in chunks so it is never held in memory"""
+    digest = hashlib.sha256()
+    body = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=key)['Body']
+    for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def promote_staged_upload(staging_key, content_key, head_response):
+    """Copy a verified staged upload to its content key within S3"""
+    source = {'Bucket': PICTURES_BUCKET, 'Key': staging_key}
+    size = head_response.get('ContentLength', 0)
+    if size <= COPY_OBJECT_LIMIT:
+        s3_client.copy_object(Bucket=PICTURES_BUCKET, Key=content_key, CopySource=source)
+        return
+    
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=PICTURES_BUCKET,
+        Key=content_key,
+        ContentType=head_response.get('ContentType', 'binary/octet-stream'),
+        Metadata=head_response.get('Metadata', {})
+    )['UploadId']
+    part_size = max(MULTIPART_COPY_PART_SIZE, -(-size // MULTIPART_MAX_PARTS))
+    
+    def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        response = s3_client.upload_part_copy(
+            Bucket=PICTURES_BUCKET,
+            Key=content_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource=source,
+            CopySourceRange=f"bytes={start}-{min(start + part_size, size) - 1}"
+        )
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+    
+    try:
+        parts = map_concurrently(copy_part, range(1, -(-size // part_size) + 1))
+        s3_client.complete_multipart_upload(
+            Bucket=PICTURES_BUCKET,
+            Key=content_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=PICTURES_BUCKET, Key=content_key, UploadId=upload_id)
+        raise
+
+def normalize_content_hash(value):
+    """A client-supplied SHA-256 as lowercase hex, or None if it is not one"""
+    if isinstance(value, str) and re.fullmatch(r'[0-9a-fA-F]{64}', value):
+        return value.lower()
+    return None
+
+def find_content_key(manifest, sha256):
+    """The key of a picture with the given content hash, if the gallery has one"""
+    for extension in IMAGE_EXTENSIONS:
+        key = f"{PICTURES_PREFIX}{sha256}{extension}"
+        if key in manifest['pictures']:
+            return key
+    return None
+
+# Direct uploads
+#
+# Picture bytes go from the browser straight to S3, so they are neither
+# base64-inflated nor held in Lambda memory, and the 6 MB request limit no
+# longer caps photo size. An upload session is one presigned PUT URL, or for
+# files larger than a part a multipart upload with a presigned URL per part.
+# The completion call registers the picture from what S3 actually stored.
+#
+# Multipart sessions are resumable: S3 already records every part it has
+# received, so the resume call lists the parts, re-signs URLs for the rest
+# and the client carries on from there. Completion takes the part list from
+# S3 too. Sessions left unfinished for UPLOAD_SESSION_TTL are aborted by the
+# scheduled job.
+
+def new_picture_key(picture_name, content_type=None):
+    """Generate a unique S3 key for a newly uploaded picture"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f"{PICTURES_PREFIX}{timestamp}_{uuid.uuid4().hex[:8]}{picture_key_extension(picture_name, content_type)}"
+
+def upload_part_size(size):
+    """Part size for a multipart upload of size bytes"""
+    part_size = max(MULTIPART_PART_SIZE, MULTIPART_MIN_PART_SIZE)
+    # S3 allows at most 10000 parts, so very large files get larger parts
+    return max(part_size, -(-size // MULTIPART_MAX_PARTS))
+
+def presign_upload_parts(key, upload_id, part_numbers):
+    """Get a presigned upload_part URL for each part number"""
+    return [
+        {
+            'partNumber': part_number,
+            'url': s3_client.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': PICTURES_BUCKET,
+                    'Key': key,
+                    'UploadId': upload_id,
+                    'PartNumber': part_number
+                },
+                ExpiresIn=UPLOAD_URL_EXPIRY
+            )
+        }
+        for part_number in part_numbers
+    ]
+
+def list_upload_parts(key, upload_id):
+    """List the parts S3 has received for a multipart upload, in order"""
+    parts = []
+    marker = 0
+    while True:
+        response = s3_client.list_parts(
+            Bucket=PICTURES_BUCKET, Key=key, UploadId=upload_id, PartNumberMarker=marker
+        )
+        parts.extend(response.get('Parts', []))
+        if not response.get('IsTruncated'):
+            return parts
+        marker = response['NextPartNumberMarker']
+
+def abort_stale_uploads(now=None):
+    """Abort multipart uploads older than UPLOAD_SESSION_TTL and drop staged objects left behind"""
+    cutoff = (now or time.time()) - UPLOAD_SESSION_TTL
+    stale = []
+    for prefix in (PICTURES_PREFIX, UPLOADS_PREFIX):
+        params = {'Bucket': PICTURES_BUCKET, 'Prefix': prefix}
+        while True:
+            response = s3_client.list_multipart_uploads(**params)
+            stale.extend(
+                upload for upload in response.get('Uploads', [])
+                if upload['Initiated'].timestamp() < cutoff
+            )
+            if not response.get('IsTruncated'):
+                break
+            params['KeyMarker'] = response['NextKeyMarker']
+            params['UploadIdMarker'] = response['NextUploadIdMarker']
+    
+    # Completed staged uploads whose completion request never finished
+    leftovers = [
+        obj['Key'] for obj in iter_bucket_objects(UPLOADS_PREFIX)
+        if obj['LastModified'].timestamp() < cutoff
+    ]
+    if leftovers:
+        delete_keys(leftovers)
+    
+    def abort(upload):
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=PICTURES_BUCKET, Key=upload['Key'], UploadId=upload['UploadId']
+            )
+            return True
+        except Exception as e:
+            print(f"Error aborting stale upload {upload['UploadId']}: {e}")
+            return False
+    
+    aborted = sum(map_concurrently(abort, stale))
+    print(f"Aborted {aborted} of {len(stale)} stale uploads")
+    return aborted
+
+def register_picture(key, picture_name, size, content_type, image_bytes=None):
+    """Render derivatives and read the properties of an uploaded picture, then add it to the manifest and the stats"""
+    # Only a quick check: rendering takes seconds, so the manifest is read again to add the entry
+    existing = load_manifest()['pictures'].get(key)
+    if existing:
+        # Content-addressed keys repeat: someone else stored these bytes first
+        return existing
+    
+    derivatives, properties = [], None
+    try:
+        if image_bytes is None:
+            response = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=key)
+            image_bytes = response['Body'].read()
+    except Exception as e:
+        # The scheduled backfill picks the picture up later
+        print(f"Error reading {key} to register it: {e}")
+    else:
+        derivatives = generate_derivatives(key, image_bytes)
+        properties = analyze_image(image_bytes)
+        store_image_properties(key, properties)
+    
+    entry = build_manifest_entry(
+        key,
+        picture_name,
+        datetime.now(timezone.utc).isoformat(),
+        size=size,
+        content_type=content_type,
+        derivatives=derivatives,
+        properties=properties
+    )
+    stored = upsert_manifest_entry(entry, replace=False)
+    if stored is not entry:
+        # Registered by a concurrent upload of the same bytes while rendering
+        return stored
+    update_stats(added=[entry])
+    update_phash_index(added=[entry])
+    return entry
+
+def sortable_timestamp(value):
+    """An ISO 8601 timestamp as a fixed-width UTC string, so timestamps compare in time order"""
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return value
+    if moment.tzinfo is None:
+        # Capture times without an offset are in the camera's unknown zone
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def sort_position(entry, order):
+    """A picture's (date, key) position in the given listing order"""
+    if order == 'taken':
+        # Pictures without a capture time sort by their upload date
+        return (sortable_timestamp(entry.get('taken') or entry['date']), entry['key'])
+    return (sortable_timestamp(entry['date']), entry['key'])
+
+def encode_cursor(entry, order='uploaded'):
+    """Encode the position after a picture as an opaque pagination cursor"""
+    position = json.dumps(list(sort_position(entry, order)), separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor into a (date, key) sort position"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    date, key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    if not isinstance(date, str) or not isinstance(key, str):
+        raise ValueError('Malformed cursor')
+    # Cursors issued before positions were normalised hold the raw timestamp
+    return sortable_timestamp(date), key
+
+def get_pictures(event):
+    """Get a page of pictures from the gallery manifest, newest first"""
+    # Pages are keyset-paginated on (date, key): uploads that happen while a
+    # client is paging sort before its cursor and never shift later pages.
+    # sort=taken orders by capture time instead of upload time.
+    try:
+        print(f"Getting pictures from bucket: {PICTURES_BUCKET}")
+        
+        query_params = event.get('queryStringParameters') or {}
+        try:
+            limit = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+            if limit < 1:
+                raise ValueError('limit must be positive')
+            limit = min(limit, MAX_PAGE_SIZE)
+            order = query_params.get('sort', 'uploaded')
+            if order not in ('uploaded', 'taken'):
+                raise ValueError('sort must be uploaded or taken')
+            cursor = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+        except (ValueError, TypeError) as e:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': f'Invalid pagination parameters: {str(e)}'})
+            }
+        
+        manifest = load_manifest()
+        
+        entries = manifest['pictures'].values()
+        if cursor:
+            entries = [entry for entry in entries if sort_position(entry, order) < cursor]
+        else:
+            entries = list(entries)
+        
+        # One extra entry tells us whether another page exists
+        page = heapq.nlargest(limit + 1, entries, key=lambda entry: sort_position(entry, order))
+        next_cursor = encode_cursor(page[limit - 1], order) if len(page) > limit else None
+        page = page[:limit]
+        
+        pictures = []
+        for entry in page:
+            # Presigning is a local computation, not an S3 round trip
+            url = presign_get_url(entry['key'])
+            sized_urls = {
+                name: presign_get_url(derivative_key(entry['key'], name))
+                if name in entry.get('derivatives', ()) else url
+                for name, _ in DERIVATIVE_SIZES
+            }
+            pictures.append({
+                'id': entry['key'][len(PICTURES_PREFIX):],
+                'name': entry['name'],
+                'date': entry['date'],
+                'url': url,
+                'thumb_url': sized_urls['thumb'],
+                'medium_url': sized_urls['medium'],
+                'size': entry.get('size', 0),
+                'width': entry.get('width'),
+                'height': entry.get('height'),
+                'taken': entry.get('taken'),
+                'camera': entry.get('camera'),
+                'rating': entry.get('rating', 0),
+                'rating_count': entry.get('rating_count', 0),
+                'comment_count': entry.get('comment_count', 0)
+            })
+        
+        print(f"Returning {len(pictures)} of {len(manifest['pictures'])} pictures")
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({
+                'pictures': pictures,
+                'count': len(pictures),
+                'total': len(manifest['pictures']),
+                'next_cursor': next_cursor
+            })
+        }
+        
+    except Exception as e:
+        print(f"Error getting pictures: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to get pictures: {str(e)}'})
+        }
+
+def duplicate_summary(entry):
+    """Listing fields of a picture in the near-duplicate report"""
+    url = presign_get_url(entry['key'])
+    thumb_url = presign_get_url(derivative_key(entry['key'], 'thumb')) if 'thumb' in entry.get('derivatives', ()) else url
+    return {
+        'id': entry['key'][len(PICTURES_PREFIX):],
+        'name': entry['name'],
+        'date': entry['date'],
+        'url': url,
+        'thumb_url': thumb_url,
+        'size': entry.get('size', 0),
+        'width': entry.get('width'),
+        'height': entry.get('height')
+    }
+
+def get_duplicates(event):
+    """Report near-duplicate pictures, for one picture or across the gallery"""
+    try:
+        query_params = event.get('queryStringParameters') or {}
+        try:
+            max_distance = int(query_params.get('distance', NEAR_DUPLICATE_DISTANCE))
+            if not 0 <= max_distance <= MAX_DUPLICATE_DISTANCE:
+                raise ValueError(f'distance must be between 0 and {MAX_DUPLICATE_DISTANCE}')
+        except (ValueError, TypeError) as e:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': f'Invalid duplicate parameters: {str(e)}'})
+            }
+        
+        manifest = load_manifest()
+        index = load_phash_index()
+        
+        picture_name = query_params.get('picture')
+        if picture_name:
+            key = find_picture_key(manifest, picture_name)
+            entry = manifest['pictures'].get(key) if key else None
+            if not entry:
+                return {
+                    'statusCode': 404,
+                    'headers': get_cors_headers(),
+                    'body': json.dumps({'error': 'Picture not found'})
+                }
+            if not entry.get('phash'):
+                return {
+                    'statusCode': 409,
+                    'headers': get_cors_headers(),
+                    'body': json.dumps({'error': 'Picture has not been fingerprinted yet'})
+                }
+            
+            matches = find_near_duplicates(index, manifest, entry, max_distance)
+            return {
+                'statusCode': 200,
+                'headers': get_cors_headers(),
+                'body': json.dumps({
+                    'picture': duplicate_summary(entry),
+                    'distance': max_distance,
+                    'duplicates': [dict(duplicate_summary(match), distance=distance) for match, distance in matches]
+                })
+            }
+        
+        groups = []
+        for group in group_near_duplicates(index, manifest, max_distance):
+            # The largest, then earliest, copy is the one to keep
+            group.sort(key=lambda entry: (-(entry.get('width') or 0) * (entry.get('height') or 0),
+                                          -entry.get('size', 0), entry['date'], entry['key']))
+            groups.append([duplicate_summary(entry) for entry in group])
+        groups.sort(key=lambda group: (-len(group), group[0]['id']))
+        
+        print(f"Found {len(groups)} near-duplicate groups within distance {max_distance}")
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({
+                'distance': max_distance,
+                'groups': groups,
+                'group_count': len(groups),
+                'duplicate_count': sum(len(group) - 1 for group in groups)
+            })
+        }
+        
+    except Exception as e:
+        print(f"Error finding duplicates: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to find duplicates: {str(e)}'})
+        }
+
+def get_stats():
+    """Get gallery statistics from the incrementally maintained stats document"""
+    try:
+        print(f"Getting stats from bucket: {PICTURES_BUCKET}")
+        
+        stats = load_stats()
+        
+        print(f"Stats: {stats['total_pictures']} pictures, {stats['total_storage']} bytes")
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({
+                'totalPictures': stats['total_pictures'],
+                'totalStorage': stats['total_storage'],
+                'contentTypes': stats['content_types'],
+                'uploadsPerDay': stats['uploads_per_day'],
+                'updated': stats.get('updated'),
+                'reconciled': stats.get('reconciled')
+            })
+        }
+        
+    except Exception as e:
+        print(f"Error getting stats: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to get stats: {str(e)}'})
+        }
+
+def get_resized_picture(event, picture_id):
+    """Serve a picture scaled to fit the requested size, from cache when possible"""
+    try:
+        query_params = event.get('queryStringParameters') or {}
+        fmt = (query_params.get('fmt') or 'jpeg').lower()
+        fmt = 'jpeg' if fmt == 'jpg' else fmt
+        try:
+            width = int(query_params['w']) if query_params.get('w') else None
+            height = int(query_params['h']) if query_params.get('h') else None
+            if not width and not height:
+                raise ValueError('w or h is required')
+            for value in (width, height):
+                if value is not None and not 0 < value <= RESIZE_MAX_DIMENSION:
+                    raise ValueError(f'sizes must be between 1 and {RESIZE_MAX_DIMENSION}')
+            if fmt not in RESIZE_FORMATS:
+                raise ValueError(f"fmt must be one of {', '.join(RESIZE_FORMATS)}")
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': f'Invalid resize parameters: {str(e)}'})
+            }
+        
+        # Round up so nearby sizes share one cached transform
+        width, height = (
+            min(-(-value // RESIZE_STEP) * RESIZE_STEP, RESIZE_MAX_DIMENSION) if value else None
+            for value in (width, height)
+        )
+        try:
+            source_etag = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=PICTURES_PREFIX + picture_id)['ETag']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                raise
+            return {
+                'statusCode': 404,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'Picture not found'})
+            }
+        cache_key = resized_cache_key(picture_id, source_etag, width, height, fmt)
+        
+        source = 'memory'
+        data = resize_cache_get(cache_key)
+        if data is None:
+            source = 's3'
+            try:
+                data = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=cache_key)['Body'].read()
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                    raise
+        if data is None:
+            source = 'miss'
+            try:
+                original = s3_client.get_object(Bucket=PICTURES_BUCKET, Key=PICTURES_PREFIX + picture_id,
+                                                IfMatch=source_etag)
+            except ClientError as e:
+                # Deleted or replaced since the HEAD
+                if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404', 'PreconditionFailed'):
+                    raise
+                return {
+                    'statusCode': 404,
+                    'headers': get_cors_headers(),
+                    'body': json.dumps({'error': 'Picture not found'})
+                }
+            data = render_resized(original['Body'].read(), width, height, fmt)
+            s3_client.put_object(
+                Bucket=PICTURES_BUCKET,
+                Key=cache_key,
+                Body=data,
+                ContentType=RESIZE_FORMATS[fmt][1]
+            )
+        if source != 'memory':
+            resize_cache_put(cache_key, data)
+        
+        if len(data) > DOWNLOAD_INLINE_LIMIT:
+            # Too large for a Lambda response; the S3 copy is cacheable too
+            return {
+                'statusCode': 302,
+                'headers': {**get_cors_headers(), 'Location': presign_get_url(cache_key)},
+                'body': ''
+            }
+        
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        headers = {
+            'Content-Type': RESIZE_FORMATS[fmt][1],
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL,
+            'ETag': etag,
+            'X-Cache': source,
+            'Access-Control-Allow-Origin': '*'
+        }
+        request_headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+        if etag_matches(request_headers.get('if-none-match'), etag):
+            return {'statusCode': 304, 'headers': headers, 'body': ''}
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': base64.b64encode(data).decode('ascii'),
+            'isBase64Encoded': True
+        }
+        
+    except Exception as e:
+        print(f"Error resizing picture {picture_id}: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to resize picture: {str(e)}'})
+        }
+
+def delete_pictures(event):
+    """Delete multiple pictures from S3"""
+    try:
+        # Parse the request body
+        body = event.get('body', '')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        
+        if not body:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'No request body provided'})
+            }
+        
+        data = json.loads(body)
+        picture_names = data.get('pictures', [])
+        picture_ids = data.get('ids', [])
+        
+        if not picture_names and not picture_ids:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'No pictures specified for deletion'})
+            }
+        
+        print(f"Deleting {len(picture_names) + len(picture_ids)} pictures")
+        
+        # Resolve names to S3 keys through the manifest name index
+        manifest = load_manifest()
+        keys_by_name = {}
+        not_found = []
+        
+        for picture_name in picture_names:
+            key = find_picture_key(manifest, picture_name, fuzzy=True)
+            if key:
+                keys_by_name[picture_name] = key
+            else:
+                not_found.append(picture_name)
+        
+        # Ids name exactly one picture, where several may share a name
+        for picture_id in picture_ids:
+            key = find_picture_key_by_id(manifest, picture_id)
+            if key:
+                keys_by_name[picture_id] = key
+            else:
+                not_found.append(picture_id)
+        
+        if not keys_by_name:
+            return {
+                'statusCode': 404,
+                'headers': get_cors_headers(),
+                'body': json.dumps({
+                    'error': 'No matching pictures found for deletion',
+                    'not_found': not_found
+                })
+            }
+        
+        # Pictures and their artifacts go out in the same set of batches
+        picture_keys = list(dict.fromkeys(keys_by_name.values()))
+        derived_keys = derived_object_keys(picture_keys, manifest)
+        outcomes = delete_keys(picture_keys + derived_keys)
+        
+        deleted_keys = [key for key in picture_keys if outcomes[key] is None]
+        errors = [{'Key': key, 'Message': outcomes[key]} for key in picture_keys if outcomes[key] is not None]
+        derived_errors = sum(1 for key in derived_keys if outcomes[key] is not None)
+        
+        print(f"Successfully deleted {len(deleted_keys)} pictures and {len(derived_keys) - derived_errors} derived objects")
+        deleted_entries = [manifest['pictures'][key] for key in deleted_keys if key in manifest['pictures']]
+        forget_object_metadata(*deleted_keys)
+        remove_manifest_entries(deleted_keys, manifest=manifest)
+        update_stats(removed=deleted_entries)
+        update_phash_index(removed=deleted_entries)
+        if errors or derived_errors:
+            print(f"Errors during deletion: {errors}, {derived_errors} derived objects left behind")
+        
+        results = []
+        for picture_name in picture_names + picture_ids:
+            key = keys_by_name.get(picture_name)
+            if key is None:
+                results.append({'picture': picture_name, 'status': 'not_found'})
+            elif outcomes[key] is None:
+                results.append({'picture': picture_name, 'key': key, 'status': 'deleted'})
+            else:
+                results.append({'picture': picture_name, 'key': key, 'status': 'error', 'error': outcomes[key]})
+        
+        result = {
+            'deleted_count': len(deleted_keys),
+            'requested_count': len(picture_names) + len(picture_ids),
+            'derived_deleted_count': len(derived_keys) - derived_errors,
+            'results': results
+        }
+        
+        if not_found:
+            result['not_found'] = not_found
+        
+        if errors:
+            result['errors'] = errors
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps(result)
+        }
+        
+    except Exception as e:
+        print(f"Error deleting pictures: {str(e)}")
+        import traceback
         print(f"Traceback: {traceback.format_exc()}")
         return {
             'statusCode': 500,
@@ -1747,7 +4238,7 @@ def delete_pictures(event):
         }
 
 def rate_picture(event):
-    """Rate a picture by updating S3 object metadata"""
+    """Record a vote for a picture as its own object"""
     try:
         # Parse the request body
         body = event.get('body', '')
@@ -1762,14 +4253,15 @@ def rate_picture(event):
             }
         
         data = json.loads(body)
-        picture_name = data.get('picture', '')
+        picture_id = data.get('id')
+        picture_name = picture_id or data.get('picture', '')
         rating = data.get('rating', 0)
         
         if not picture_name:
             return {
                 'statusCode': 400,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Picture name is required'})
+                'body': json.dumps({'error': 'Picture id or name is required'})
             }
         
         if not isinstance(rating, int) or rating < 1 or rating > 5:
@@ -1781,74 +4273,36 @@ def rate_picture(event):
         
         print(f"Rating picture '{picture_name}' with {rating} stars")
         
-        # Find the S3 object for this picture using metadata
-        response = s3_client.list_objects_v2(
-            Bucket=PICTURES_BUCKET,
-            Prefix='pictures/'
-        )
+        # Find the S3 object for this picture by id, or through the manifest name index
+        manifest = load_manifest()
+        if picture_id:
+            s3_key = find_picture_key_by_id(manifest, picture_id)
+        else:
+            s3_key = find_picture_key(manifest, picture_name, fuzzy=True)
+        head_response = head_picture(s3_key, manifest) if s3_key else None
         
-        s3_key = None
-        if 'Contents' in response:
-            print(f"Found {len(response['Contents'])} objects in S3 for rating")
-            for obj in response['Contents']:
-                key = obj['Key']
-                try:
-                    # Get object metadata to find original name
-                    head_response = s3_client.head_object(
-                        Bucket=PICTURES_BUCKET,
-                        Key=key
-                    )
-                    metadata = head_response.get('Metadata', {})
-                    original_name = metadata.get('original-name', key.split('/')[-1])
-                    print(f"Checking S3 object: {key} -> original_name: '{original_name}'")
-                    
-                    # Match by original name from metadata
-                    if (original_name == picture_name or 
-                        picture_name.lower() in original_name.lower() or
-                        original_name.lower() in picture_name.lower()):
-                        s3_key = key
-                        print(f"Found match for rating: '{picture_name}' -> {key}")
-                        break
-                        
-                except Exception as meta_error:
-                    print(f"Error getting metadata for {key}: {meta_error}")
-                    # Fallback to filename matching
-                    filename = key.split('/')[-1]
-                    if picture_name.lower() in filename.lower():
-                        s3_key = key
-                        print(f"Found fallback match for rating: '{picture_name}' -> {key}")
-                        break
-        
-        if not s3_key:
+        if not head_response:
             return {
                 'statusCode': 404,
-                'headers': get_cors_headers(),
-                'body': json.dumps({'error': f'Picture "{picture_name}" not found'})
-            }
-        
-        # Get current object metadata
-        head_response = s3_client.head_object(
-            Bucket=PICTURES_BUCKET,
-            Key=s3_key
-        )
-        
-        # Update metadata with rating
-        current_metadata = head_response.get('Metadata', {})
-        current_metadata['rating'] = str(rating)
-        current_metadata['original-name'] = picture_name
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': f'Picture "{picture_name}" not found'})
+            }
         
-        # Copy object with new metadata (S3 doesn't allow direct metadata updates)
-        copy_source = {'Bucket': PICTURES_BUCKET, 'Key': s3_key}
-        s3_client.copy_object(
-            CopySource=copy_source,
-            Bucket=PICTURES_BUCKET,
-            Key=s3_key,
-            Metadata=current_metadata,
-            MetadataDirective='REPLACE',
-            ContentType=head_response.get('ContentType', 'image/jpeg')
-        )
+        record_vote(s3_key, rating)
         
-        print(f"Successfully rated picture {picture_name} with {rating} stars")
+        print(f"Recorded {rating} star vote for {picture_name}")
+        # The vote object is the record; the manifest counters are updated
+        # under If-Match so concurrent votes are all added
+        entry = add_to_manifest_counters(s3_key, votes=1, stars=rating)
+        if entry is not None:
+            summary = rating_summary(entry['rating_count'], entry['rating_sum'])
+        else:
+            # The manifest could not be updated; answer with a live tally
+            legacy_rating = head_response.get('Metadata', {}).get('rating')
+            count, total = tally_ratings(rating_prefix(s3_key)).get(s3_key, (0, 0))
+            if legacy_rating:
+                count, total = count + 1, total + int(legacy_rating)
+            summary = rating_summary(count, total)
         
         return {
             'statusCode': 200,
@@ -1856,7 +4310,9 @@ def rate_picture(event):
             'body': json.dumps({
                 'success': True,
                 'picture': picture_name,
-                'rating': rating
+                'vote': rating,
+                'rating': summary['rating'],
+                'rating_count': summary['rating_count']
             })
         }
         
@@ -1872,7 +4328,7 @@ def rate_picture(event):
 
 
 def add_comment(event):
-    """Add a comment to a picture by updating S3 object metadata"""
+    """Add a comment to a picture by appending to its comment log"""
     try:
         # Parse the request body
         body = event.get('body', '')
@@ -1880,7 +4336,8 @@ def add_comment(event):
             body = base64.b64decode(body).decode('utf-8')
         
         data = json.loads(body)
-        picture_name = data.get('picture')
+        picture_id = data.get('id')
+        picture_name = picture_id or data.get('picture')
         author = data.get('author')
         comment_text = data.get('text')
         
@@ -1888,36 +4345,17 @@ def add_comment(event):
             return {
                 'statusCode': 400,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'Missing required fields: picture, author, text'})
+                'body': json.dumps({'error': 'Missing required fields: id or picture, author, text'})
             }
         
         print(f"Adding comment to picture: {picture_name}")
         
-        # Find the S3 object key for this picture
-        response = s3_client.list_objects_v2(
-            Bucket=PICTURES_BUCKET,
-            Prefix='pictures/'
-        )
-        
-        target_key = None
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                if obj['Key'].lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                    # Get metadata to check original name
-                    try:
-                        head_response = s3_client.head_object(
-                            Bucket=PICTURES_BUCKET,
-                            Key=obj['Key']
-                        )
-                        metadata = head_response.get('Metadata', {})
-                        original_name = metadata.get('original-name', obj['Key'].split('/')[-1])
-                        
-                        if original_name == picture_name:
-                            target_key = obj['Key']
-                            break
-                    except Exception as e:
-                        print(f"Error checking metadata for {obj['Key']}: {e}")
-                        continue
+        # Find the S3 object key for this picture by id, or through the manifest name index
+        manifest = load_manifest()
+        if picture_id:
+            target_key = find_picture_key_by_id(manifest, picture_id)
+        else:
+            target_key = find_picture_key(manifest, picture_name)
         
         if not target_key:
             return {
@@ -1926,52 +4364,36 @@ def add_comment(event):
                 'body': json.dumps({'error': f'Picture not found: {picture_name}'})
             }
         
-        # Get current metadata
-        head_response = s3_client.head_object(
-            Bucket=PICTURES_BUCKET,
-            Key=target_key
-        )
-        current_metadata = head_response.get('Metadata', {})
-        
-        # Parse existing comments
-        existing_comments = []
-        comments_json = current_metadata.get('comments', '')
-        if comments_json:
-            try:
-                existing_comments = json.loads(comments_json)
-            except json.JSONDecodeError as e:
-                print(f"Error parsing existing comments: {e}")
-                existing_comments = []
-        
-        # Add new comment
         new_comment = {
             'author': author,
             'text': comment_text,
             'date': datetime.now().isoformat()
         }
-        existing_comments.append(new_comment)
-        
-        # Update metadata with new comments
-        updated_metadata = current_metadata.copy()
-        updated_metadata['comments'] = json.dumps(existing_comments)
-        
-        # Copy object with updated metadata
-        s3_client.copy_object(
-            Bucket=PICTURES_BUCKET,
-            CopySource={'Bucket': PICTURES_BUCKET, 'Key': target_key},
-            Key=target_key,
-            Metadata=updated_metadata,
-            MetadataDirective='REPLACE'
-        )
+        append_comment(target_key, new_comment)
         
         print(f"Comment added successfully to {picture_name}")
+        # The count is added under If-Match, so concurrent comments are all counted
+        entry = add_to_manifest_counters(target_key, comments=1)
+        if entry is not None:
+            comment_count = entry['comment_count']
+        else:
+            snapshot = load_comment_snapshot(target_key)
+            comment_count = snapshot['count'] + len(pending_comment_log(snapshot, list_comment_log(target_key)))
+        
+        if comment_count % COMMENT_COMPACT_THRESHOLD == 0:
+            try:
+                compact_comment_thread(target_key)
+            except Exception as e:
+                # The log is still complete; the next threshold retries
+                print(f"Error compacting comments for {target_key}: {e}")
         
         return {
             'statusCode': 200,
             'headers': get_cors_headers(),
             'body': json.dumps({
                 'message': 'Comment added successfully',
-                'comment': new_comment
+                'comment': new_comment,
+                'comment_count': comment_count
             })
         }
         
@@ -1985,11 +4407,57 @@ def add_comment(event):
             'body': json.dumps({'error': f'Failed to add comment: {str(e)}'})
         }
 
+def get_comments(event):
+    """Get the comment thread of a single picture"""
+    try:
+        query_params = event.get('queryStringParameters') or {}
+        picture_id = query_params.get('id')
+        picture_name = picture_id or query_params.get('picture')
+        
+        if not picture_name:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'Missing required parameter: id or picture'})
+            }
+        
+        manifest = load_manifest()
+        if picture_id:
+            target_key = find_picture_key_by_id(manifest, picture_id)
+        else:
+            target_key = find_picture_key(manifest, picture_name)
+        
+        if not target_key:
+            return {
+                'statusCode': 404,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': f'Picture not found: {picture_name}'})
+            }
+        
+        comments = load_comment_thread(target_key)
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({
+                'picture': picture_name,
+                'comments': comments,
+                'count': len(comments)
+            })
+        }
+        
+    except Exception as e:
+        print(f"Error getting comments: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to get comments: {str(e)}'})
+        }
+
 def download_pictures(event):
-    """Create and return a ZIP file containing selected pictures"""
-    import zipfile
-    import io
-    
+    """Create a ZIP file containing selected pictures, streamed to S3 when large"""
     try:
         # Parse the request body
         body = event.get('body', '')
@@ -1998,99 +4466,102 @@ def download_pictures(event):
         
         data = json.loads(body)
         picture_names = data.get('pictures', [])
+        picture_ids = data.get('ids', [])
         
-        if not picture_names:
+        if not picture_names and not picture_ids:
             return {
                 'statusCode': 400,
                 'headers': get_cors_headers(),
                 'body': json.dumps({'error': 'No pictures specified for download'})
             }
         
-        print(f"Creating ZIP for {len(picture_names)} pictures: {picture_names}")
+        print(f"Creating ZIP for {len(picture_names) + len(picture_ids)} pictures")
         
-        # Create ZIP file in memory
-        zip_buffer = io.BytesIO()
+        # Resolve every requested name and id with a single manifest read
+        manifest = load_manifest()
+        selection = []
+        for picture_name in picture_names:
+            target_key = find_picture_key(manifest, picture_name)
+            if target_key:
+                selection.append((picture_name, target_key))
+            else:
+                print(f"Picture not found: {picture_name}")
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Get list of all objects in S3
-            response = s3_client.list_objects_v2(
-                Bucket=PICTURES_BUCKET,
-                Prefix='pictures/'
-            )
-            
-            if 'Contents' not in response:
-                return {
-                    'statusCode': 404,
-                    'headers': get_cors_headers(),
-                    'body': json.dumps({'error': 'No pictures found'})
-                }
-            
-            found_pictures = 0
-            for picture_name in picture_names:
-                # Find the S3 key for this picture name
-                target_key = None
-                for obj in response['Contents']:
-                    if obj['Key'].lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                        try:
-                            # Get metadata to check original name
-                            head_response = s3_client.head_object(
-                                Bucket=PICTURES_BUCKET,
-                                Key=obj['Key']
-                            )
-                            metadata = head_response.get('Metadata', {})
-                            original_name = metadata.get('original-name', obj['Key'].split('/')[-1])
-                            
-                            if original_name == picture_name:
-                                target_key = obj['Key']
-                                break
-                        except Exception as e:
-                            print(f"Error checking metadata for {obj['Key']}: {e}")
-                            continue
-                
-                if target_key:
-                    try:
-                        # Download the picture from S3
-                        print(f"Downloading {target_key} for {picture_name}")
-                        obj_response = s3_client.get_object(
-                            Bucket=PICTURES_BUCKET,
-                            Key=target_key
-                        )
-                        
-                        # Add to ZIP file with original name
-                        zip_file.writestr(picture_name, obj_response['Body'].read())
-                        found_pictures += 1
-                        print(f"Added {picture_name} to ZIP")
-                        
-                    except Exception as e:
-                        print(f"Error downloading {target_key}: {e}")
-                        continue
-                else:
-                    print(f"Picture not found: {picture_name}")
+        # Ids name exactly one picture, where several may share a name
+        for picture_id in picture_ids:
+            target_key = find_picture_key_by_id(manifest, picture_id)
+            if target_key:
+                selection.append((manifest['pictures'][target_key]['name'], target_key))
+            else:
+                print(f"Picture not found: {picture_id}")
+        selection = unique_archive_names(selection)
+        
+        not_found_response = {
+            'statusCode': 404,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': 'None of the requested pictures were found'})
+        }
+        if not selection:
+            return not_found_response
         
-        if found_pictures == 0:
+        filename = f"photos_{datetime.now().strftime('%Y%m%d')}.zip"
+        archive_size = sum(manifest['pictures'][key].get('size', 0) for _, key in selection)
+        
+        if archive_size > DOWNLOAD_INLINE_LIMIT:
+            # Too large for a Lambda response: stream into S3 and hand out a link
+            archive_key = f"{DOWNLOADS_PREFIX}{uuid.uuid4().hex}/{filename}"
+            writer = S3MultipartWriter(archive_key, content_type='application/zip')
+            try:
+                found_pictures = write_zip_entries(writer, selection)
+            except Exception:
+                writer.abort()
+                raise
+            if found_pictures == 0:
+                writer.abort()
+                return not_found_response
+            writer.close()
+            
+            print(f"Streamed ZIP with {found_pictures} pictures to {archive_key}, size: {writer.position} bytes")
+            url = s3_client.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': PICTURES_BUCKET,
+                    'Key': archive_key,
+                    'ResponseContentDisposition': f'attachment; filename="{filename}"'
+                },
+                ExpiresIn=DOWNLOAD_URL_EXPIRY
+            )
             return {
-                'statusCode': 404,
+                'statusCode': 200,
                 'headers': get_cors_headers(),
-                'body': json.dumps({'error': 'None of the requested pictures were found'})
+                'body': json.dumps({
+                    'url': url,
+                    'filename': filename,
+                    'count': found_pictures,
+                    'size': writer.position,
+                    'expires_in': DOWNLOAD_URL_EXPIRY
+                })
             }
         
-        # Get ZIP data
-        zip_buffer.seek(0)
-        zip_data = zip_buffer.getvalue()
+        zip_buffer = io.BytesIO()
+        found_pictures = write_zip_entries(zip_buffer, selection)
+        
+        if found_pictures == 0:
+            return not_found_response
         
-        print(f"Created ZIP file with {found_pictures} pictures, size: {len(zip_data)} bytes")
+        print(f"Created ZIP file with {found_pictures} pictures, size: {zip_buffer.tell()} bytes")
         
-        # Return ZIP file as binary response
+        # Return ZIP file as binary response, encoded straight from the buffer
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/zip',
-                'Content-Disposition': f'attachment; filename="photos_{datetime.now().strftime("%Y%m%d")}.zip"',
+                'Content-Disposition': f'attachment; filename="{filename}"',
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, Authorization'
             },
-            'body': base64.b64encode(zip_data).decode('utf-8'),
+            'body': base64.b64encode(zip_buffer.getbuffer()).decode('ascii'),
             'isBase64Encoded': True
         }
         
@@ -2132,10 +4603,13 @@ def upload_picture(event):
         # Use original image data (no processing to avoid PIL dependency)
         processed_image_bytes = image_bytes
         
-        # Generate unique filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        file_extension = picture_name.split('.')[-1] if '.' in picture_name else 'jpg'
-        s3_key = f"pictures/{timestamp}_{uuid.uuid4().hex[:8]}.{file_extension}"
+        # Known content is not stored again
+        sha256 = hashlib.sha256(processed_image_bytes).hexdigest()
+        existing = find_content_key(load_manifest(), sha256)
+        if existing:
+            return duplicate_upload_response(existing)
+        
+        s3_key = content_picture_key(sha256, picture_name, content_type)
         
         # Upload to S3
         s3_client.put_object(
@@ -2152,6 +4626,8 @@ def upload_picture(event):
         
         # Store metadata in Iceberg table (simplified - just log for now)
         print(f"Picture uploaded: {s3_key}, original: {picture_name}")
+        register_picture(s3_key, picture_name, len(processed_image_bytes), content_type,
+                         image_bytes=processed_image_bytes)
         
         return {
             'statusCode': 200,
@@ -2170,3 +4646,381 @@ def upload_picture(event):
             'headers': get_cors_headers(),
             'body': json.dumps({'error': f'Failed to upload picture: {str(e)}'})
         }
+
+def duplicate_upload_response(key):
+    """Answer an upload of content the gallery already stores"""
+    entry = load_manifest()['pictures'].get(key, {})
+    print(f"Upload matches existing picture {key}")
+    return {
+        'statusCode': 200,
+        'headers': get_cors_headers(),
+        'body': json.dumps({
+            'message': 'Picture already in the gallery',
+            'key': key,
+            'original_name': entry.get('name', key.split('/')[-1]),
+            'duplicate': True
+        })
+    }
+
+def check_uploads(event):
+    """Report which content hashes the gallery already stores"""
+    try:
+        body = event.get('body', '')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        
+        data = json.loads(body)
+        hashes = data.get('hashes')
+        
+        if not isinstance(hashes, list) or len(hashes) > HASH_CHECK_LIMIT:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': f'Between 0 and {HASH_CHECK_LIMIT} hashes are required'})
+            }
+        
+        manifest = load_manifest()
+        existing = {}
+        for value in hashes:
+            sha256 = normalize_content_hash(value)
+            key = sha256 and find_content_key(manifest, sha256)
+            if key:
+                existing[value] = {'key': key, 'name': manifest['pictures'][key]['name']}
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'existing': existing})
+        }
+        
+    except Exception as e:
+        print(f"Error checking uploads: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to check uploads: {str(e)}'})
+        }
+
+def create_upload(event):
+    """Start a direct-to-S3 upload and return its presigned URLs"""
+    try:
+        body = event.get('body', '')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        
+        data = json.loads(body)
+        picture_name = data.get('name') or f'picture_{uuid.uuid4().hex[:8]}.jpg'
+        content_type = data.get('contentType') or 'image/jpeg'
+        size = data.get('size')
+        
+        if not isinstance(size, int) or size <= 0:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'A positive file size is required'})
+            }
+        
+        sha256 = normalize_content_hash(data.get('sha256'))
+        if data.get('sha256') is not None and not sha256:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'sha256 must be a hex SHA-256 digest'})
+            }
+        
+        if sha256:
+            existing = find_content_key(load_manifest(), sha256)
+            if existing:
+                return duplicate_upload_response(existing)
+            s3_key = content_picture_key(sha256, picture_name, content_type)
+        else:
+            # Clients that do not hash their files get a unique key as before
+            s3_key = new_picture_key(picture_name, content_type)
+        metadata = {'upload_date': datetime.now().isoformat()}
+        if picture_name.isascii():
+            # Metadata travels as HTTP headers, which browsers restrict to ASCII here
+            metadata['original-name'] = picture_name
+        part_size = upload_part_size(size)
+        
+        if size <= part_size:
+            params = {
+                'Bucket': PICTURES_BUCKET,
+                'Key': s3_key,
+                'ContentType': content_type,
+                'Metadata': metadata
+            }
+            # The browser must send exactly the headers that were signed
+            headers = {'Content-Type': content_type}
+            headers.update({f'x-amz-meta-{name}': value for name, value in metadata.items()})
+            if sha256:
+                # S3 rejects a body whose digest differs from the signed one
+                params['ChecksumSHA256'] = base64.b64encode(bytes.fromhex(sha256)).decode('ascii')
+                headers['x-amz-checksum-sha256'] = params['ChecksumSHA256']
+            url = s3_client.generate_presigned_url('put_object', Params=params, ExpiresIn=UPLOAD_URL_EXPIRY)
+            session = {'key': s3_key, 'method': 'PUT', 'url': url, 'headers': headers}
+        else:
+            metadata['original-name'] = picture_name
+            if sha256:
+                # Multipart uploads carry no whole-object checksum, so the parts are
+                # assembled aside and only reach the content key once hashed
+                s3_key = staging_upload_key(s3_key)
+            upload_id = s3_client.create_multipart_upload(
+                Bucket=PICTURES_BUCKET,
+                Key=s3_key,
+                ContentType=content_type,
+                Metadata=metadata
+            )['UploadId']
+            parts = presign_upload_parts(s3_key, upload_id, range(1, -(-size // part_size) + 1))
+            session = {'key': s3_key, 'uploadId': upload_id, 'partSize': part_size, 'parts': parts}
+        
+        print(f"Started upload session for {picture_name}: {s3_key}, {size} bytes")
+        session['expires_in'] = UPLOAD_URL_EXPIRY
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps(session)
+        }
+        
+    except Exception as e:
+        print(f"Error starting upload: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to start upload: {str(e)}'})
+        }
+
+def complete_upload(event):
+    """Finish a direct-to-S3 upload and register the stored picture"""
+    try:
+        body = event.get('body', '')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        
+        data = json.loads(body)
+        s3_key = data.get('key', '')
+        upload_id = data.get('uploadId')
+        
+        if not s3_key.startswith(PICTURES_PREFIX) and not content_key_of_staging_key(s3_key):
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'Invalid upload key'})
+            }
+        
+        if upload_id and content_hash_of_key(s3_key):
+            # Sessions started before uploads were staged would complete unchecked
+            # onto the content key, possibly over an existing picture
+            return {
+                'statusCode': 409,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'Upload session expired; start the upload again'})
+            }
+        
+        if upload_id:
+            try:
+                # A resumed client may not know every part's ETag, but S3 does
+                parts = sorted(
+                    ({'PartNumber': int(part['PartNumber']), 'ETag': part['ETag']}
+                     for part in data.get('parts') or list_upload_parts(s3_key, upload_id)),
+                    key=lambda part: part['PartNumber']
+                )
+                s3_client.complete_multipart_upload(
+                    Bucket=PICTURES_BUCKET,
+                    Key=s3_key,
+                    UploadId=upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                    raise
+                # A retried request whose first attempt completed the upload;
+                # whether the object exists is checked below
+                print(f"Upload {upload_id} for {s3_key} is no longer in progress")
+        
+        # Register what S3 stored rather than what the client claims
+        content_key = content_key_of_staging_key(s3_key)
+        try:
+            head_response = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=s3_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                raise
+            head_response = None
+        
+        if head_response is None and content_key:
+            # An earlier attempt may already have verified and moved the staged upload
+            try:
+                head_response = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=content_key)
+                s3_key, content_key = content_key, None
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                    raise
+        
+        if head_response is None:
+            return {
+                'statusCode': 404,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'Uploaded picture not found'})
+            }
+        
+        if content_key:
+            # Hash what arrived; only matching bytes are copied to the content key
+            if hash_stored_object(s3_key) != content_hash_of_key(content_key):
+                s3_client.delete_object(Bucket=PICTURES_BUCKET, Key=s3_key)
+                return {
+                    'statusCode': 400,
+                    'headers': get_cors_headers(),
+                    'body': json.dumps({'error': 'Uploaded content does not match its hash'})
+                }
+            try:
+                head_response = s3_client.head_object(Bucket=PICTURES_BUCKET, Key=content_key)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                    raise
+                promote_staged_upload(s3_key, content_key, head_response)
+            s3_client.delete_object(Bucket=PICTURES_BUCKET, Key=s3_key)
+            s3_key = content_key
+        
+        picture_name = (data.get('name')
+                        or head_response.get('Metadata', {}).get('original-name')
+                        or s3_key.split('/')[-1])
+        entry = register_picture(
+            s3_key,
+            picture_name,
+            head_response.get('ContentLength', 0),
+            head_response.get('ContentType', 'image/jpeg')
+        )
+        picture_name = entry['name']
+        print(f"Picture uploaded: {s3_key}, original: {picture_name}")
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({
+                'message': 'Picture uploaded successfully',
+                'key': s3_key,
+                'original_name': picture_name
+            })
+        }
+        
+    except Exception as e:
+        print(f"Error completing upload: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to complete upload: {str(e)}'})
+        }
+
+def resume_upload(event):
+    """Report the confirmed parts of a multipart upload and re-sign the missing ones"""
+    try:
+        body = event.get('body', '')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        
+        data = json.loads(body)
+        s3_key = data.get('key', '')
+        upload_id = data.get('uploadId')
+        size = data.get('size')
+        part_size = data.get('partSize')
+        
+        if (not (s3_key.startswith(PICTURES_PREFIX) or content_key_of_staging_key(s3_key)) or not upload_id
+                or not isinstance(size, int) or not isinstance(part_size, int)
+                or size <= 0 or part_size < MULTIPART_MIN_PART_SIZE):
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'An upload key, id, size and part size are required'})
+            }
+        
+        if content_hash_of_key(s3_key):
+            # Started before uploads were staged; completion would refuse it
+            return {
+                'statusCode': 404,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'Upload session not found'})
+            }
+        
+        try:
+            confirmed = list_upload_parts(s3_key, upload_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+            # Completed, aborted or expired: the client has to start over
+            return {
+                'statusCode': 404,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'Upload session not found'})
+            }
+        
+        # A part only counts if it arrived whole; short parts are sent again
+        part_count = -(-size // part_size)
+        expected = {
+            number: part_size if number < part_count else size - part_size * (part_count - 1)
+            for number in range(1, part_count + 1)
+        }
+        completed = [
+            {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+            for part in confirmed
+            if expected.get(part['PartNumber']) == part.get('Size')
+        ]
+        done = {part['PartNumber'] for part in completed}
+        missing = [number for number in expected if number not in done]
+        print(f"Resuming upload {s3_key}: {len(completed)} of {part_count} parts confirmed")
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({
+                'key': s3_key,
+                'uploadId': upload_id,
+                'partSize': part_size,
+                'completed': completed,
+                'parts': presign_upload_parts(s3_key, upload_id, missing),
+                'expires_in': UPLOAD_URL_EXPIRY
+            })
+        }
+        
+    except Exception as e:
+        print(f"Error resuming upload: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to resume upload: {str(e)}'})
+        }
+
+def abort_upload(event):
+    """Abandon a multipart upload and discard its parts"""
+    try:
+        body = event.get('body', '')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        
+        data = json.loads(body)
+        s3_key = data.get('key', '')
+        upload_id = data.get('uploadId')
+        
+        if not (s3_key.startswith(PICTURES_PREFIX) or content_key_of_staging_key(s3_key)) or not upload_id:
+            return {
+                'statusCode': 400,
+                'headers': get_cors_headers(),
+                'body': json.dumps({'error': 'An upload key and id are required'})
+            }
+        
+        s3_client.abort_multipart_upload(Bucket=PICTURES_BUCKET, Key=s3_key, UploadId=upload_id)
+        
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'message': 'Upload aborted', 'key': s3_key})
+        }
+        
+    except Exception as e:
+        print(f"Error aborting upload: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': get_cors_headers(),
+            'body': json.dumps({'error': f'Failed to abort upload: {str(e)}'})
+        }
+
+# Rendered once per container; see Static assets above
+_static_assets = build_static_assets()